@@ -1,2 +1,2 @@
 #!/bin/bash
-restic $HOST -r $URI backup --tag files --exclude sessions --exclude __pychache__ --exclude "*.bak" ./
+restic $HOST -r $URI backup $RESTIC_BACKUP_ARGS --tag files --exclude sessions --exclude __pychache__ --exclude "*.bak" ./
@@ -1,4 +1,5 @@
 #!/bin/bash
 # recover the backup from the files snapshot and save it in ./
 
-restic $HOST -r $URI restore $SNAPSHOT --tag files --target ./ --exclude .git
+# $INCLUDE limits the restore to the paths given with `restic.restore --include ...` (empty: everything)
+restic $HOST -r $URI restore $SNAPSHOT --tag files --target ./ --exclude .git $INCLUDE
@@ -0,0 +1,198 @@
+"""
+Integrity checks that don't download the whole repository every time.
+
+`restic check --read-data` reads every pack file, too much to run regularly on a repository of terabytes.
+A rotating check reads one part per run (`--read-data-subset=n/t`, restic divides the packs into t parts by ID),
+so t runs cover the whole repository. Which parts were read in the current cycle is kept locally per repository
+(check/<hash>.json in the cache dir).
+
+The number of parts comes from --parts (or RESTIC_CHECK_PARTS), or is derived from a byte budget per run
+(--budget or RESTIC_CHECK_BUDGET) and the repository size as known locally (from the last prune or
+`du --mode raw-data`). A different number of parts starts a new cycle, since the parts no longer line up.
+"""
+
+import hashlib
+import json
+import math
+import re
+import time
+import typing
+from dataclasses import asdict, dataclass, field, fields
+from pathlib import Path
+from typing import Optional, Self
+
+from .helpers import cache_dir
+
+MODES = ("metadata", "rotate", "full")
+DEFAULT_PARTS = 10
+
+# `read group #2 of 27 data packs (out of total 2139 packs in 80 groups)`, or the progress bar of a full read:
+_GROUP_RE = re.compile(r"read group #\d+ of (\d+) data packs")
+_PROGRESS_RE = re.compile(r"(\d+) / \d+ packs")
+
+
+@dataclass
+class CheckRun:
+    """
+    One check with --read-data(-subset), for the report.
+
+    Attributes:
+        finished (float): unix timestamp.
+        subset (str): what was read: 'n/t', a size, or 'all'.
+        duration (float): wall clock seconds.
+        packs (Optional[int]): pack files read (from restic's output).
+        read_bytes (Optional[int]): estimated bytes read (the repository size divided by the number of parts).
+    """
+
+    finished: float
+    subset: str
+    duration: float
+    packs: Optional[int] = None
+    read_bytes: Optional[int] = None
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """
+        Estimated bytes per second.
+        """
+        if self.read_bytes is None or not self.duration:
+            return None
+        return self.read_bytes / self.duration
+
+
+@dataclass
+class CheckState:
+    """
+    Progress of the rotating check of one repository.
+
+    Attributes:
+        path (Path): where the state is stored.
+        parts (int): the number of parts (t) of the current cycle.
+        done (list[int]): the parts (n) read in the current cycle.
+        cycle_started (Optional[float]): unix timestamp of the first run of the current cycle.
+        last_complete (Optional[float]): when all data was last read (a finished cycle or a full check).
+        last_run (Optional[CheckRun]): the last successful check that read data.
+    """
+
+    path: Path
+    parts: int = 0
+    done: list[int] = field(default_factory=list)
+    cycle_started: Optional[float] = None
+    last_complete: Optional[float] = None
+    last_run: Optional[CheckRun] = None
+
+    @classmethod
+    def load(cls, uri: str) -> Self:
+        key = hashlib.sha256(uri.encode()).hexdigest()[:16]
+        path = cache_dir("check") / f"{key}.json"
+        try:
+            stored = json.loads(path.read_text())
+        except (OSError, ValueError):
+            stored = {}
+
+        known = {item.name for item in fields(cls)} - {"path"}
+        values = {name: value for name, value in stored.items() if name in known}
+        if values.get("last_run"):
+            values["last_run"] = CheckRun(**values["last_run"])
+        return cls(path=path, **values)
+
+    def save(self) -> None:
+        data = asdict(self)
+        data.pop("path")
+        tmp = self.path.with_name(f"{self.path.name}.tmp")
+        tmp.write_text(json.dumps(data, indent=2))
+        tmp.replace(self.path)
+
+    @property
+    def coverage(self) -> float:
+        """
+        Part of the repository read in the current cycle.
+        """
+        return len(self.done) / self.parts if self.parts else 0.0
+
+    def next_part(self, parts: int, now: Optional[float] = None) -> int:
+        """
+        The part to read next (1-based), starting a new cycle when `parts` changed or all parts were read.
+        """
+        if parts != self.parts or len(self.done) >= parts:
+            self.parts, self.done, self.cycle_started = parts, [], None
+        if self.cycle_started is None:
+            self.cycle_started = time.time() if now is None else now
+        return min(set(range(1, parts + 1)) - set(self.done))
+
+    def record(self, run: CheckRun, part: Optional[int] = None) -> None:
+        """
+        Remember a successful check: `part` of the cycle, or everything (part None and subset 'all').
+        """
+        self.last_run = run
+        if part is not None and part not in self.done:
+            self.done.append(part)
+        if run.subset == "all" or (self.parts and len(self.done) >= self.parts):
+            self.last_complete = run.finished
+        self.save()
+
+    def describe(self) -> str:
+        from .restic_cache import format_size
+
+        lines = []
+        if self.parts:
+            lines.append(
+                f"rotating check: {len(self.done)}/{self.parts} parts read ({self.coverage:.0%}), "
+                f"{self.parts - len(self.done)} runs to go in this cycle"
+            )
+        complete = time.strftime("%Y-%m-%d %H:%M", time.localtime(self.last_complete)) if self.last_complete else None
+        lines.append(f"all data last read: {complete or 'never (from this machine)'}")
+        if run := self.last_run:
+            details = [f"{run.duration:.0f}s"]
+            if run.packs is not None:
+                details.append(f"{run.packs} packs")
+            if run.read_bytes is not None:
+                details.append(f"~{format_size(run.read_bytes)}")
+            if run.throughput is not None:
+                details.append(f"~{format_size(int(run.throughput))}/s")
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(run.finished))
+            lines.append(f"last read: {run.subset} at {when} ({', '.join(details)})")
+        return "\n".join(lines)
+
+
+def parts_for(parts: Optional[int], budget: Optional[int], total_bytes: Optional[int]) -> Optional[int]:
+    """
+    Number of parts for a rotating check: at least `parts`, and more when one part would exceed the byte budget.
+    None when there is only a budget and the repository size is unknown.
+    """
+    if budget and total_bytes:
+        return max(parts or 1, math.ceil(total_bytes / budget))
+    if budget:
+        return parts
+    return parts or DEFAULT_PARTS
+
+
+def packs_read(output: str) -> Optional[int]:
+    if match := _GROUP_RE.search(output):
+        return int(match[1])
+    if matches := _PROGRESS_RE.findall(output):
+        return int(matches[-1])
+    return None
+
+
+def check_values(state: CheckState, run: Optional[CheckRun]) -> dict[str, float]:
+    """
+    Metrics (see metrics.py) for a check run.
+    """
+    values: dict[str, float] = {}
+    if state.parts:
+        values["check_coverage_ratio"] = state.coverage
+    if run and run.read_bytes is not None:
+        values["check_read_bytes"] = run.read_bytes
+    if run and run.throughput is not None:
+        values["check_throughput_bytes_per_second"] = run.throughput
+    return values
+
+
+def subset_size(value: typing.Any) -> Optional[int]:
+    """
+    A byte budget like '50G' (None when not set).
+    """
+    from .restic_cache import parse_size
+
+    return parse_size(value or None)
@@ -1,20 +1,82 @@
+"""
+The .env file with the repository settings.
+
+Parsed files are cached per path and reparsed only when the file changed (inode, mtime or size), so all readers
+(e.g. every Repository object) share one up-to-date dict. Writes rewrite the file atomically (temporary file,
+then rename), keeping comments and empty lines intact. Within `batch()`, updates are collected and written at once.
+"""
+
+import contextlib
 import os
+import typing
 import warnings
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional
 
-# the path where the environment variables are going
+from . import tracing
+
+# the path where the environment variables are going (created on first use, not on import)
 DOTENV = Path(".env")
-DOTENV.touch(exist_ok=True)
 
-_dotenv_settings: dict[Path, dict[str, str]] = {}
+
+@dataclass
+class _EnvFile:
+    """
+    Parsed settings of one .env file, with the stat() values they were read from.
+    """
+
+    settings: dict[str, str]
+    stamp: tuple[int, int, int]
+    # stamp of the version last copied to os.environ (see export):
+    exported: Optional[tuple[int, int, int]] = None
+
+
+# by absolute path:
+_dotenv_settings: dict[str, _EnvFile] = {}
+# updates waiting for the end of a batch(), by absolute path:
+_pending: dict[str, dict[str, str]] = {}
+
+
+def _key(path: Path) -> str:
+    return os.path.abspath(path)
+
+
+def _stamp(path: Path) -> tuple[int, int, int]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        path.touch(exist_ok=True)
+        stat = os.stat(path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def parse(text: str) -> dict[str, str]:
+    """
+    KEY=value pairs of a .env file, without comments and redundant whitespace.
+    """
+    items = {}
+    for line in text.splitlines():
+        # remove comments and redundant whitespace
+        line = line.split("#", 1)[0].strip()
+        if not line or "=" not in line:
+            # just a comment, skip
+            # or key without value? invalid, prevent crash:
+            continue
+
+        # convert to tuples
+        k, v = line.split("=", 1)
+
+        # clean the tuples and add to dict
+        items[k.strip()] = v.strip()
+    return items
 
 
 def read_dotenv(path: Optional[Path] = None) -> dict[str, str]:
     """Reads a .env file at the specified path and returns a dictionary of key - value pairs.
 
-    If the specified key is not found in the.env file, the function prompts the user to enter a value for the key,
-    with a default value provided.The key-value pair is then appended to the.env file.
+    The file is created when missing. The same dict is returned for as long as the file exists,
+    when the file was changed it is updated in place (so every holder sees the new settings).
 
     Args:
         path(Path): The path to the .env file.
@@ -22,31 +84,107 @@ def read_dotenv(path: Optional[Path] = None) -> dict[str, str]:
     Returns:
         dict: A dictionary containing the key - value pairs in the .env file."""
     path = path or DOTENV
+    key = _key(path)
+    # stat before reading: a change while reading is then picked up by the next call
+    stamp = _stamp(path)
 
-    if existing := _dotenv_settings.get(path):
-        # 'cache'
-        return existing
+    cached = _dotenv_settings.get(key)
+    if cached and cached.stamp == stamp:
+        return cached.settings
 
-    items = {}
-    with path.open(mode="r") as env_file:
-        for line in env_file:
-            # remove comments and redundant whitespace
-            line = line.split("#", 1)[0].strip()
-            if not line or "=" not in line:
-                # just a comment, skip
-                # or key without value? invalid, prevent crash:
-                continue
-
-            # convert to tuples
-            k, v = line.split("=", 1)
-
-            # clean the tuples and add to dict
-            items[k.strip()] = v.strip()
-
-    _dotenv_settings[path] = items
+    with tracing.span("env.load", path=str(path)) as span:
+        items = parse(path.read_text())
+        # not written yet, but already set:
+        items |= _pending.get(key, {})
+        span.set(settings=len(items))
+
+    if cached:
+        cached.settings.clear()
+        cached.settings.update(items)
+        cached.stamp = stamp
+        return cached.settings
+
+    _dotenv_settings[key] = _EnvFile(items, stamp)
     return items
 
 
+def export(path: Optional[Path] = None) -> dict[str, str]:
+    """
+    read_dotenv, and copy the settings to os.environ (once per version of the file, not on every call).
+    """
+    path = path or DOTENV
+    settings = read_dotenv(path)
+    cached = _dotenv_settings[_key(path)]
+    if cached.exported != cached.stamp:
+        os.environ |= settings
+        cached.exported = cached.stamp
+    return settings
+
+
+def _write_atomic(path: Path, text: str) -> None:
+    """
+    Write to a temporary file next to `path` (private, it holds credentials), then rename it over `path`.
+    """
+    mode = os.stat(path).st_mode & 0o777 if path.exists() else 0o600
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def _updated_lines(lines: list[str], values: dict[str, str]) -> list[str]:
+    """
+    Replace the values of existing keys (keeping trailing comments), append the new ones.
+    """
+    remaining = dict(values)
+    outlines = []
+    for line in lines:
+        content, hash_, comment = line.partition("#")
+        key = content.split("=", 1)[0].strip() if "=" in content else None
+        if key not in remaining:
+            # comments, empty lines and other settings stay as they are
+            outlines.append(line)
+            continue
+
+        new = f"{key}={remaining.pop(key)}"
+        if hash_:
+            new += (content[len(content.rstrip()) :] or " ") + hash_ + comment
+        outlines.append(new)
+
+    outlines.extend(f"{key.strip().upper()}={value.strip()}" for key, value in remaining.items())
+    return outlines
+
+
+def update_env(path: Path, values: dict[str, typing.Any]) -> None:
+    """
+    Set several keys in the .env file with one (atomic) write, or at the end of the current batch().
+
+    Args:
+        path: pathlib.Path designating the .env file
+        values: keys (probably best to use UPPERCASE) and values (anything that converts to a string using str())
+    """
+    values = {key: str(value) for key, value in values.items()}
+    key = _key(path)
+    settings = read_dotenv(path)
+
+    if key in _pending:
+        _pending[key] |= values
+    else:
+        _write_atomic(path, "\n".join(_updated_lines(path.read_text().splitlines(), values)) + "\n")
+        _dotenv_settings[key].stamp = _stamp(path)
+
+    for name, value in values.items():
+        # (like the file: existing keys keep their spelling, new keys are appended in uppercase)
+        settings[name if name in settings else name.strip().upper()] = value.strip()
+
+
 def set_env_value(path: Path, target: str, value: str) -> None:
     """
     update/set environment variables in the .env file, keeping comments intact
@@ -58,40 +196,29 @@ def set_env_value(path: Path, target: str, value: str) -> None:
         target: key to write, probably best to use UPPERCASE
         value: string value to write, or anything that converts to a string using str()
     """
-    with path.open(mode="r") as env_file:
-        # open the .env file and read every line in the inlines
-        inlines = env_file.read().split("\n")
+    update_env(path, {target: value})
 
-    outlines = []  # lines for output
-    geschreven = False
-    for line in inlines:
-        if line.strip().startswith("#"):
-            # ignore comments
-            outlines.append(line)
-            continue
-        # remove redundant whitespace
-        line = line.strip()
-        if not line:
-            # remove empty lines
-            continue
-        # convert to tuples
-        key, oldvalue = line.split("=", 1)
-        # clean the key and value
-        key = key.strip()
-        if key == target:
-            # add the new tuple to the lines
-            outlines.append(f"{key}={value}")
-            geschreven = True
-        else:
-            # or leave it as it is
-            outlines.append(line)
-    if not geschreven:
-        # if target in .env file
-        outlines.append(f"{target.strip().upper()}={value.strip()}")
-    with path.open(mode="w") as env_file:
-        # write outlines to .env file
-        env_file.write("\n".join(outlines))
-        env_file.write("\n")
+
+@contextlib.contextmanager
+def batch(path: Optional[Path] = None) -> typing.Generator[dict[str, str], None, None]:
+    """
+    Collect the updates (set_env_value, check_env) of the block and write them to the .env file at once,
+    also when the block fails (e.g. ctrl-c halfway through the prompts of `setup`).
+    Reads within the block already see the new values.
+    """
+    path = path or DOTENV
+    key = _key(path)
+    if key in _pending:
+        # nested: the outer batch writes
+        yield read_dotenv(path)
+        return
+
+    _pending[key] = {}
+    try:
+        yield read_dotenv(path)
+    finally:
+        if values := _pending.pop(key):
+            update_env(path, values)
 
 
 def check_env(
@@ -127,10 +254,8 @@ def check_env(
     if suffix:
         value += suffix
 
-    with path.open(mode="r+") as env_file:
-        env_file.seek(0, 2)
-        # write key and value to .env file
-        env_file.write(f"\n{key.upper()}={value}")
+    # write key and value to .env file (now, or at the end of the batch)
+    update_env(path, {key.upper(): value})
 
     # update in memory too:
     os.environ[key] = env[key] = value
@@ -0,0 +1,457 @@
+"""
+Fan-out backups: run the captain-hooks scripts once and upload to several repositories at the same time.
+
+The scripts are executed with a `restic` shim first on $PATH. Every restic call in a script goes to this module
+(`python -m edwh_restic_plugin.fanout <run dir> <args>`), which starts the real restic once per target repository,
+concurrently, each with its own environment (credentials) and `-r`. Data piped into `restic backup --stdin`
+(e.g. a database dump) is produced once and copied to every target; `--stdin-from-command` producers are run once
+by the shim for the same reason. File backups read the same files concurrently, so they mostly come from the
+page cache after the first read.
+
+Each shim call records per-target results (exit code, snapshot ID) in the run directory, so failures can be
+reported, and messages and forget policies applied, per repository.
+"""
+
+import contextlib
+import datetime
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from termcolor import cprint
+
+if typing.TYPE_CHECKING:
+    from invoke import Context
+
+    from .hooks import HookResult
+    from .output import OutputHandler
+    from .repositories import Repository
+
+# size of the chunks copied from a stdin producer to all targets:
+CHUNK_SIZE = 1024 * 1024
+
+_REPO_FLAGS = ("-r", "--repo")
+# to find the subcommand between global flags like `--host x` (only used for reporting):
+_RESTIC_COMMANDS = frozenset(
+    {
+        "backup",
+        "cat",
+        "check",
+        "copy",
+        "diff",
+        "dump",
+        "find",
+        "forget",
+        "init",
+        "key",
+        "list",
+        "ls",
+        "migrate",
+        "mount",
+        "prune",
+        "recover",
+        "repair",
+        "restore",
+        "rewrite",
+        "self-update",
+        "snapshots",
+        "stats",
+        "tag",
+        "unlock",
+    }
+)
+
+
+@dataclass
+class FanOutTarget:
+    """
+    One repository to upload to.
+
+    Attributes:
+        name (str): repository short name, e.g. 'os' or 'b2'.
+        uri (str): restic repository uri.
+        options (list[str]): extra restic arguments for this repository (see Repository.restic_options).
+        env (dict[str, str]): complete environment for restic (credentials etc.), see `target_for`.
+    """
+
+    name: str
+    uri: str
+    options: list[str] = field(default_factory=list)
+    env: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class TargetResult:
+    """
+    Outcome of one restic call (from a script) for one target.
+    """
+
+    target: str
+    script: str
+    command: str
+    exited: int
+    snapshot: Optional[str]
+    duration: float
+    # restic's backup summary (see metrics.BackupSummary), for backups:
+    summary: Optional[dict[str, int]] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.exited == 0
+
+
+@contextlib.contextmanager
+def restored_environ() -> typing.Generator[None, None, None]:
+    """
+    Undo changes to os.environ afterwards, so settings of one repository never leak into the next.
+    """
+    before = dict(os.environ)
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(before)
+
+
+def target_for(c: "Context", repo: "Repository") -> FanOutTarget:
+    """
+    Capture the environment `repo` prepares for restic, without keeping it in os.environ.
+    """
+    with restored_environ():
+        repo.prepare_env_for_restic(c)
+        return FanOutTarget(
+            name=repo._short_name,
+            uri=repo.uri,
+            options=shlex.split(repo.restic_options),
+            env=dict(os.environ),
+        )
+
+
+def strip_repo_args(args: list[str]) -> list[str]:
+    """
+    Remove `-r X`, `--repo X` and `--repo=X`: every target gets its own.
+    """
+    stripped = []
+    idx = 0
+    while idx < len(args):
+        arg = args[idx]
+        if arg == "--":
+            # the rest belongs to a --stdin-from-command producer
+            return stripped + args[idx:]
+        if arg in _REPO_FLAGS:
+            idx += 1
+        elif not arg.startswith("--repo="):
+            stripped.append(arg)
+        idx += 1
+    return stripped
+
+
+def split_producer(args: list[str]) -> tuple[list[str], Optional[list[str]]]:
+    """
+    Turn `backup --stdin-from-command ... -- producer args` into `backup --stdin ...` and the producer command,
+    so the producer runs once instead of once per target.
+    """
+    if "--stdin-from-command" not in args or "--" not in args:
+        return args, None
+
+    separator = args.index("--")
+    restic_args = ["--stdin" if arg == "--stdin-from-command" else arg for arg in args[:separator]]
+    return restic_args, args[separator + 1 :]
+
+
+class FanOut:
+    """
+    Run directory with the target settings, the `restic` shim and the recorded results. Removed on exit.
+    """
+
+    def __init__(self, targets: list[FanOutTarget], restic: str = "restic") -> None:
+        # mkdtemp creates a private (0700) directory; the targets file holds credentials.
+        self.path = Path(tempfile.mkdtemp(prefix="edwh-restic-fanout-"))
+        self.results_dir.mkdir()
+        self.bin_dir.mkdir()
+
+        config = {"restic": restic, "targets": [asdict(target) for target in targets]}
+        fd = os.open(self.path / "targets.json", os.O_WRONLY | os.O_CREAT, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(config, f)
+
+        # run this module with the interpreter (and import path) of the current process:
+        import_root = Path(__file__).parents[len(__name__.split(".")) - 1]
+        shim = self.bin_dir / "restic"
+        python = shlex.join([sys.executable, "-m", __name__, str(self.path)])
+        shim.write_text(
+            f'#!/bin/sh\nPYTHONPATH={shlex.quote(str(import_root))}${{PYTHONPATH:+:$PYTHONPATH}} exec {python} "$@"\n'
+        )
+        shim.chmod(0o700)
+
+    @property
+    def results_dir(self) -> Path:
+        return self.path / "results"
+
+    @property
+    def bin_dir(self) -> Path:
+        return self.path / "bin"
+
+    def env(self) -> dict[str, str]:
+        """
+        Environment changes for the scripts, so `restic` resolves to the shim.
+        """
+        return {"PATH": f"{self.bin_dir}{os.pathsep}{os.environ.get('PATH', '')}"}
+
+    def results(self) -> list[TargetResult]:
+        results = []
+        for file in sorted(self.results_dir.glob("*.json")):
+            results.extend(TargetResult(**item) for item in json.loads(file.read_text()))
+        return results
+
+    def cleanup(self) -> None:
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self) -> "FanOut":
+        return self
+
+    def __exit__(self, *_: typing.Any) -> None:
+        self.cleanup()
+
+
+def _write_all(sink: typing.BinaryIO, data: bytes) -> None:
+    # (pipes may accept only part of a chunk)
+    view = memoryview(data)
+    while view:
+        view = view[os.write(sink.fileno(), view) :]
+
+
+def _tee(source: typing.BinaryIO, sinks: list[typing.BinaryIO]) -> None:
+    """
+    Copy source to every sink; a sink that goes away (restic failed) is dropped, the others continue.
+
+    The sinks are left open: closing them tells restic the data is complete, which is up to the caller.
+    Stops early when no sink is left (a producer then gets a broken pipe instead of blocking forever).
+    """
+    fd = source.fileno()
+    while sinks and (chunk := os.read(fd, CHUNK_SIZE)):
+        for sink in list(sinks):
+            try:
+                _write_all(sink, chunk)
+            except OSError:
+                # e.g. BrokenPipeError: this restic exited
+                sinks.remove(sink)
+
+
+def run_targets(
+    restic: str, targets: list[FanOutTarget], args: list[str], stdin: typing.BinaryIO
+) -> list[tuple[FanOutTarget, int, "OutputHandler", float]]:
+    """
+    Run `restic <args>` for all targets concurrently. Returns (target, exit code, output, duration) per target.
+
+    Output is printed as it arrives, every line prefixed with the target's name; only its last lines are kept.
+    """
+    from .output import OutputHandler
+
+    args = strip_repo_args(args)
+    args, producer_command = split_producer(args)
+    reads_stdin = "--stdin" in args
+
+    started = time.monotonic()
+    processes = [
+        subprocess.Popen(
+            [restic, "-r", target.uri, *target.options, *args],
+            env=target.env,
+            stdin=subprocess.PIPE if reads_stdin else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            # unbuffered, so every chunk is handed to restic right away:
+            bufsize=0,
+            stderr=subprocess.STDOUT,
+        )
+        for target in targets
+    ]
+
+    print_lock = threading.Lock()
+
+    def printer(name: str) -> typing.Callable[[str], None]:
+        def print_line(line: str) -> None:
+            with print_lock:
+                print(f"[{name}] {line}", flush=True)
+
+        return print_line
+
+    outputs = [OutputHandler(on_line=printer(target.name)) for target in targets]
+    durations: list[float] = [0.0] * len(processes)
+
+    def collect(idx: int, process: subprocess.Popen) -> None:
+        with outputs[idx] as handler:
+            while chunk := os.read(process.stdout.fileno(), CHUNK_SIZE):
+                handler.feed(chunk)
+        process.wait()
+        durations[idx] = time.monotonic() - started
+
+    readers = [threading.Thread(target=collect, args=(idx, proc)) for idx, proc in enumerate(processes)]
+    for reader in readers:
+        reader.start()
+
+    producer_exit = 0
+    if reads_stdin:
+        if producer_command:
+            producer = subprocess.Popen(producer_command, stdout=subprocess.PIPE)
+            _tee(producer.stdout, [process.stdin for process in processes])
+            producer.stdout.close()
+            producer_exit = producer.wait()
+            # (killed by a signal, e.g. SIGPIPE when every restic is gone: like the shell reports it)
+            producer_exit = 128 - producer_exit if producer_exit < 0 else producer_exit
+        else:
+            _tee(stdin, [process.stdin for process in processes])
+
+        if producer_exit:
+            # restic would save whatever it got so far when stdin is closed normally (see streams.run_stream):
+            for process in processes:
+                process.kill()
+        for process in processes:
+            with contextlib.suppress(OSError):
+                process.stdin.close()
+
+    for reader in readers:
+        reader.join()
+
+    exit_codes = [process.returncode for process in processes]
+    if producer_exit:
+        # like restic's own --stdin-from-command: a failing producer means a failed backup
+        exit_codes = [producer_exit] * len(processes)
+
+    return [(target, exit_codes[idx], outputs[idx], durations[idx]) for idx, target in enumerate(targets)]
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    """
+    Entrypoint of the `restic` shim: fan out one restic call to all targets of a run directory.
+    """
+    from .metrics import summary_dict
+
+    run_dir, *args = argv if argv is not None else sys.argv[1:]
+    run_dir = Path(run_dir)
+    config = json.loads((run_dir / "targets.json").read_text())
+    targets = [FanOutTarget(**target) for target in config["targets"]]
+
+    ran = run_targets(config["restic"], targets, args, sys.stdin.buffer)
+
+    script = os.environ.get("CAPTAIN_HOOKS_SCRIPT", "")
+    command = next((arg for arg in args if arg in _RESTIC_COMMANDS), "")
+    results = []
+    for target, exited, output, duration in ran:
+        print(f"[{target.name}] restic {command}: exit {exited} ({duration:.1f}s)")
+
+        snapshots = output.snapshots
+        results.append(
+            TargetResult(
+                target=target.name,
+                script=script,
+                command=command,
+                exited=exited,
+                snapshot=snapshots[-1] if snapshots else None,
+                duration=duration,
+                summary=summary_dict("\n".join(output.summary_lines)) if command == "backup" else None,
+            )
+        )
+
+    result_file = run_dir / "results" / f"{time.time_ns()}-{os.getpid()}.json"
+    result_file.write_text(json.dumps([asdict(result) for result in results]))
+
+    return max((exited for _, exited, _, _ in ran), default=0)
+
+
+def backup(
+    c: "Context",
+    repos: list["Repository"],
+    target: str,
+    message: Optional[str] = None,
+    verbose: bool = False,
+    parallel: int = 1,
+    timeout: Optional[float] = None,
+) -> tuple[list["HookResult"], dict[str, list[TargetResult]]]:
+    """
+    Run the backup scripts for `target` once, uploading to all repos concurrently, and tag the run's message
+    per repository.
+
+    Returns:
+        (result per script, restic results per repository short name)
+    """
+    from tqdm import tqdm
+
+    from .hooks import HookRunner
+    from .restic_binary import find_restic
+
+    targets = [target_for(c, repo) for repo in repos]
+    message = message or f"{datetime.datetime.now()} localtime"
+
+    scripts = repos[0].get_hooks(target, "backup", timeout)
+
+    with FanOut(targets, find_restic() or "restic") as fan_out, restored_environ():
+        # variables scripts may use besides calling restic; the shim replaces the repository per target:
+        os.environ |= targets[0].env
+        os.environ["HOST"] = os.environ["RESTIC_HOST"] = repos[0].hostarg
+        os.environ["MSG"] = message
+        os.environ |= fan_out.env()
+
+        runner = HookRunner(c, verbose=verbose, workers=parallel, log_dir=repos[0].log_dir)
+        hook_results = runner.run(scripts, progress=tqdm)
+        per_target: dict[str, list[TargetResult]] = {t.name: [] for t in targets}
+        for result in fan_out.results():
+            per_target[result.target].append(result)
+
+    for repo in repos:
+        results = [result for result in per_target[repo._short_name] if result.ok and result.snapshot]
+        with restored_environ():
+            repo.prepare_env_for_restic(c)
+            # (tagging gives the snapshots a new ID)
+            renamed = repo.tag_message(c, [result.snapshot for result in results], message) or {}
+        for result in results:
+            result.snapshot = renamed.get(result.snapshot, result.snapshot)
+
+    return hook_results, per_target
+
+
+def report(hook_results: list["HookResult"], per_target: dict[str, list[TargetResult]]) -> int:
+    """
+    Print the status per script and per repository, returns the worst exit code.
+    """
+    print("\n\nfile status codes:")
+    for result in hook_results:
+        if result.timed_out:
+            cprint(f"[timeout ({result.script.timeout}s)] {result.script.path}", color="red")
+        elif result.ok:
+            cprint(f"[success] {result.script.path}", color="green")
+        else:
+            cprint(f"[failure ({result.exited})] {result.script.path}", color="red")
+
+    print("\nrepository status:")
+    for name, results in per_target.items():
+        if failures := [result for result in results if not result.ok]:
+            details = ", ".join(
+                f"{Path(result.script).name or result.command} ({result.exited})" for result in failures
+            )
+            cprint(f"[failure] {name}: {details}", color="red")
+        else:
+            snapshots = [result.snapshot[:8] for result in results if result.snapshot]
+            ids = f" ({', '.join(snapshots)})" if snapshots else ""
+            cprint(f"[success] {name}: {len(snapshots)} snapshots{ids}", color="green")
+
+    codes = [result.exited for result in hook_results]
+    codes += [result.exited for results in per_target.values() for result in results]
+    return max(codes, default=0)
+
+
+def failed_targets(per_target: dict[str, list[TargetResult]]) -> set[str]:
+    return {name for name, results in per_target.items() if any(not result.ok for result in results)}
+
+
+if __name__ == "__main__":
+    sys.exit(main())
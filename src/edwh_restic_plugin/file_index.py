@@ -0,0 +1,294 @@
+"""
+Local index of the files in every snapshot, so finding which snapshots contain a path doesn't require
+`restic ls`/`restic find` over every snapshot tree in the repository.
+
+The index is a SQLite database in the plugin's cache dir (next to the snapshot cache), keyed by restic repository ID.
+Paths are stored once and referenced by number, and only snapshots that weren't indexed before are listed
+(`restic ls --json <snapshot>`, streamed line by line). Snapshots that were forgotten are dropped from the index.
+"""
+
+import datetime as dt
+import json
+import re
+import sqlite3
+import typing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from .helpers import cache_dir
+from .snapshots import Snapshot
+
+# insert nodes in batches while streaming `restic ls`:
+INSERT_BATCH_SIZE = 10_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS paths (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    repo_id TEXT NOT NULL,
+    snapshot_id TEXT NOT NULL,
+    time TEXT NOT NULL,
+    complete INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (repo_id, snapshot_id)
+);
+CREATE TABLE IF NOT EXISTS entries (
+    path_id INTEGER NOT NULL,
+    snapshot INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    size INTEGER,
+    mtime INTEGER,
+    PRIMARY KEY (path_id, snapshot)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_snapshot ON entries (snapshot);
+"""
+
+_GLOB_CHARS = re.compile(r"[*?\[]")
+# restic prints nanoseconds, Python parses up to microseconds:
+_FRACTION_RE = re.compile(r"(\.\d{6})\d+")
+
+
+@dataclass
+class FileMatch:
+    """
+    A path found in one snapshot.
+
+    Attributes:
+        snapshot_id (str): full snapshot ID.
+        time (datetime): when the snapshot was made.
+        path (str): absolute path in the snapshot.
+        type (str): 'file', 'dir', 'symlink', ...
+        size (Optional[int]): size in bytes (files only).
+        mtime (Optional[datetime]): modification time of the file.
+    """
+
+    snapshot_id: str
+    time: dt.datetime
+    path: str
+    type: str
+    size: Optional[int]
+    mtime: Optional[dt.datetime]
+
+    @property
+    def short_id(self) -> str:
+        return self.snapshot_id[:8]
+
+
+def parse_mtime(mtime: Optional[str]) -> Optional[int]:
+    """
+    restic's RFC 3339 timestamp (with nanoseconds) to a unix timestamp.
+    """
+    if not mtime:
+        return None
+    try:
+        return int(dt.datetime.fromisoformat(_FRACTION_RE.sub(r"\1", mtime).replace("Z", "+00:00")).timestamp())
+    except ValueError:
+        return None
+
+
+def parse_nodes(lines: typing.Iterable[str | bytes]) -> typing.Iterator[dict]:
+    """
+    Messages of `restic ls --json`, one per line (the snapshot first, then its nodes).
+    """
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def to_glob(pattern: str) -> list[str]:
+    """
+    SQLite GLOB patterns for a query:
+
+    - '/home/app/data' (no wildcards): that path, and everything below it when it's a directory.
+    - '/home/*/data.sql': glob on the full path (like fnmatch, '*' also matches '/').
+    - 'data.sql', '*.sql' (relative): on the file name, in any directory (like `restic find`).
+
+    Patterns that start with a fixed '/prefix' can use the index on paths.
+    """
+    pattern = pattern.rstrip("/") or "/"
+    if not pattern.startswith("/"):
+        pattern = f"*/{pattern}"
+    if _GLOB_CHARS.search(pattern):
+        return [pattern]
+
+    # without wildcards GLOB matches literally:
+    return [pattern, f"{pattern.rstrip('/')}/*"]
+
+
+def minimal_includes(paths: typing.Iterable[str]) -> list[str]:
+    """
+    Drop paths that are already covered by an included parent directory.
+    """
+    includes: list[str] = []
+    for path in sorted(set(paths)):
+        if includes and (path == includes[-1] or path.startswith(includes[-1].rstrip("/") + "/")):
+            continue
+        includes.append(path)
+    return includes
+
+
+class FileIndex:
+    """
+    Files per snapshot per restic repository.
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path or cache_dir() / "files.sqlite"
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "FileIndex":
+        return self
+
+    def __exit__(self, *_: typing.Any) -> None:
+        self.close()
+
+    def indexed_ids(self, repo_id: str) -> set[str]:
+        rows = self.db.execute("SELECT snapshot_id FROM snapshots WHERE repo_id = ? AND complete", (repo_id,))
+        return {row[0] for row in rows}
+
+    def remove(self, repo_id: str, snapshot_ids: typing.Iterable[str]) -> None:
+        """
+        Forget snapshots (and their entries); paths that are no longer used are cleaned up by `vacuum`.
+        """
+        with self.db:
+            for snapshot_id in snapshot_ids:
+                row = self.db.execute(
+                    "SELECT id FROM snapshots WHERE repo_id = ? AND snapshot_id = ?", (repo_id, snapshot_id)
+                ).fetchone()
+                if row:
+                    self.db.execute("DELETE FROM entries WHERE snapshot = ?", row)
+                    self.db.execute("DELETE FROM snapshots WHERE id = ?", row)
+
+    def vacuum(self) -> None:
+        with self.db:
+            self.db.execute("DELETE FROM paths WHERE id NOT IN (SELECT path_id FROM entries)")
+        self.db.execute("VACUUM")
+
+    def _path_ids(self, paths: list[str]) -> dict[str, int]:
+        self.db.executemany("INSERT OR IGNORE INTO paths (path) VALUES (?)", [(path,) for path in paths])
+        ids = {}
+        # stay below SQLite's limit of host parameters per statement:
+        for idx in range(0, len(paths), 500):
+            chunk = paths[idx : idx + 500]
+            placeholders = ",".join("?" * len(chunk))
+            ids |= dict(self.db.execute(f"SELECT path, id FROM paths WHERE path IN ({placeholders})", chunk))
+        return ids
+
+    def add(self, repo_id: str, snapshot: Snapshot, nodes: typing.Iterable[dict]) -> int:
+        """
+        Index one snapshot from the nodes of `restic ls --json` (other messages are skipped).
+
+        The snapshot only counts as indexed once all nodes are stored, so an interrupted run starts it over.
+
+        Returns:
+            the number of entries.
+        """
+        self.remove(repo_id, [snapshot.id])
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO snapshots (repo_id, snapshot_id, time) VALUES (?, ?, ?)",
+                (repo_id, snapshot.id, snapshot.time.isoformat()),
+            )
+        key = cursor.lastrowid
+
+        count = 0
+        batch: list[dict] = []
+
+        def flush() -> None:
+            with self.db:
+                ids = self._path_ids([node["path"] for node in batch])
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO entries (path_id, snapshot, type, size, mtime) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (ids[node["path"]], key, node.get("type", ""), node.get("size"), parse_mtime(node.get("mtime")))
+                        for node in batch
+                    ],
+                )
+            batch.clear()
+
+        for node in nodes:
+            if node.get("struct_type", "node") != "node" or "path" not in node:
+                continue
+            batch.append(node)
+            count += 1
+            if len(batch) >= INSERT_BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+
+        with self.db:
+            self.db.execute("UPDATE snapshots SET complete = 1 WHERE id = ?", (key,))
+        return count
+
+    def find(
+        self,
+        repo_id: str,
+        pattern: str,
+        snapshot_ids: Optional[typing.Iterable[str]] = None,
+        limit: Optional[int] = None,
+    ) -> list[FileMatch]:
+        """
+        Entries matching `pattern` (see to_glob), newest snapshot first.
+
+        Args:
+            repo_id: restic repository ID.
+            pattern: path, path glob or file name (glob).
+            snapshot_ids: only look in these snapshots (full IDs).
+            limit: maximum number of matches.
+        """
+        globs = to_glob(pattern)
+        query = (
+            "SELECT s.snapshot_id, s.time, p.path, e.type, e.size, e.mtime "
+            "FROM paths p JOIN entries e ON e.path_id = p.id JOIN snapshots s ON s.id = e.snapshot "
+            f"WHERE s.repo_id = ? AND s.complete AND ({' OR '.join('p.path GLOB ?' for _ in globs)})"
+        )
+        params: list[typing.Any] = [repo_id, *globs]
+        if snapshot_ids is not None:
+            snapshot_ids = list(snapshot_ids)
+            query += f" AND s.snapshot_id IN ({','.join('?' * len(snapshot_ids))})"
+            params.extend(snapshot_ids)
+        query += " ORDER BY s.time DESC, p.path"
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        return [
+            FileMatch(
+                snapshot_id=snapshot_id,
+                time=dt.datetime.fromisoformat(time),
+                path=path,
+                type=type_,
+                size=size,
+                mtime=dt.datetime.fromtimestamp(mtime, tz=dt.timezone.utc) if mtime is not None else None,
+            )
+            for snapshot_id, time, path, type_, size, mtime in self.db.execute(query, params)
+        ]
+
+
+def render_matches(matches: typing.Iterable[FileMatch]) -> str:
+    """
+    Aligned table like `restic find`, with the snapshot of every match.
+    """
+    rows = [("ID", "Time", "Size", "Modified", "Path")]
+    for match in matches:
+        rows.append(
+            (
+                match.short_id,
+                match.time.strftime("%Y-%m-%d %H:%M:%S"),
+                "" if match.size is None or match.type == "dir" else str(match.size),
+                match.mtime.astimezone().strftime("%Y-%m-%d %H:%M:%S") if match.mtime else "",
+                match.path + ("/" if match.type == "dir" else ""),
+            )
+        )
+
+    widths = [max(len(row[idx]) for row in rows) for idx in range(4)]
+    return "\n".join(
+        "  ".join([*(value.ljust(width) for value, width in zip(row[:4], widths)), row[4]]).rstrip() for row in rows
+    )
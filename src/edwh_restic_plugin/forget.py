@@ -1,11 +1,10 @@
+import os
 import shlex
 import typing
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Optional, Self, get_type_hints
 
-import tomlkit
-
 
 @dataclass
 class ResticForgetPolicy:
@@ -26,7 +25,8 @@ class ResticForgetPolicy:
         keep_within_weekly (Optional[str]): Weekly retention period within which to keep snapshots.
         keep_within_monthly (Optional[str]): Monthly retention period within which to keep snapshots.
         keep_within_yearly (Optional[str]): Yearly retention period within which to keep snapshots.
-        prune (bool): Whether to purge old snapshots. Default is True.
+        prune (bool): Prune afterwards when the prune thresholds are met (see prune.py), also when the prune settings
+            have `after-forget = false`. Default is False.
     """
 
     keep_last: Optional[int] = None
@@ -135,36 +135,10 @@ class ResticForgetPolicy:
         return cls(**options)
 
     @classmethod
-    def from_toml_file(cls, subkey: str = "default", toml_path: Optional[str | Path] = None) -> Optional[Self]:
+    def from_section(cls, section: dict[str, typing.Any]) -> Self:
         """
-        Creates a policy instance from a TOML file.
-
-        Args:
-            subkey (str): The key under which the policy is stored in the TOML file.
-            toml_path (Optional[str | Path]): The path to the TOML configuration file. Defaults to '.toml' in the current directory.
-
-        Returns:
-            ResticForgetPolicy: An instance of ResticForgetPolicy created from the provided TOML file and key, or None if not found.
-
-        Raises:
-            FileNotFoundError: If the specified TOML file does not exist.
-            KeyError: If the specified subkey is not found in the TOML file.
+        Creates a policy instance from a `[restic.forget.<name>]` table, e.g. {'keep-last': 5, 'prune': True}.
         """
-        # Set default toml_path if not provided
-        if toml_path is None:
-            toml_path = Path.cwd() / ".toml"
-        else:
-            toml_path = Path(toml_path)
-
-        try:
-            data = tomlkit.parse(toml_path.read_text())
-            forget = data["restic"]["forget"]
-        except (KeyError, OSError):
-            return None
-
-        if not (section := (forget.get(subkey) or forget.get("default"))):
-            return None
-
         policy_dict = {}
         type_hints = get_type_hints(cls)
 
@@ -184,6 +158,27 @@ class ResticForgetPolicy:
 
         return cls(**policy_dict)
 
+    @classmethod
+    def from_toml_file(cls, subkey: str = "default", toml_path: Optional[str | Path] = None) -> Optional[Self]:
+        """
+        Creates a policy instance from a TOML file.
+
+        Args:
+            subkey (str): The key under which the policy is stored in the TOML file.
+            toml_path (Optional[str | Path]): The path to the TOML configuration file. Defaults to '.toml' in the current directory.
+
+        Returns:
+            ResticForgetPolicy: An instance of ResticForgetPolicy created from the provided TOML file and key, or None if not found.
+
+        Raises:
+            tomllib.TOMLDecodeError: If the TOML file is invalid.
+        """
+        sections = forget_sections(Path.cwd() / ".toml" if toml_path is None else Path(toml_path))
+        if not (section := (sections.get(subkey) or sections.get("default"))):
+            return None
+
+        return cls.from_section(section)
+
     def to_toml(
         self,
         subkey: str,
@@ -196,6 +191,8 @@ class ResticForgetPolicy:
             toml_path (str | Path): The path to the TOML configuration file.
             subkey (str): The key under which the policy should be stored in the TOML file.
         """
+        import tomlkit
+
         toml_path = Path(toml_path)
 
         # Read existing TOML data or create new if not exists
@@ -239,46 +236,9 @@ class ResticForgetPolicy:
             ResticForgetPolicy: An instance of ResticForgetPolicy created from the provided TOML file and key,
                                 or copied from the default TOML file, or None if not found.
         """
-        # Ensure toml_path is a Path object
-        if toml_path is None:
-            toml_path = Path.cwd() / ".toml"
-        else:
-            toml_path = Path(toml_path)
-
-        # Set default_toml_path if not provided
-        if default_toml_path is None:
-            default_toml_path = toml_path.parent / "default.toml"
-        else:
-            default_toml_path = Path(default_toml_path)
-
-        # Try to get the policy from the main TOML file
-        policy = cls.from_toml_file(subkey, toml_path)
-        if policy:
-            return policy
-
-        # Try to get the policy from the default TOML file
-        policy = cls.from_toml_file(subkey, default_toml_path)
-        if policy:
-            # Copy the policy to the main TOML file
-            policy.to_toml(
-                subkey,
-                toml_path,
-            )
-            return policy
-
-        # Try to get the default policy from the default TOML file
-        policy = cls.from_toml_file("default", default_toml_path)
-        if policy:
-            # Copy the default policy to the main TOML file under the subkey
-            policy.to_toml(
-                "default",
-                toml_path,
-            )
-            return policy
-
-        return None
+        return PolicyResolver(toml_path, default_toml_path).resolve([subkey], copy=True)
 
-    # since dry and prune are mutually exclusive, create helper here:
+    # `prune` only asks for a prune after forgetting, whether it runs is up to the thresholds (see prune.py):
 
     @property
     def dry(self) -> bool:
@@ -287,4 +247,99 @@ class ResticForgetPolicy:
     @dry.setter
     def dry(self, value: bool) -> None:
         self.dry_run = value
-        self.prune = not value
+
+
+# parsed [restic] tables by absolute path, with the (inode, mtime, size) they were read at:
+_toml_cache: dict[str, tuple[tuple[int, int, int], dict[str, typing.Any]]] = {}
+
+
+def restic_sections(toml_path: Path, table: str) -> dict[str, dict[str, typing.Any]]:
+    """
+    The `[restic.<table>.*]` tables of a TOML file ({} if it doesn't exist), parsed once per version of the file.
+
+    Raises:
+        tomllib.TOMLDecodeError: If the TOML file is invalid.
+    """
+    try:
+        stat = os.stat(toml_path)
+    except OSError:
+        return {}
+
+    key = os.path.abspath(toml_path)
+    stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if (cached := _toml_cache.get(key)) and cached[0] == stamp:
+        restic = cached[1]
+    else:
+        # (stdlib, faster than tomlkit, which is only needed to write while keeping comments and formatting)
+        import tomllib
+
+        restic = tomllib.loads(toml_path.read_text()).get("restic", {})
+        _toml_cache[key] = stamp, restic
+
+    return {name: section for name, section in restic.get(table, {}).items() if isinstance(section, dict)}
+
+
+def forget_sections(toml_path: Path) -> dict[str, dict[str, typing.Any]]:
+    """
+    The `[restic.forget.*]` tables of a TOML file, see restic_sections.
+    """
+    return restic_sections(toml_path, "forget")
+
+
+class PolicyResolver:
+    """
+    Finds the forget policy for a repository in `.toml`, falling back to `default.toml`.
+
+    Within each file, the first of the given names (e.g. short name and aliases) with a section wins,
+    then the 'default' section. Nothing is written unless asked for (see `resolve`).
+
+    Args:
+        toml_path: the project's policies, '.toml' in the current directory by default.
+        default_toml_path: the fallback policies, 'default.toml' next to toml_path by default.
+    """
+
+    def __init__(self, toml_path: Optional[str | Path] = None, default_toml_path: Optional[str | Path] = None) -> None:
+        self.toml_path = Path.cwd() / ".toml" if toml_path is None else Path(toml_path)
+        self.default_toml_path = (
+            self.toml_path.parent / "default.toml" if default_toml_path is None else Path(default_toml_path)
+        )
+
+    def find(
+        self, names: typing.Sequence[str], table: str = "forget"
+    ) -> Optional[tuple[Path, str, dict[str, typing.Any]]]:
+        """
+        (file, section name, section) of the policy to use, or None.
+        Other `[restic.<table>.*]` settings per repository (e.g. 'prune') are looked up the same way.
+        """
+        for path in (self.toml_path, self.default_toml_path):
+            sections = restic_sections(path, table)
+            for name in (*names, "default"):
+                if section := sections.get(name):
+                    return path, name, section
+        return None
+
+    def named(self, name: str) -> Optional[ResticForgetPolicy]:
+        """
+        The policy of exactly section `name` (from .toml, else default.toml), without falling back to 'default'.
+        """
+        for path in (self.toml_path, self.default_toml_path):
+            if section := forget_sections(path).get(name):
+                return ResticForgetPolicy.from_section(section)
+        return None
+
+    def resolve(self, names: typing.Sequence[str], copy: bool = False) -> Optional[ResticForgetPolicy]:
+        """
+        The policy for the first of `names` that has one, or the default policy.
+
+        Args:
+            names: section names to look for, in order.
+            copy: write a policy found in default.toml into .toml (under the first name), so it can be tuned there.
+        """
+        if not (found := self.find(names)):
+            return None
+
+        path, _, section = found
+        policy = ResticForgetPolicy.from_section(section)
+        if copy and path != self.toml_path:
+            policy.to_toml(names[0], self.toml_path)
+        return policy
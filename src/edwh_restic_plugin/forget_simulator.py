@@ -0,0 +1,294 @@
+"""
+Offline `restic forget`: which snapshots a ResticForgetPolicy would keep or remove, and why.
+
+Follows restic's own algorithm (ApplyPolicy in restic's snapshot_policy.go), per group of snapshots
+(host and paths, like restic's default `--group-by host,paths`):
+- snapshots are walked newest first;
+- keep-last/hourly/daily/weekly/monthly/yearly keep the newest snapshot of each hour/day/week/... until their count
+  runs out (-1: unlimited), and the oldest snapshot too while counts are left;
+- keep-within(-hourly/daily/...) do the same for all snapshots newer than the newest snapshot minus the duration;
+- keep-tag keeps every snapshot with all tags of a `--keep-tag a,b` list, without counting.
+
+Works on the snapshot list from the local cache (Repository.list_snapshots), so candidate policies can be compared
+without asking the repository again.
+"""
+
+import datetime as dt
+import re
+import typing
+from dataclasses import dataclass, field
+from typing import Optional
+
+from .forget import ResticForgetPolicy
+from .snapshots import Snapshot
+
+_DURATION_RE = re.compile(r"(\d+)([ymdh])")
+
+
+@dataclass
+class Duration:
+    """
+    A restic duration like '1y6m' or '7d12h'.
+    """
+
+    years: int = 0
+    months: int = 0
+    days: int = 0
+    hours: int = 0
+
+    @classmethod
+    def parse(cls, text: str) -> "Duration":
+        text = text.strip()
+        if not text or _DURATION_RE.sub("", text):
+            raise ValueError(f"invalid duration {text!r}, use e.g. '1y2m3d4h'")
+
+        values = {"y": 0, "m": 0, "d": 0, "h": 0}
+        for number, unit in _DURATION_RE.findall(text):
+            values[unit] += int(number)
+        return cls(years=values["y"], months=values["m"], days=values["d"], hours=values["h"])
+
+    def __str__(self) -> str:
+        # like restic prints it in the reasons:
+        parts = zip((self.years, self.months, self.days, self.hours), "ymdh")
+        return "".join(f"{value}{unit}" for value, unit in parts if value)
+
+    def before(self, moment: dt.datetime) -> dt.datetime:
+        """
+        `moment` minus this duration, with Go's AddDate normalization (e.g. 2023-03-31 - 1m = 2023-03-03).
+        """
+        months = moment.year * 12 + moment.month - 1 - self.years * 12 - self.months
+        first = moment.replace(year=months // 12, month=months % 12 + 1, day=1)
+        return first + dt.timedelta(days=moment.day - 1 - self.days, hours=-self.hours)
+
+
+def _always(_: dt.datetime, nr: int) -> int:
+    return nr
+
+
+def _hour(time: dt.datetime, _: int) -> int:
+    return time.year * 1_000_000 + time.month * 10_000 + time.day * 100 + time.hour
+
+
+def _day(time: dt.datetime, _: int) -> int:
+    return time.year * 10_000 + time.month * 100 + time.day
+
+
+def _week(time: dt.datetime, _: int) -> int:
+    year, week, _weekday = time.isocalendar()
+    return year * 100 + week
+
+
+def _month(time: dt.datetime, _: int) -> int:
+    return time.year * 100 + time.month
+
+
+def _year(time: dt.datetime, _: int) -> int:
+    return time.year
+
+
+# (policy attribute, bucket, reason), in restic's order.
+# The bucket is the hour/day/... a snapshot falls in (restic's 'bucker'), a new value means a new period:
+_COUNTED = (
+    ("keep_last", _always, "last snapshot"),
+    ("keep_hourly", _hour, "hourly snapshot"),
+    ("keep_daily", _day, "daily snapshot"),
+    ("keep_weekly", _week, "weekly snapshot"),
+    ("keep_monthly", _month, "monthly snapshot"),
+    ("keep_yearly", _year, "yearly snapshot"),
+)
+_WITHIN = (
+    ("keep_within", _always, "within {}"),
+    ("keep_within_hourly", _hour, "hourly within {}"),
+    ("keep_within_daily", _day, "daily within {}"),
+    ("keep_within_weekly", _week, "weekly within {}"),
+    ("keep_within_monthly", _month, "monthly within {}"),
+    ("keep_within_yearly", _year, "yearly within {}"),
+)
+
+
+@dataclass
+class GroupResult:
+    """
+    Outcome of a policy for one group of snapshots (newest first, like restic lists them).
+
+    Attributes:
+        key (tuple): (host, paths) of the group.
+        keep (list[Snapshot]): snapshots the policy keeps.
+        remove (list[Snapshot]): snapshots `restic forget` would remove.
+        reasons (dict[str, list[str]]): why each kept snapshot is kept, by snapshot ID (restic's 'matches').
+    """
+
+    key: tuple[str, tuple[str, ...]]
+    keep: list[Snapshot] = field(default_factory=list)
+    remove: list[Snapshot] = field(default_factory=list)
+    reasons: dict[str, list[str]] = field(default_factory=dict)
+
+
+@dataclass
+class Simulation:
+    """
+    Outcome of a policy for all snapshots.
+    """
+
+    policy: ResticForgetPolicy
+    groups: list[GroupResult]
+
+    @property
+    def keep(self) -> list[Snapshot]:
+        return [snapshot for group in self.groups for snapshot in group.keep]
+
+    @property
+    def remove(self) -> list[Snapshot]:
+        return [snapshot for group in self.groups for snapshot in group.remove]
+
+    @property
+    def reasons(self) -> dict[str, list[str]]:
+        return {snapshot_id: reasons for group in self.groups for snapshot_id, reasons in group.reasons.items()}
+
+
+def is_empty(policy: ResticForgetPolicy) -> bool:
+    """
+    A policy without any keep-* option (restic then refuses to remove anything).
+    """
+    options = [attribute for attribute, _, _ in _COUNTED + _WITHIN]
+    return not policy.keep_tag and all(getattr(policy, option) in (None, 0, "") for option in options)
+
+
+def apply_policy(snapshots: typing.Iterable[Snapshot], policy: ResticForgetPolicy) -> GroupResult:
+    """
+    Apply a policy to one group of snapshots (see `simulate` for grouping).
+    """
+    newest_first = sorted(snapshots, key=lambda snapshot: snapshot.time, reverse=True)
+    group = newest_first[0] if newest_first else None
+    result = GroupResult(key=(group.hostname, tuple(sorted(group.paths))) if group else ("", ()))
+
+    if is_empty(policy):
+        result.keep = newest_first
+        result.reasons = {snapshot.id: ["policy is empty"] for snapshot in newest_first}
+        return result
+    if not newest_first:
+        return result
+
+    # [count left, bucket, reason, last bucket value]:
+    counted = [
+        [count, bucket, reason, None]
+        for attribute, bucket, reason in _COUNTED
+        if (count := int(getattr(policy, attribute) or 0)) > 0 or count == -1
+    ]
+    latest = newest_first[0].time
+    # [threshold, bucket, reason, last bucket value]:
+    within = [
+        [duration.before(latest), bucket, reason.format(duration), None]
+        for attribute, bucket, reason in _WITHIN
+        if (value := getattr(policy, attribute)) and (duration := Duration.parse(value))
+    ]
+    tag_lists = [[tag for tag in tags.split(",") if tag] for tags in policy.keep_tag]
+
+    oldest = len(newest_first) - 1
+    for nr, snapshot in enumerate(newest_first):
+        reasons = [f"has tags [{', '.join(tags)}]" for tags in tag_lists if set(tags).issubset(snapshot.tags)]
+
+        for counter in counted:
+            count, bucket, reason, last = counter
+            if count == 0:
+                continue
+            value = bucket(snapshot.time, nr)
+            # (the oldest snapshot is kept too while there are counts left, to keep the longest history)
+            if value != last or nr == oldest:
+                counter[3] = value
+                if count > 0:
+                    counter[0] -= 1
+                reasons.append(reason)
+
+        for counter in within:
+            threshold, bucket, reason, last = counter
+            if snapshot.time > threshold:
+                value = bucket(snapshot.time, nr)
+                if value != last or nr == oldest:
+                    counter[3] = value
+                    reasons.append(reason)
+
+        if reasons:
+            result.keep.append(snapshot)
+            result.reasons[snapshot.id] = reasons
+        else:
+            result.remove.append(snapshot)
+
+    return result
+
+
+def group_key(snapshot: Snapshot, group_by: typing.Sequence[str]) -> tuple:
+    """
+    Like restic's --group-by: any of 'host', 'paths' and 'tags'.
+    """
+    parts = {
+        "host": lambda: snapshot.hostname,
+        "paths": lambda: tuple(sorted(snapshot.paths)),
+        "tags": lambda: tuple(sorted(snapshot.tags)),
+    }
+    return tuple(parts[part]() for part in group_by)
+
+
+def simulate(
+    snapshots: typing.Iterable[Snapshot],
+    policy: ResticForgetPolicy,
+    group_by: typing.Sequence[str] = ("host", "paths"),
+) -> Simulation:
+    """
+    What `restic forget <policy>` would do with these snapshots, without touching the repository.
+    """
+    groups: dict[tuple, list[Snapshot]] = {}
+    for snapshot in snapshots:
+        groups.setdefault(group_key(snapshot, group_by), []).append(snapshot)
+
+    return Simulation(policy, [apply_policy(group, policy) for group in groups.values()])
+
+
+def render_comparison(simulations: dict[str, Simulation], snapshots: Optional[typing.Sequence[Snapshot]] = None) -> str:
+    """
+    Policies side by side: how many snapshots each keeps and removes,
+    and (with `snapshots`) per snapshot whether it's kept and why.
+
+    Args:
+        simulations: by label (e.g. the policy arguments).
+        snapshots: show these snapshots (oldest first) as rows.
+    """
+    header = ("Policy", "Keep", "Remove", "Oldest kept")
+    rows = []
+    for label, simulation in simulations.items():
+        oldest = min((snapshot.time for snapshot in simulation.keep), default=None)
+        rows.append(
+            (
+                label,
+                str(len(simulation.keep)),
+                str(len(simulation.remove)),
+                oldest.strftime("%Y-%m-%d %H:%M") if oldest else "-",
+            )
+        )
+    lines = _table(header, rows)
+
+    if snapshots:
+        labels = list(simulations)
+        reasons = [simulation.reasons for simulation in simulations.values()]
+        header = ("ID", "Time", "Host", *(f"[{idx}]" for idx in range(1, len(labels) + 1)))
+        rows = [
+            (
+                snapshot.short_id,
+                snapshot.time.strftime("%Y-%m-%d %H:%M:%S"),
+                snapshot.hostname,
+                *(", ".join(kept[snapshot.id]) if snapshot.id in kept else "remove" for kept in reasons),
+            )
+            for snapshot in snapshots
+        ]
+        lines += ["", *(f"[{idx}] {label}" for idx, label in enumerate(labels, 1)), "", *_table(header, rows)]
+
+    return "\n".join(lines)
+
+
+def _table(header: tuple[str, ...], rows: list[tuple[str, ...]]) -> list[str]:
+    widths = [max(len(row[idx]) for row in (header, *rows)) for idx in range(len(header))]
+
+    def fmt(row: tuple[str, ...]) -> str:
+        return "  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+
+    return [fmt(header), "-" * len(fmt(tuple("-" * width for width in widths))), *(fmt(row) for row in rows)]
@@ -1,11 +1,15 @@
+import os
 import sys
 import typing
+from pathlib import Path
 
 import invoke
-from edwh.tasks import require_sudo
 
 T = typing.TypeVar("T")
 
+# the path where the restic command is going to be executed
+DEFAULT_BACKUP_FOLDER = Path("captain-hooks")
+
 
 def fix_tags(tags: typing.Iterable[T | None]) -> list[T]:
     """
@@ -30,11 +34,16 @@ def _require_restic(c: invoke.Context = None) -> bool:
     :param c: An optional Invoke context. If not provided, a new context will be created.
     :return: False if 'restic' is already installed, True otherwise.
     """
-    c = c or invoke.Context()  # type: invoke.Context
-    if c.run("which restic", warn=True, hide=True).ok:
+    from .restic_binary import find_restic, forget_restic
+
+    if find_restic():
         # restic already exists, do nothing
         return False
 
+    from edwh.tasks import require_sudo
+
+    c = c or invoke.Context()  # type: invoke.Context
+
     if not require_sudo(c):
         return False
 
@@ -42,5 +51,22 @@ def _require_restic(c: invoke.Context = None) -> bool:
     print("Restic missing from this system! Installing now...", file=sys.stderr)
     c.sudo("apt install -y restic", hide=True)
     c.sudo("restic self-update", hide=True)
+    forget_restic()
     print("Restic installed and updated!", file=sys.stderr)
     return True
+
+
+def cache_dir(*parts: str) -> Path:
+    """
+    Directory for local state of this plugin (snapshot metadata etc.), created if missing.
+
+    Uses $EDWH_RESTIC_CACHE_DIR if set, otherwise $XDG_CACHE_HOME/edwh-restic (~/.cache/edwh-restic).
+    """
+    if override := os.environ.get("EDWH_RESTIC_CACHE_DIR"):
+        base = Path(override)
+    else:
+        base = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "edwh-restic"
+
+    path = base.joinpath(*parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
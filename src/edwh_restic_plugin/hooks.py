@@ -0,0 +1,322 @@
+"""
+Discovery and execution of captain-hooks scripts.
+
+Scripts can optionally declare how they should be scheduled with a header comment in their first few lines:
+
+    # captain-hooks: group=postgres timeout=600
+
+- `group`: scripts in the same group always run one after the other (in filename order),
+           scripts without a group are independent and may run concurrently with anything else.
+- `timeout`: maximum runtime in seconds before the script is killed (overrides the --timeout default).
+"""
+
+import contextvars
+import datetime
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Self
+
+from invoke import Context
+from termcolor import cprint
+
+from . import tracing
+from .helpers import DEFAULT_BACKUP_FOLDER
+
+if typing.TYPE_CHECKING:
+    from .streams import StreamTarget
+
+# exit code used for scripts that were killed after their timeout (same as coreutils `timeout`)
+TIMEOUT_EXIT_CODE = 124
+
+_HEADER_RE = re.compile(r"^#\s*captain-hooks:\s*(?P<settings>.*)$", re.MULTILINE)
+# only look at the start of a script for the header:
+_HEADER_MAX_BYTES = 2048
+
+
+@dataclass
+class HookScript:
+    """
+    A single backup/restore script in the captain-hooks folder.
+
+    Attributes:
+        path (str): path to the executable script.
+        group (str): scripts with the same group run sequentially. Defaults to the path itself (= no ordering).
+        timeout (Optional[float]): seconds after which the script is killed, or None for no limit.
+    """
+
+    path: str
+    group: str
+    timeout: Optional[float] = None
+
+    @property
+    def name(self) -> str:
+        return Path(self.path).name
+
+    @classmethod
+    def from_path(cls, path: str | Path, default_timeout: Optional[float] = None) -> Self:
+        """
+        Create a HookScript, reading optional scheduling settings from the `# captain-hooks:` header.
+        """
+        path = str(path)
+        settings = parse_header(path)
+
+        timeout = default_timeout
+        if raw_timeout := settings.get("timeout"):
+            timeout = float(raw_timeout) or None
+
+        return cls(
+            path=path,
+            group=settings.get("group") or path,
+            timeout=timeout,
+        )
+
+
+@dataclass
+class HookResult:
+    """
+    Outcome of running one HookScript.
+
+    Attributes:
+        stdout (str): the last lines of the output (see output.OutputHandler), not all of it.
+        snapshots (list[str]): IDs of the snapshots the script created, in order.
+        summary_lines (list[str]): restic's backup summaries in the output (see metrics.parse_summary).
+        output_bytes (int): size of the complete output.
+        log (Optional[str]): file with the complete output, when logging.
+    """
+
+    script: HookScript
+    exited: int
+    stdout: str
+    duration: float
+    timed_out: bool = False
+    snapshots: list[str] = field(default_factory=list)
+    summary_lines: list[str] = field(default_factory=list)
+    output_bytes: int = 0
+    log: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.exited == 0
+
+
+def parse_header(path: str | Path) -> dict[str, str]:
+    """
+    Read `key=value` settings from the `# captain-hooks:` comment at the top of a script.
+
+    Unreadable or binary files simply have no settings.
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(_HEADER_MAX_BYTES).decode(errors="ignore")
+    except OSError:
+        return {}
+
+    if not (match := _HEADER_RE.search(head)):
+        return {}
+
+    settings = {}
+    for pair in match.group("settings").split():
+        if "=" in pair:
+            key, value = pair.split("=", 1)
+            settings[key.strip().lower()] = value.strip()
+
+    return settings
+
+
+def discover(target: str, verb: str, folder: Path = DEFAULT_BACKUP_FOLDER) -> list[str]:
+    """
+    Find scripts for a verb and target, e.g. backup_files*.
+
+    Sorted so execution order (and ordering within a group) is deterministic.
+    """
+    return sorted(str(file) for file in folder.glob(f"{verb}_{target}*"))
+
+
+def trace_attributes(result: HookResult) -> dict[str, typing.Any]:
+    return {
+        "exit_code": result.exited,
+        "stdout_bytes": result.output_bytes or len(result.stdout.encode(errors="replace")),
+        "timed_out": result.timed_out,
+    }
+
+
+def group_scripts(scripts: typing.Iterable[HookScript]) -> list[list[HookScript]]:
+    """
+    Bundle scripts by their group, keeping the order in which groups and scripts were first seen.
+    """
+    groups: dict[str, list[HookScript]] = {}
+    for script in scripts:
+        groups.setdefault(script.group, []).append(script)
+    return list(groups.values())
+
+
+class HookRunner:
+    """
+    Runs HookScripts either one by one (workers=1, the classic behavior) or concurrently.
+
+    In parallel mode, output of each script is captured and printed in one block when the script finishes,
+    so output of concurrent scripts doesn't get interleaved.
+    Output is processed line by line (see output.OutputHandler): only its last lines are kept in memory,
+    with `log_dir` the complete output of every script is written to `<log_dir>/<time>-<script>.log`.
+    Stream targets are backed up, or restored (from $SNAPSHOT, like scripts) with verb='restore'.
+    """
+
+    def __init__(
+        self,
+        c: Context,
+        verbose: bool = False,
+        workers: int = 1,
+        log_dir: Optional[str | Path] = None,
+        verb: str = "backup",
+    ):
+        self.c = c
+        self.verbose = verbose
+        self.workers = max(1, workers or 1)
+        self.log_dir = Path(log_dir).expanduser() if log_dir else None
+        self.verb = verb
+        self._print_lock = threading.Lock()
+
+    @property
+    def parallel(self) -> bool:
+        return self.workers > 1
+
+    def run_script(self, script: "HookScript | StreamTarget") -> HookResult:
+        """
+        Run a single script (or declared stream target), never raising on a failing exit code.
+        """
+        if not isinstance(script, HookScript):
+            with tracing.span(f"stream {script.name}", stream=script.path) as span:
+                result = self.run_stream(script)
+                if span.recording:
+                    span.set(**trace_attributes(result), snapshot=getattr(result, "snapshot", None))
+                    span.set(bytes=getattr(result, "bytes", None))
+            return result
+
+        with tracing.span(f"script {script.name}", script=script.path, group=script.group) as span:
+            result = self._run_script(script, span.traceparent)
+            if span.recording:
+                span.set(**trace_attributes(result))
+        return result
+
+    def log_path(self, name: str) -> Optional[Path]:
+        if not self.log_dir:
+            return None
+        return self.log_dir / f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{name.replace(':', '_')}.log"
+
+    def _run_script(self, script: HookScript, traceparent: Optional[str] = None) -> HookResult:
+        from . import output
+
+        live = self.verbose and not self.parallel
+        if live:
+            print("\033[1m running", script.path, "\033[0m")
+            print(f"{script.path} output: ", file=sys.stderr)
+            sys.stdout.flush()
+
+        handler = output.OutputHandler(
+            log=self.log_path(script.name), echo=getattr(sys.stdout, "buffer", None) if live else None
+        )
+        # lets restic wrappers (e.g. the fan-out shim) know which script called them,
+        # and (when tracing) lets scripts continue the trace:
+        env = os.environ | {"CAPTAIN_HOOKS_SCRIPT": script.path} | ({"TRACEPARENT": traceparent} if traceparent else {})
+
+        started = time.monotonic()
+        exited, timed_out = output.run(
+            [script.path],
+            handler,
+            env=env,
+            timeout=script.timeout,
+            # a terminal only makes sense when scripts don't run concurrently:
+            pty=not self.parallel,
+            # concurrent scripts can't share the terminal's stdin:
+            stdin=subprocess.DEVNULL if self.parallel else None,
+        )
+
+        result = HookResult(
+            script=script,
+            exited=TIMEOUT_EXIT_CODE if timed_out else exited,
+            stdout=handler.stdout,
+            duration=time.monotonic() - started,
+            timed_out=timed_out,
+            snapshots=handler.snapshots,
+            summary_lines=list(handler.summary_lines),
+            output_bytes=handler.bytes,
+            log=str(handler.log) if handler.log else None,
+        )
+
+        if self.parallel:
+            self._report(result)
+
+        return result
+
+    def run_stream(self, stream: "StreamTarget") -> HookResult:
+        from .streams import run_restore, run_stream
+
+        if self.verbose and not self.parallel:
+            print("\033[1m running", stream.path, "\033[0m")
+
+        if self.verb == "restore":
+            result = run_restore(stream, os.environ.get("SNAPSHOT") or "latest", log=self.log_path(stream.path))
+        else:
+            result = run_stream(stream, log=self.log_path(stream.path))
+        if self.parallel:
+            self._report(result)
+        elif self.verbose:
+            print(result.stdout, file=sys.stderr)
+        return result
+
+    def run_group(self, group: list["HookScript | StreamTarget"]) -> list[HookResult]:
+        return [self.run_script(script) for script in group]
+
+    def run(self, scripts: list["HookScript | StreamTarget"], progress: typing.Callable = None) -> list[HookResult]:
+        """
+        Execute all scripts, returns the results in the same order as `scripts`.
+
+        Args:
+            scripts: the scripts to run.
+            progress: optional tqdm-like factory: wraps `scripts` when sequential, or is called with `total=` in
+                      parallel mode and updated with `.update(n)`.
+        """
+        if not self.parallel:
+            iterator = progress(scripts) if progress else scripts
+            return [self.run_script(script) for script in iterator]
+
+        by_path: dict[str, HookResult] = {}
+        groups = group_scripts(scripts)
+        bar = progress(total=len(scripts)) if progress else None
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                # in the caller's context, so spans of the scripts are children of the current span:
+                futures = [pool.submit(contextvars.copy_context().run, self.run_group, group) for group in groups]
+                for future in as_completed(futures):
+                    results = future.result()
+                    by_path |= {result.script.path: result for result in results}
+                    if bar is not None:
+                        bar.update(len(results))
+        finally:
+            if bar is not None:
+                bar.close()
+
+        return [by_path[script.path] for script in scripts]
+
+    def _report(self, result: HookResult) -> None:
+        """
+        Print the (captured) output of one script as a single uninterrupted block.
+        """
+        status = "timed out" if result.timed_out else f"exit {result.exited}"
+        with self._print_lock:
+            cprint(
+                f"--- {result.script.path} ({status}, {result.duration:.1f}s) ---",
+                color="green" if result.ok else "red",
+                file=sys.stderr,
+            )
+            # always show output of failing scripts, otherwise only when verbose:
+            if (self.verbose or not result.ok) and result.stdout.strip():
+                print(result.stdout.rstrip(), file=sys.stderr)
@@ -0,0 +1,192 @@
+"""
+Keystone (OpenStack identity) tokens for the Swift backend.
+
+Restic authenticates to Keystone with username/password in every process it starts. When `OS_AUTH_TOKEN` and
+`OS_STORAGE_URL` are set, it skips that and talks to Swift directly. So the plugin requests a token once,
+keeps it on disk (private, in the plugin's cache dir) until shortly before it expires, and exports it.
+
+The password variables stay set too, so restic can still re-authenticate if a token is revoked during a run.
+"""
+
+import datetime as dt
+import hashlib
+import json
+import os
+import time
+import typing
+import urllib.error
+import urllib.request
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Optional, Self
+
+from .helpers import cache_dir
+
+# tokens with less than this many seconds left are refreshed, so they don't expire halfway through a backup:
+MIN_TTL = 15 * 60
+
+
+class KeystoneError(Exception):
+    """
+    Authentication failed or the response was not understood.
+    """
+
+
+@dataclass
+class KeystoneConfig:
+    """
+    What is needed to request a project scoped token (the OS_* settings from .env).
+    """
+
+    auth_url: str
+    username: str
+    password: str
+    user_domain_name: str
+    project_id: str
+    project_name: str
+    project_domain_name: str
+    region_name: str
+
+    @classmethod
+    def from_env(cls, env: dict[str, str]) -> Self:
+        return cls(
+            auth_url=env["OS_AUTH_URL"],
+            username=env["OS_USERNAME"],
+            password=env["OS_PASSWORD"],
+            user_domain_name=env.get("OS_USER_DOMAIN_NAME") or env["OS_PROJECT_DOMAIN_NAME"],
+            project_id=env.get("OS_PROJECT_ID", ""),
+            project_name=env.get("OS_PROJECT_NAME", ""),
+            project_domain_name=env["OS_PROJECT_DOMAIN_NAME"],
+            region_name=env.get("OS_REGION_NAME", ""),
+        )
+
+    @property
+    def cache_key(self) -> str:
+        identity = "\n".join((self.auth_url, self.username, self.project_id, self.project_name, self.region_name))
+        return hashlib.sha256(identity.encode()).hexdigest()[:16]
+
+    def request_body(self) -> dict[str, typing.Any]:
+        if self.project_id:
+            project = {"id": self.project_id}
+        else:
+            project = {"name": self.project_name, "domain": {"name": self.project_domain_name}}
+
+        return {
+            "auth": {
+                "identity": {
+                    "methods": ["password"],
+                    "password": {
+                        "user": {
+                            "name": self.username,
+                            "domain": {"name": self.user_domain_name},
+                            "password": self.password,
+                        }
+                    },
+                },
+                "scope": {"project": project},
+            }
+        }
+
+
+@dataclass
+class KeystoneToken:
+    """
+    Attributes:
+        token (str): value for OS_AUTH_TOKEN (the X-Subject-Token header).
+        storage_url (str): public object-store endpoint of the project, for OS_STORAGE_URL.
+        expires_at (float): unix timestamp.
+    """
+
+    token: str
+    storage_url: str
+    expires_at: float
+
+    def ttl(self) -> float:
+        return self.expires_at - time.time()
+
+    def is_valid(self, min_ttl: float = MIN_TTL) -> bool:
+        return self.ttl() > min_ttl
+
+
+def _storage_url(catalog: list[dict[str, typing.Any]], region: str) -> str:
+    for service in catalog:
+        if service.get("type") != "object-store":
+            continue
+        for endpoint in service.get("endpoints", []):
+            if endpoint.get("interface") != "public":
+                continue
+            if region and region not in (endpoint.get("region"), endpoint.get("region_id")):
+                continue
+            return endpoint["url"]
+
+    raise KeystoneError(f"No public object-store endpoint for region {region!r} in the service catalog.")
+
+
+def authenticate(config: KeystoneConfig, timeout: float = 30) -> KeystoneToken:
+    """
+    Request a new token with username/password (POST /v3/auth/tokens).
+    """
+    request = urllib.request.Request(
+        f"{config.auth_url.rstrip('/')}/auth/tokens",
+        data=json.dumps(config.request_body()).encode(),
+        headers={"Content-Type": "application/json", "Accept": "application/json"},
+        method="POST",
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            token = response.headers["X-Subject-Token"]
+            body = json.load(response)
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        raise KeystoneError(f"Keystone authentication at {config.auth_url} failed: {e}") from e
+
+    if not token:
+        raise KeystoneError("Keystone response did not contain a token.")
+
+    try:
+        details = body["token"]
+        expires_at = dt.datetime.fromisoformat(details["expires_at"].replace("Z", "+00:00")).timestamp()
+        storage_url = _storage_url(details.get("catalog") or [], config.region_name)
+    except (KeyError, TypeError, AttributeError, ValueError) as e:
+        # a 2xx without the expected body (e.g. a proxy page), so the caller can fall back to password auth:
+        raise KeystoneError(f"Unexpected Keystone response from {config.auth_url}: {e!r}") from e
+
+    return KeystoneToken(token=token, storage_url=storage_url, expires_at=expires_at)
+
+
+class TokenCache:
+    """
+    Tokens on disk, one file per identity (auth url, user, project, region).
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path or cache_dir("keystone")
+        # tokens are credentials:
+        self.path.chmod(0o700)
+
+    def _file(self, config: KeystoneConfig) -> Path:
+        return self.path / f"{config.cache_key}.json"
+
+    def load(self, config: KeystoneConfig) -> Optional[KeystoneToken]:
+        try:
+            return KeystoneToken(**json.loads(self._file(config).read_text()))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def store(self, config: KeystoneConfig, token: KeystoneToken) -> None:
+        target = self._file(config)
+        tmp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(asdict(token), f)
+        tmp.replace(target)
+
+    def get(self, config: KeystoneConfig, min_ttl: float = MIN_TTL, refresh: bool = False) -> KeystoneToken:
+        """
+        A token that is valid for at least `min_ttl` more seconds, from disk or freshly requested.
+        """
+        if not refresh and (token := self.load(config)) and token.is_valid(min_ttl):
+            return token
+
+        token = authenticate(config)
+        self.store(config, token)
+        return token
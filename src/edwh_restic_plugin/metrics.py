@@ -0,0 +1,381 @@
+"""
+Prometheus metrics for node_exporter's textfile collector.
+
+Set RESTIC_METRICS_DIR (in .env or the environment) to the directory of the textfile collector
+(node_exporter --collector.textfile.directory). `backup`, `forget`, `prune`, `check` and `du` then write
+`edwh_restic_<project>_<task>_<repository>.prom` there after every run, also when the run failed:
+duration, exit status, last success timestamp and, for backups, the files/bytes from restic's summary per target.
+
+Files are replaced atomically (written next to the target and renamed), so node_exporter never reads half a file.
+The project label is the name of the current directory.
+"""
+
+import contextlib
+import json
+import os
+import re
+import sys
+import time
+import typing
+from dataclasses import asdict, dataclass, field, fields
+from pathlib import Path
+from typing import Optional, Self
+
+if typing.TYPE_CHECKING:
+    from .fanout import TargetResult
+    from .hooks import HookResult
+    from .repositories import Repository
+
+METRICS_DIR = "RESTIC_METRICS_DIR"
+PREFIX = "edwh_restic"
+
+# restic's text output, for scripts that don't use `restic backup --json`:
+_TEXT_FILES_RE = re.compile(r"Files:\s+(\d+) new,\s+(\d+) changed,\s+(\d+) unmodified")
+_TEXT_ADDED_RE = re.compile(r"Added to the repository:\s+([\d.]+ \w+)")
+_TEXT_PROCESSED_RE = re.compile(r"processed (\d+) files, ([\d.]+ \w+) in")
+# `restic stats` (text), for du:
+_STATS_RE = {
+    "repository_size_bytes": re.compile(r"^\s*Total Size:\s+(.+?)\s*$", re.MULTILINE),
+    "repository_files": re.compile(r"^\s*Total File Count:\s+(\d+)\s*$", re.MULTILINE),
+    "repository_snapshots": re.compile(r"^\s*Snapshots processed:\s+(\d+)\s*$", re.MULTILINE),
+}
+_SAMPLE_RE = re.compile(r"^(?P<series>[a-zA-Z_:][\w:]*(?:\{.*\})?)\s+(?P<value>\S+)$")
+_SLUG_RE = re.compile(r"[^a-zA-Z0-9]+")
+
+
+@dataclass
+class BackupSummary:
+    """
+    What `restic backup` did, summed over all backups of a target (the field names of restic's JSON summary).
+    """
+
+    files_new: int = 0
+    files_changed: int = 0
+    files_unmodified: int = 0
+    data_added: int = 0
+    total_files_processed: int = 0
+    total_bytes_processed: int = 0
+
+    @classmethod
+    def from_json(cls, summary: dict) -> Self:
+        return cls(**{item.name: int(summary.get(item.name) or 0) for item in fields(cls)})
+
+    def __add__(self, other: "BackupSummary") -> "BackupSummary":
+        return BackupSummary(
+            **{item.name: getattr(self, item.name) + getattr(other, item.name) for item in fields(self)}
+        )
+
+
+def parse_summary(output: str) -> Optional[BackupSummary]:
+    """
+    Sum the summaries of all `restic backup` calls in some output: `--json` summaries if there are any,
+    otherwise restic's text summary (where sizes are rounded, e.g. '1.234 GiB').
+
+    Returns:
+        None when the output has no backup summary at all.
+    """
+    summaries = []
+    for line in output.splitlines():
+        if '"summary"' not in line:
+            continue
+        try:
+            message = json.loads(line[line.find("{") :])
+        except ValueError:
+            continue
+        if isinstance(message, dict) and message.get("message_type") == "summary":
+            summaries.append(BackupSummary.from_json(message))
+    if summaries:
+        return sum(summaries, BackupSummary())
+
+    from .restic_cache import parse_size
+
+    files = _TEXT_FILES_RE.findall(output)
+    if not files:
+        return None
+
+    summary = BackupSummary()
+    for new, changed, unmodified in files:
+        summary += BackupSummary(files_new=int(new), files_changed=int(changed), files_unmodified=int(unmodified))
+    for added in _TEXT_ADDED_RE.findall(output):
+        summary.data_added += parse_size(added)
+    for count, size in _TEXT_PROCESSED_RE.findall(output):
+        summary.total_files_processed += int(count)
+        summary.total_bytes_processed += parse_size(size)
+    return summary
+
+
+def parse_stats(output: str) -> dict[str, float]:
+    """
+    Repository size, file and snapshot count from the text output of `restic stats` (what the mode reports).
+    """
+    from .restic_cache import parse_size
+
+    values: dict[str, float] = {}
+    for name, regex in _STATS_RE.items():
+        if match := regex.search(output):
+            values[name] = parse_size(match[1]) if name == "repository_size_bytes" else int(match[1])
+    return values
+
+
+@dataclass
+class TargetRun:
+    """
+    One backup target (script or stream) in a run.
+    """
+
+    target: str
+    exited: int
+    duration: float
+    summary: Optional[BackupSummary] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.exited == 0
+
+
+@dataclass
+class Run:
+    """
+    The metrics of one task for one repository.
+
+    Attributes:
+        task (str): 'backup', 'forget', 'prune', 'check' (or 'check-rotate', 'check-metadata') or 'du'.
+        repository (str): repository short name, e.g. 'b2'.
+        path (Optional[Path]): the .prom file to write, None when metrics are off.
+        exited (int): exit status of the task.
+        duration (float): wall clock seconds.
+        finished (float): unix timestamp.
+        targets (list[TargetRun]): per backup target.
+        values (dict[str, float]): extra gauges, e.g. repository_size_bytes for du.
+    """
+
+    task: str
+    repository: str
+    path: Optional[Path] = None
+    exited: int = 0
+    duration: float = 0.0
+    finished: float = 0.0
+    targets: list[TargetRun] = field(default_factory=list)
+    values: dict[str, float] = field(default_factory=dict)
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    @property
+    def ok(self) -> bool:
+        return self.exited == 0
+
+    def add_hook_results(self, results: typing.Iterable["HookResult"]) -> None:
+        for result in results:
+            if summary := getattr(result, "summary", None):
+                parsed = BackupSummary.from_json(summary)
+            else:
+                # (the summaries picked from the complete output, stdout only has its last lines)
+                parsed = parse_summary("\n".join(result.summary_lines) or result.stdout)
+            self.targets.append(TargetRun(target_name(result.script.path), result.exited, result.duration, parsed))
+
+    def add_fan_out_results(self, hook_results: list["HookResult"], results: list["TargetResult"]) -> None:
+        """
+        Per script: its own exit code or the worst exit code of its restic calls for this repository.
+        """
+        for hook_result in hook_results:
+            mine = [result for result in results if result.script == hook_result.script.path]
+            summaries = [BackupSummary(**result.summary) for result in mine if result.summary]
+            self.targets.append(
+                TargetRun(
+                    target_name(hook_result.script.path),
+                    max([hook_result.exited, *(result.exited for result in mine)]),
+                    hook_result.duration,
+                    sum(summaries, BackupSummary()) if summaries else None,
+                )
+            )
+        self.exited = max([self.exited, *(target.exited for target in self.targets)])
+
+
+def target_name(path: str) -> str:
+    """
+    'captain-hooks/backup_files.sh' -> 'backup_files.sh'; streams keep their 'stream:<name>'.
+    """
+    return path if path.startswith("stream:") else Path(path).name
+
+
+def _slug(value: str) -> str:
+    return _SLUG_RE.sub("_", value).strip("_").lower() or "default"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _series(name: str, labels: dict[str, str]) -> str:
+    pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+    return f"{PREFIX}_{name}{{{pairs}}}"
+
+
+def read_samples(path: Path) -> dict[str, float]:
+    """
+    The samples in an existing .prom file, by series (name and labels); empty when there is none.
+    """
+    try:
+        text = path.read_text()
+    except OSError:
+        return {}
+
+    samples = {}
+    for line in text.splitlines():
+        if (match := _SAMPLE_RE.match(line)) and not line.startswith("#"):
+            with contextlib.suppress(ValueError):
+                samples[match["series"]] = float(match["value"])
+    return samples
+
+
+_HELP = {
+    "duration_seconds": "Wall clock time of the last run.",
+    "exit_status": "Exit status of the last run (0 = success).",
+    "last_run_timestamp_seconds": "When the last run finished.",
+    "last_success_timestamp_seconds": "When the last successful run finished.",
+    "target_duration_seconds": "Wall clock time of a backup target (script or stream) in the last run.",
+    "target_exit_status": "Exit status of a backup target in the last run.",
+    "target_last_success_timestamp_seconds": "When a backup target last succeeded.",
+    "backup_files_new": "New files in the last backup of a target.",
+    "backup_files_changed": "Changed files in the last backup of a target.",
+    "backup_files_unmodified": "Unmodified files in the last backup of a target.",
+    "backup_added_bytes": "Bytes added to the repository by the last backup of a target.",
+    "backup_processed_files": "Files processed by the last backup of a target.",
+    "backup_processed_bytes": "Bytes processed by the last backup of a target.",
+    "repository_size_bytes": "Size of the repository in the mode of the last `restic stats`.",
+    "repository_files": "Files in the repository according to the last `restic stats`.",
+    "repository_snapshots": "Snapshots processed by the last `restic stats`.",
+    "forget_removed_snapshots": "Snapshots removed by the last forget.",
+    "check_coverage_ratio": "Part of the repository read in the current cycle of the rotating check.",
+    "check_read_bytes": "Estimated bytes read by the last check.",
+    "check_throughput_bytes_per_second": "Estimated read throughput of the last check.",
+}
+
+_SUMMARY_METRICS = {
+    "backup_files_new": "files_new",
+    "backup_files_changed": "files_changed",
+    "backup_files_unmodified": "files_unmodified",
+    "backup_added_bytes": "data_added",
+    "backup_processed_files": "total_files_processed",
+    "backup_processed_bytes": "total_bytes_processed",
+}
+
+
+def render(run: Run, project: str, previous: Optional[dict[str, float]] = None) -> str:
+    """
+    The run in the Prometheus text format. Last success timestamps of failed runs come from `previous`.
+    """
+    previous = previous or {}
+    samples: dict[str, list[tuple[str, float]]] = {}
+
+    def add(name: str, labels: dict[str, str], value: Optional[float]) -> None:
+        if value is not None:
+            samples.setdefault(name, []).append((_series(name, labels), value))
+
+    def last_success(name: str, labels: dict[str, str], ok: bool) -> None:
+        add(name, labels, run.finished if ok else previous.get(_series(name, labels)))
+
+    labels = {"project": project, "repository": run.repository, "task": run.task}
+    add("duration_seconds", labels, run.duration)
+    add("exit_status", labels, run.exited)
+    add("last_run_timestamp_seconds", labels, run.finished)
+    last_success("last_success_timestamp_seconds", labels, run.ok)
+
+    for target in run.targets:
+        target_labels = labels | {"target": target.target}
+        add("target_duration_seconds", target_labels, target.duration)
+        add("target_exit_status", target_labels, target.exited)
+        last_success("target_last_success_timestamp_seconds", target_labels, target.ok)
+        if target.summary:
+            for name, attribute in _SUMMARY_METRICS.items():
+                add(name, target_labels, getattr(target.summary, attribute))
+
+    for name, value in run.values.items():
+        add(name, labels, value)
+
+    lines = []
+    for name, series in samples.items():
+        lines.append(f"# HELP {PREFIX}_{name} {_HELP[name]}")
+        lines.append(f"# TYPE {PREFIX}_{name} gauge")
+        lines.extend(f"{key} {value}" if isinstance(value, int) else f"{key} {value:.3f}" for key, value in series)
+    return "\n".join(lines) + "\n"
+
+
+def metrics_path(directory: Path, project: str, task: str, repository: str) -> Path:
+    return directory / f"{PREFIX}_{_slug(project)}_{_slug(task)}_{_slug(repository)}.prom"
+
+
+def write_atomic(path: Path, text: str) -> None:
+    """
+    Write to a temporary file in the same directory, then rename it over `path` (node_exporter skips non-.prom).
+    """
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with tmp.open("w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp.chmod(0o644)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def write(run: Run, project: Optional[str] = None) -> None:
+    """
+    Write the metrics of a finished run, if metrics are enabled. Never fails the task.
+    """
+    if not run.enabled:
+        return
+
+    try:
+        run.path.parent.mkdir(parents=True, exist_ok=True)
+        write_atomic(run.path, render(run, project or Path.cwd().name, read_samples(run.path)))
+    except OSError as e:
+        print(f"could not write metrics to {run.path}: {e}", file=sys.stderr)
+
+
+def start(repo: "Repository", task: str) -> Run:
+    """
+    A new run for `repo`, writing to $RESTIC_METRICS_DIR when that is set.
+    """
+    directory = repo.env_config.get(METRICS_DIR) or os.environ.get(METRICS_DIR)
+    path = metrics_path(Path(directory).expanduser(), Path.cwd().name, task, repo._short_name) if directory else None
+    return Run(task=task, repository=repo._short_name, path=path)
+
+
+@contextlib.contextmanager
+def recording(repo: "Repository", task: str, enabled: bool = True) -> typing.Generator[Run, None, None]:
+    """
+    Time the block and write its metrics afterwards, with the exit status of a failure (exception or exit()).
+    """
+    from invoke.exceptions import UnexpectedExit
+
+    run = start(repo, task) if enabled else Run(task=task, repository=repo._short_name)
+    started = time.monotonic()
+    try:
+        yield run
+    except UnexpectedExit as e:
+        run.exited = e.result.exited or 1
+        raise
+    except SystemExit as e:
+        if e.code:
+            run.exited = e.code if isinstance(e.code, int) else 1
+        raise
+    except BaseException:
+        run.exited = max(run.exited, 1)
+        raise
+    finally:
+        run.duration = time.monotonic() - started
+        run.finished = time.time()
+        write(run)
+
+
+def summary_dict(output: str) -> Optional[dict[str, int]]:
+    """
+    parse_summary as a plain dict, for the (JSON) results of the fan-out shim.
+    """
+    summary = parse_summary(output)
+    return asdict(summary) if summary else None
@@ -0,0 +1,185 @@
+"""
+Moving a repository between buckets with rclone, tuned for large repositories.
+
+- The target is probed for emptiness with a single top level listing instead of listing every object.
+- Transfer/checker concurrency is chosen per backend (see Repository.rclone_transfers and friends).
+- When both sides are on the same provider, objects are copied server-side (no download/upload).
+- The repository is moved in parts (data/00 .. data/ff, index, snapshots, keys, config). Finished parts are
+  checkpointed, so an interrupted move continues where it stopped instead of comparing everything again.
+  `config` goes last, so the target only looks like a restic repository once everything else is there.
+"""
+
+import hashlib
+import json
+import os
+import shlex
+import typing
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Self
+
+from invoke import Context
+
+from . import tracing
+from .helpers import cache_dir
+
+if typing.TYPE_CHECKING:
+    from .repositories import Repository
+
+# directories of a restic repository after data/, in the order they are moved (locks are never moved):
+METADATA_DIRS = ("index", "snapshots", "keys")
+CONFIG_FILE = "config"
+
+# rclone config keys that identify where the data lives (as opposed to credentials):
+_PROVIDER_KEYS = ("type", "provider", "endpoint", "auth", "region", "host", "ssh")
+
+
+def parse_rclone_config(section: str) -> dict[str, str]:
+    """
+    'key = value' lines (as returned by Repository.prepare_rclone_config) to a dict.
+    """
+    config = {}
+    for line in section.splitlines():
+        key, sep, value = line.partition("=")
+        if sep:
+            config[key.strip()] = value.strip()
+    return config
+
+
+def same_provider(source: dict[str, str], target: dict[str, str]) -> bool:
+    """
+    Are both rclone remotes on the same provider/endpoint, so objects can be copied server-side?
+    """
+    return all(source.get(key) == target.get(key) for key in _PROVIDER_KEYS)
+
+
+def rclone_flags(
+    source: "Repository",
+    target: "Repository",
+    server_side: bool = True,
+    transfers: Optional[int] = None,
+    checkers: Optional[int] = None,
+) -> list[str]:
+    """
+    Tuning flags for moving between these two repositories: the slowest side determines the concurrency.
+    """
+    flags = [
+        "--transfers",
+        str(transfers or min(source.rclone_transfers, target.rclone_transfers)),
+        "--checkers",
+        str(checkers or min(source.rclone_checkers, target.rclone_checkers)),
+    ]
+    if source.rclone_fast_list and target.rclone_fast_list:
+        # one recursive listing per part instead of one request per directory:
+        flags.append("--fast-list")
+
+    source_config = parse_rclone_config(source.prepare_rclone_config())
+    target_config = parse_rclone_config(target.prepare_rclone_config())
+    if server_side and same_provider(source_config, target_config):
+        flags.append("--server-side-across-configs")
+
+    return flags
+
+
+@dataclass
+class MoveCheckpoint:
+    """
+    Parts of the repository that were moved completely, stored in the plugin's cache dir.
+    """
+
+    path: Path
+    done: list[str] = field(default_factory=list)
+
+    @classmethod
+    def load(cls, source: str, target: str) -> Self:
+        key = hashlib.sha256(f"{source}\n{target}".encode()).hexdigest()[:16]
+        path = cache_dir("move") / f"{key}.json"
+        try:
+            done = json.loads(path.read_text())["done"]
+        except (OSError, ValueError, KeyError):
+            done = []
+        return cls(path=path, done=done)
+
+    def mark(self, part: str) -> None:
+        self.done.append(part)
+        tmp = self.path.with_name(f"{self.path.name}.tmp")
+        tmp.write_text(json.dumps({"done": self.done}))
+        tmp.replace(self.path)
+
+    def clear(self) -> None:
+        self.done = []
+        self.path.unlink(missing_ok=True)
+
+
+class RcloneMove:
+    """
+    Move the repository at `source` (rclone remote:path) to `target`, part by part.
+    """
+
+    def __init__(self, c: Context, rclone: str, source: str, target: str, flags: list[str]) -> None:
+        self.c = c
+        self.rclone = rclone
+        self.source = source
+        self.target = target
+        self.flags = flags
+
+    def _lsf(self, remote: str, *args: str) -> list[str]:
+        ran = tracing.run(self.c, f"{self.rclone} lsf {shlex.join([*args, remote])}", hide=True, warn=True)
+        # a missing bucket/directory is just empty:
+        return ran.stdout.split() if ran.ok else []
+
+    def target_is_empty(self) -> bool:
+        """
+        Only look at the top level: a restic repository has at most a handful of entries there.
+        """
+        return not self._lsf(self.target, "--max-depth", "1")
+
+    def parts(self) -> list[str]:
+        """
+        data/00 .. data/ff (only the ones that exist), then the metadata directories and config.
+        """
+        data = sorted(f"data/{name.rstrip('/')}" for name in self._lsf(f"{self.source}/data", "--dirs-only"))
+        return [*data, *METADATA_DIRS, CONFIG_FILE]
+
+    def move_part(self, part: str, dry: bool = False) -> bool:
+        if part == CONFIG_FILE:
+            command = [
+                "copyto",
+                f"{self.source}/{CONFIG_FILE}",
+                f"{self.target}/{CONFIG_FILE}",
+            ]
+        else:
+            command = ["sync", f"{self.source}/{part}", f"{self.target}/{part}"]
+        if dry:
+            command.append("--dry-run")
+
+        ran = tracing.run(self.c, f"{self.rclone} {shlex.join([*command, *self.flags])}", warn=True)
+        return ran.ok
+
+    def run(self, checkpoint: MoveCheckpoint, dry: bool = False) -> list[str]:
+        """
+        Move every part that isn't in the checkpoint yet. Returns the parts that failed.
+        """
+        failed = []
+        for part in self.parts():
+            if part in checkpoint.done:
+                continue
+            if part == CONFIG_FILE and failed:
+                # don't make an incomplete target look like a usable repository
+                break
+
+            if not self.move_part(part, dry=dry):
+                failed.append(part)
+            elif not dry:
+                checkpoint.mark(part)
+
+        if not failed and not dry:
+            checkpoint.clear()
+        return failed
+
+
+def write_rclone_config(path: Path, source: "Repository", target: "Repository") -> None:
+    # fixed section names, so moving between two repositories of the same type works too:
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(f"[source]\n{source.prepare_rclone_config()}\n\n[target]\n{target.prepare_rclone_config()}\n")
@@ -0,0 +1,260 @@
+"""
+Line by line handling of script and restic output, in constant memory.
+
+A script backing up a big tree with `restic backup --verbose` prints a line per file, easily hundreds of megabytes.
+Instead of buffering all of that (like `c.run` does), an OutputHandler is fed the output as it arrives and keeps:
+- the last TAIL_LINES lines (shown for failing scripts), without the `--json` progress messages;
+- the IDs of created snapshots ('snapshot <id> saved', or the `snapshot_id` of a `--json` summary);
+- restic's backup summaries (the `--json` summary messages and the lines of the text summary);
+and optionally writes the full output to a log file.
+"""
+
+import contextlib
+import json
+import os
+import re
+import signal
+import subprocess
+import threading
+import typing
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+# lines of output kept in memory per script:
+TAIL_LINES = 200
+# longer lines are cut off (e.g. output without any newlines):
+MAX_LINE = 8192
+# lines of restic's summaries kept, a few per backup call:
+SUMMARY_LINES = 1000
+# size of the reads from a script's output:
+CHUNK_SIZE = 64 * 1024
+
+# text output, or the summary of `restic backup --json` (also when prefixed by the fan-out shim):
+SNAPSHOT_RE = re.compile(r'snapshot (\w+) saved|"snapshot_id":\s*"(\w+)"')
+_MESSAGE_TYPE_RE = re.compile(r'"message_type":\s*"(\w+)"')
+# restic's text summary, see metrics.parse_summary:
+_TEXT_SUMMARY_RE = re.compile(r"(^|\] )(Files:|Added to the repository:|processed \d+ files)")
+# colors and cursor movement of restic's progress bar on a terminal:
+_ANSI_RE = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]")
+
+
+class OutputHandler:
+    """
+    Consumes the output of one process. Feed it bytes, then close it (also a context manager).
+
+    Args:
+        tail: how many lines to keep.
+        log: write the complete output to this file.
+        echo: also write the output as-is to this (binary) stream, e.g. sys.stdout.buffer for live output.
+        on_line: called with every (decoded) line.
+    """
+
+    def __init__(
+        self,
+        tail: int = TAIL_LINES,
+        log: Optional[Path] = None,
+        echo: Optional[typing.BinaryIO] = None,
+        on_line: Optional[typing.Callable[[str], None]] = None,
+    ) -> None:
+        self.tail: deque[str] = deque(maxlen=tail)
+        self.snapshots: list[str] = []
+        self.summaries: list[dict] = []
+        self.summary_lines: deque[str] = deque(maxlen=SUMMARY_LINES)
+        self.lines = 0
+        self.bytes = 0
+        self.log = log
+        self.echo = echo
+        self.on_line = on_line
+        self._partial = b""
+        self._log_file: Optional[typing.BinaryIO] = None
+        if log:
+            log.parent.mkdir(parents=True, exist_ok=True)
+            self._log_file = open(log, "wb")  # noqa: SIM115 (closed in close())
+
+    def feed(self, data: bytes) -> None:
+        self.bytes += len(data)
+        if self._log_file:
+            self._log_file.write(data)
+        if self.echo:
+            self.echo.write(data)
+            self.echo.flush()
+
+        *complete, self._partial = (self._partial + data).split(b"\n")
+        for line in complete:
+            self._line(line)
+
+        if len(self._partial) > MAX_LINE:
+            # a progress bar redrawn with carriage returns: only the last state matters
+            self._partial = self._partial.rsplit(b"\r", 1)[-1][:MAX_LINE]
+
+    def _line(self, raw: bytes) -> None:
+        # (a pty ends lines with \r\n, a progress bar redraws the line after a \r)
+        line = raw.rstrip(b"\r").rsplit(b"\r", 1)[-1][:MAX_LINE].decode(errors="replace")
+        if "\x1b" in line:
+            line = _ANSI_RE.sub("", line)
+        self.lines += 1
+        if self.on_line:
+            self.on_line(line)
+
+        if '"message_type"' in line and (match := _MESSAGE_TYPE_RE.search(line)):
+            message_type = match.group(1)
+            if message_type in ("status", "verbose_status"):
+                # progress, many per second
+                return
+            if message_type == "summary":
+                self._summary(line)
+        elif _TEXT_SUMMARY_RE.search(line):
+            self.summary_lines.append(line)
+
+        if "snapshot" in line and (match := SNAPSHOT_RE.search(line)):
+            self.snapshots.append(match.group(1) or match.group(2))
+
+        self.tail.append(line)
+
+    def _summary(self, line: str) -> None:
+        try:
+            message = json.loads(line[line.find("{") :])
+        except ValueError:
+            return
+        if isinstance(message, dict):
+            self.summaries.append(message)
+            self.summary_lines.append(line)
+
+    @property
+    def stdout(self) -> str:
+        """
+        The kept lines, starting with a note about what was left out.
+        """
+        lines = list(self.tail)
+        if (omitted := self.lines - len(lines)) > 0:
+            where = f", full output in {self.log}" if self.log else ""
+            lines.insert(0, f"[... {omitted} earlier lines{where}]")
+        return "".join(f"{line}\n" for line in lines)
+
+    def close(self) -> None:
+        if self._partial:
+            self._line(self._partial)
+            self._partial = b""
+        if self._log_file:
+            self._log_file.close()
+            self._log_file = None
+
+    def __enter__(self) -> "OutputHandler":
+        return self
+
+    def __exit__(self, *_: typing.Any) -> None:
+        self.close()
+
+
+class Timeout:
+    """
+    Kill processes after `seconds` (None: never).
+
+    Args:
+        group: kill the whole process group (of a process started with start_new_session), so e.g. restic started
+               by a script doesn't keep running (and keep the output open) after the script was killed.
+    """
+
+    def __init__(self, seconds: Optional[float], *processes: subprocess.Popen, group: bool = False) -> None:
+        self.expired = False
+        self.processes = list(processes)
+        self.group = group
+        self._timer = threading.Timer(seconds, self._kill) if seconds else None
+
+    def _kill(self) -> None:
+        self.expired = True
+        for process in self.processes:
+            kill(process, signal.SIGKILL, self.group)
+
+    def __enter__(self) -> "Timeout":
+        if self._timer:
+            self._timer.start()
+        return self
+
+    def __exit__(self, *_: typing.Any) -> None:
+        if self._timer:
+            self._timer.cancel()
+
+
+def kill(process: subprocess.Popen, sig: int = signal.SIGKILL, group: bool = False) -> None:
+    with contextlib.suppress(OSError):
+        if group:
+            os.killpg(process.pid, sig)
+        else:
+            process.send_signal(sig)
+
+
+def _read(fd: int) -> bytes:
+    try:
+        return os.read(fd, CHUNK_SIZE)
+    except OSError:
+        # EIO: the other end of a pty was closed
+        return b""
+
+
+def run(
+    command: list[str],
+    handler: OutputHandler,
+    env: Optional[dict[str, str]] = None,
+    timeout: Optional[float] = None,
+    pty: bool = False,
+    stdin: typing.Any = None,
+) -> tuple[int, bool]:
+    """
+    Run a command, feeding its output (stdout and stderr) to `handler` while it runs.
+
+    Args:
+        command: the program and its arguments.
+        handler: gets the output, closed afterwards.
+        env: complete environment (default: the current one).
+        timeout: seconds after which the command (and everything it started) is killed.
+        pty: run on a pseudo-terminal, so programs behave (colors, progress) as when run interactively.
+        stdin: like subprocess.Popen's stdin (default: inherited).
+
+    Returns:
+        (exit code, whether the timeout expired)
+    """
+    master = slave = None
+    if pty:
+        import pty as _pty
+
+        master, slave = _pty.openpty()
+
+    try:
+        process = subprocess.Popen(
+            command,
+            stdin=stdin,
+            stdout=slave if pty else subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+            # in its own process group, to kill everything it started on timeout or interrupt:
+            start_new_session=True,
+        )
+    except OSError:
+        if master is not None:
+            os.close(master)
+        raise
+    finally:
+        if slave is not None:
+            os.close(slave)
+
+    fd = master if pty else process.stdout.fileno()
+    try:
+        with handler, Timeout(timeout, process, group=True) as timer:
+            while chunk := _read(fd):
+                handler.feed(chunk)
+            exited = process.wait()
+    except BaseException:
+        # e.g. ctrl-c: give restic the chance to remove its lock
+        kill(process, signal.SIGINT, group=True)
+        process.wait()
+        raise
+    finally:
+        if pty:
+            os.close(master)
+        elif process.stdout:
+            process.stdout.close()
+
+    # killed by a signal: exit code like a shell reports it
+    return (128 - exited if exited < 0 else exited), timer.expired
@@ -0,0 +1,242 @@
+"""
+When to prune.
+
+`restic prune` lists and repacks pack files while holding an exclusive lock: on cloud backends it is by far the most
+expensive operation. So `forget` only removes snapshots, and prunes afterwards only when one of the thresholds of the
+repository's `[restic.prune.<name>]` section (or `[restic.prune.default]`) is met:
+- `min-unused`: estimated unused space, as part of the repository ('10%' or 0.1);
+- `every-days`: days since the last prune;
+- `after-forgets`: forget runs that removed snapshots since the last prune.
+`max-unused` and `max-repack-size` are passed on to `restic prune`, `after-forget = false` leaves pruning to the prune
+task (unless the forget policy has `prune = true`).
+
+The decision is made without touching the repository, from local state per repository (prune-state.json in the
+cache dir): the sizes restic reported after the last prune, plus the data added by the snapshots forgotten since
+(an upper bound: newer snapshots may still use some of it).
+"""
+
+import datetime as dt
+import json
+import os
+import re
+import time
+import typing
+from dataclasses import asdict, dataclass, field, fields
+from typing import Optional, Self
+
+from .helpers import cache_dir
+
+STATE_FILE = "prune-state.json"
+
+_PERCENT_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*%\s*$")
+# restic prune's statistics (text):
+_REMAINING_RE = re.compile(r"^remaining:\s+\d+ blobs / (.+?)\s*$", re.MULTILINE)
+_UNUSED_RE = re.compile(r"^unused size after prune:\s+(.+?)\s+\(", re.MULTILINE)
+
+
+def ratio(value: str | float | None) -> Optional[float]:
+    """
+    '10%' or 0.1 -> 0.1.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        if not (match := _PERCENT_RE.match(value)):
+            raise ValueError(f"Invalid ratio {value!r}, use e.g. '10%' or 0.1.")
+        return float(match[1]) / 100
+    return float(value)
+
+
+@dataclass
+class PruneSettings:
+    """
+    Thresholds and restic options for pruning a repository.
+
+    Attributes:
+        min_unused (Optional[float]): prune when at least this part of the repository is (estimated) unused.
+        every_days (Optional[float]): prune when the last prune is at least this many days ago.
+        after_forgets (Optional[int]): prune after this many forget runs that removed snapshots.
+        max_unused (Optional[str]): restic's --max-unused, e.g. '5%' or '1G'.
+        max_repack_size (Optional[str]): restic's --max-repack-size, e.g. '2G'.
+        after_forget (bool): prune after forget when a threshold is met (False: only with `prune = true` in the policy).
+    """
+
+    min_unused: Optional[float] = 0.1
+    every_days: Optional[float] = 30
+    after_forgets: Optional[int] = None
+    max_unused: Optional[str] = None
+    max_repack_size: Optional[str] = None
+    after_forget: bool = True
+
+    @classmethod
+    def from_section(cls, section: dict[str, typing.Any]) -> Self:
+        """
+        From a `[restic.prune.<name>]` table, e.g. {'min-unused': '20%', 'every-days': 7, 'max-repack-size': '2G'}.
+        Thresholds that are left out keep their default, 0 (or false) switches a threshold off.
+        """
+        known = {item.name for item in fields(cls)}
+        options = {key.replace("-", "_"): value for key, value in section.items()}
+        if unknown := set(options) - known:
+            raise ValueError(f"Unknown prune settings: {', '.join(sorted(unknown))}")
+
+        if "min_unused" in options:
+            options["min_unused"] = ratio(options["min_unused"]) or None
+        for key in ("every_days", "after_forgets"):
+            if key in options:
+                options[key] = options[key] or None
+        return cls(**options)
+
+    def to_string(self) -> str:
+        """
+        The restic prune arguments.
+        """
+        args = []
+        if self.max_unused:
+            args.append(f"--max-unused {self.max_unused}")
+        if self.max_repack_size:
+            args.append(f"--max-repack-size {self.max_repack_size}")
+        return " ".join(args)
+
+
+@dataclass
+class PruneState:
+    """
+    What this machine knows about the unused space of a repository.
+
+    Attributes:
+        last_prune (Optional[float]): unix timestamp of the last prune, None if it never pruned from here.
+        forgets (int): forget runs that removed snapshots since the last prune.
+        total_bytes (Optional[int]): repository size after the last prune (or from the last `du`).
+        unused_bytes (int): unused after the last prune, plus the data added by snapshots forgotten since.
+    """
+
+    last_prune: Optional[float] = None
+    forgets: int = 0
+    total_bytes: Optional[int] = None
+    unused_bytes: int = 0
+
+    @property
+    def unused_ratio(self) -> Optional[float]:
+        if not self.total_bytes:
+            return None
+        return self.unused_bytes / self.total_bytes
+
+    def describe(self) -> str:
+        if self.last_prune is None:
+            return "never pruned from this machine"
+        last = dt.datetime.fromtimestamp(self.last_prune).strftime("%Y-%m-%d %H:%M")
+        unused = f"{self.unused_ratio:.1%}" if self.unused_ratio is not None else "unknown"
+        return f"last prune {last}, {self.forgets} forgets since, ~{unused} unused"
+
+
+def due(settings: PruneSettings, state: PruneState, now: Optional[float] = None) -> Optional[str]:
+    """
+    Why the repository should be pruned now, or None when no threshold is met.
+    """
+    now = time.time() if now is None else now
+    if state.last_prune is None:
+        return "never pruned from this machine"
+
+    if settings.every_days and now - state.last_prune >= settings.every_days * 86400:
+        return f"last prune is {(now - state.last_prune) / 86400:.0f} days ago (every-days = {settings.every_days:g})"
+    if settings.after_forgets and state.forgets >= settings.after_forgets:
+        return f"{state.forgets} forgets since the last prune (after-forgets = {settings.after_forgets})"
+    if settings.min_unused and (unused := state.unused_ratio) is not None and unused >= settings.min_unused:
+        return f"~{unused:.1%} unused (min-unused = {settings.min_unused:.0%})"
+    return None
+
+
+def load_states() -> dict[str, dict[str, typing.Any]]:
+    try:
+        return json.loads((cache_dir() / STATE_FILE).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def load_state(uri: str) -> PruneState:
+    """
+    The prune state of the repository at `uri` (empty when unknown).
+    """
+    known = {item.name for item in fields(PruneState)}
+    stored = load_states().get(uri, {})
+    return PruneState(**{key: value for key, value in stored.items() if key in known})
+
+
+def save_state(uri: str, state: PruneState) -> None:
+    states = load_states()
+    states[uri] = asdict(state)
+
+    target = cache_dir() / STATE_FILE
+    tmp = target.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(states, indent=2))
+    tmp.replace(target)
+
+
+@dataclass
+class ForgetResult:
+    """
+    What `restic forget --json` did.
+    """
+
+    kept: int = 0
+    removed: int = 0
+    # data_added of the removed snapshots (restic 0.17+ stores a summary in the snapshot, older ones count as 0):
+    removed_bytes: int = 0
+    # (host, paths, kept, removed) per group:
+    groups: list[tuple[str, list[str], int, int]] = field(default_factory=list)
+
+    @classmethod
+    def parse(cls, stdout: str) -> Self:
+        """
+        From the JSON output: a list of groups with `keep` and `remove` snapshot lists.
+        """
+        result = cls()
+        # (one line of JSON, restic may print messages before it)
+        lines = [line for line in stdout.splitlines() if line.startswith("[{") or line.strip() == "[]"]
+        for group in json.loads(lines[-1]) if lines else []:
+            keep, remove = group.get("keep") or [], group.get("remove") or []
+            result.kept += len(keep)
+            result.removed += len(remove)
+            result.removed_bytes += sum((snapshot.get("summary") or {}).get("data_added", 0) for snapshot in remove)
+            result.groups.append((group.get("host") or "", group.get("paths") or [], len(keep), len(remove)))
+        return result
+
+
+def record_forget(uri: str, result: ForgetResult) -> PruneState:
+    """
+    Count a forget run that removed snapshots, and what it likely freed.
+    """
+    state = load_state(uri)
+    if result.removed:
+        state.forgets += 1
+        state.unused_bytes += result.removed_bytes
+        save_state(uri, state)
+    return state
+
+
+def record_prune(uri: str, output: str, now: Optional[float] = None) -> PruneState:
+    """
+    Start counting again after a prune, with the sizes from its output (when restic printed them).
+    """
+    from .restic_cache import parse_size
+
+    state = PruneState(last_prune=time.time() if now is None else now)
+    if match := _REMAINING_RE.search(output):
+        state.total_bytes = parse_size(match[1])
+    if match := _UNUSED_RE.search(output):
+        state.unused_bytes = parse_size(match[1]) or 0
+    elif state.total_bytes is None:
+        # no statistics: keep the last known size, the unused space is unknown again
+        state.total_bytes = load_state(uri).total_bytes
+
+    save_state(uri, state)
+    return state
+
+
+def record_size(uri: str, total_bytes: int) -> None:
+    """
+    A fresh repository size (e.g. from `restic stats --mode raw-data`) makes the unused estimate more precise.
+    """
+    state = load_state(uri)
+    state.total_bytes = total_bytes
+    save_state(uri, state)
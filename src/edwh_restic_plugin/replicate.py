@@ -0,0 +1,213 @@
+"""
+Snapshot replication between two repositories with `restic copy`.
+
+Unlike `move` (which syncs raw bucket objects), `restic copy` only transfers blobs the target doesn't have yet.
+Snapshots that were copied before are remembered in the snapshot cache (per source/target repository ID),
+so repeated runs only list the source (incrementally, via the cache) and copy what is new.
+"""
+
+import contextvars
+import datetime as dt
+import re
+import shlex
+import sys
+import typing
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Optional
+
+from invoke import Context
+from invoke.exceptions import UnexpectedExit
+from termcolor import cprint
+
+from . import tracing
+from .fanout import FanOutTarget, restored_environ, target_for
+from .snapshots import Snapshot, filter_snapshots
+
+if typing.TYPE_CHECKING:
+    from .repositories import Repository
+
+# snapshots per `restic copy` call
+BATCH_SIZE = 20
+
+_RELATIVE_RE = re.compile(r"^(?P<number>\d+)\s*(?P<unit>[mhdw])$")
+_UNITS = {"m": "minutes", "h": "hours", "d": "days", "w": "weeks"}
+
+
+def parse_since(since: str, now: Optional[dt.datetime] = None) -> dt.datetime:
+    """
+    '2024-05-01', '2024-05-01T12:00' or relative like '12h', '7d', '2w' (ago).
+    """
+    now = now or dt.datetime.now(dt.timezone.utc)
+    if match := _RELATIVE_RE.match(since.strip()):
+        return now - dt.timedelta(**{_UNITS[match["unit"]]: int(match["number"])})
+
+    try:
+        moment = dt.datetime.fromisoformat(since.strip())
+    except ValueError as e:
+        raise ValueError(f"Invalid --since {since!r}, use a date (2024-05-01) or age (7d, 12h).") from e
+
+    # naive dates are local time:
+    return moment if moment.tzinfo else moment.astimezone()
+
+
+def select_snapshots(
+    snapshots: typing.Iterable[Snapshot],
+    tags: typing.Iterable[str] = (),
+    host: Optional[str] = None,
+    since: Optional[dt.datetime] = None,
+) -> list[Snapshot]:
+    """
+    Snapshots to copy: matching the filters (whether they were copied before is up to the caller).
+    """
+    return [
+        snapshot
+        for snapshot in filter_snapshots(snapshots, tags=tags, host=host)
+        if since is None or snapshot.time >= since
+    ]
+
+
+def copy_command(restic: str, source: FanOutTarget, target: FanOutTarget, snapshot_ids: list[str]) -> list[str]:
+    # `-o` options apply to every backend of that type, so only use them if just one side needs them:
+    options = target.options if not source.options else source.options if not target.options else []
+    return [restic, "-r", target.uri, *options, "copy", "--from-repo", source.uri, *snapshot_ids]
+
+
+def copy_env(source: FanOutTarget, target: FanOutTarget) -> dict[str, str]:
+    """
+    One environment with the credentials of both repositories (restic copy talks to both).
+
+    Note: two repositories on the same backend type with different credentials (e.g. two S3 accounts)
+    can't be combined this way, since restic reads those from the same variables.
+    """
+    return (
+        source.env
+        | target.env
+        | {
+            "RESTIC_FROM_REPOSITORY": source.uri,
+            "RESTIC_FROM_PASSWORD": source.env.get("RESTIC_PASSWORD", ""),
+        }
+    )
+
+
+@dataclass
+class ReplicationResult:
+    copied: list[str] = field(default_factory=list)
+    failed: list[str] = field(default_factory=list)
+    skipped: int = 0
+
+
+class Replicator:
+    """
+    Copies snapshots from one repository to another in batches, optionally several batches at a time.
+    """
+
+    def __init__(
+        self,
+        c: Context,
+        source: "Repository",
+        target: "Repository",
+        restic: str = "restic",
+        verbose: bool = False,
+    ) -> None:
+        self.c = c
+        self.source_repo = source
+        self.target_repo = target
+        self.restic = restic
+        self.verbose = verbose
+        self.source = target_for(c, source)
+        self.target = target_for(c, target)
+
+    def target_repository_id(self, init: bool = False) -> str:
+        """
+        ID of the target repository; with init=True it is created first if needed
+        (with the chunker parameters of the source, so deduplication between them works).
+        """
+        from .snapshot_cache import SnapshotCache
+
+        with SnapshotCache() as cache, restored_environ():
+            self.target_repo.prepare_env_for_restic(self.c)
+            try:
+                return self.target_repo.repository_id(self.c, cache)
+            except UnexpectedExit:
+                if not init:
+                    raise
+
+            cprint(f"initializing {self.target.uri} with the chunker parameters of {self.source.uri}", color="blue")
+            command = [
+                self.restic,
+                "-r",
+                self.target.uri,
+                "init",
+                "--from-repo",
+                self.source.uri,
+                "--copy-chunker-params",
+            ]
+            tracing.run(
+                self.c, shlex.join(command), env=copy_env(self.source, self.target), replace_env=True, hide=True
+            )
+            return self.target_repo.repository_id(self.c, cache)
+
+    def copy_batch(self, snapshot_ids: list[str]) -> tuple[list[str], bool, str]:
+        command = shlex.join(copy_command(self.restic, self.source, self.target, snapshot_ids))
+        if self.verbose:
+            print("$", command, file=sys.stderr)
+
+        ran = tracing.run(
+            self.c,
+            command,
+            env=copy_env(self.source, self.target),
+            replace_env=True,
+            hide=True,
+            warn=True,
+            in_stream=False,
+        )
+        return snapshot_ids, ran.ok, ran.stdout + ran.stderr
+
+    def run(
+        self,
+        tags: typing.Iterable[str] = (),
+        host: Optional[str] = None,
+        since: Optional[dt.datetime] = None,
+        parallel: int = 1,
+        batch_size: int = BATCH_SIZE,
+        dry: bool = False,
+        refresh: bool = False,
+        init: bool = False,
+    ) -> ReplicationResult:
+        from .snapshot_cache import SnapshotCache
+
+        with restored_environ():
+            snapshots = self.source_repo.list_snapshots(self.c, refresh=refresh, verbose=self.verbose)
+
+        target_id = self.target_repository_id(init=init)
+        with SnapshotCache() as cache:
+            source_id = cache.get_repo_id(self.source.uri)
+            done = cache.replicated_ids(source_id, target_id)
+
+        candidates = select_snapshots(snapshots, tags=tags, host=host, since=since)
+        todo = [snapshot.id for snapshot in candidates if snapshot.id not in done]
+        result = ReplicationResult(skipped=len(candidates) - len(todo))
+
+        if dry or not todo:
+            result.copied = todo if dry else []
+            return result
+
+        batches = [todo[idx : idx + batch_size] for idx in range(0, len(todo), batch_size)]
+        with ThreadPoolExecutor(max_workers=max(1, parallel)) as pool, SnapshotCache() as cache:
+            futures = [pool.submit(contextvars.copy_context().run, self.copy_batch, batch) for batch in batches]
+            for future in as_completed(futures):
+                snapshot_ids, ok, output = future.result()
+                if ok:
+                    # record per batch, so an interrupted run resumes where it stopped:
+                    cache.mark_replicated(source_id, target_id, snapshot_ids)
+                    result.copied.extend(snapshot_ids)
+                else:
+                    result.failed.extend(snapshot_ids)
+                    cprint(f"restic copy failed for {len(snapshot_ids)} snapshots:", color="red", file=sys.stderr)
+                    print(output.rstrip(), file=sys.stderr)
+
+                if self.verbose and ok:
+                    print(output.rstrip(), file=sys.stderr)
+
+        return result
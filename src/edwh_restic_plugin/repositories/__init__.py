@@ -3,31 +3,42 @@ import contextlib
 import datetime
 import heapq
 import importlib
-import importlib.util
-import io
+import json
 import os
 import re
+import shlex
 import sys
 import typing
-from collections import OrderedDict, defaultdict
+from collections import OrderedDict
 from pathlib import Path
 
-import invoke
 from invoke import Context
 from invoke.exceptions import AuthFailure
 from termcolor import cprint
-from tqdm import tqdm
 from typing_extensions import NotRequired
 
-from ..env import DOTENV, check_env, read_dotenv
-from ..forget import ResticForgetPolicy
-from ..helpers import _require_restic, camel_to_snake, fix_tags
+from .. import tracing
+from ..env import DOTENV, check_env, export
+from ..forget import PolicyResolver, ResticForgetPolicy
+from ..helpers import DEFAULT_BACKUP_FOLDER, _require_restic, camel_to_snake, fix_tags
 
+# heavier modules (tqdm, sqlite3, ...) are imported where they are used, to keep CLI startup fast.
 if typing.TYPE_CHECKING:
     from restic_reaper import WipeOutcome
 
-# the path where the restic command is going to be executed
-DEFAULT_BACKUP_FOLDER = Path("captain-hooks")
+    from ..file_index import FileMatch
+    from ..hooks import HookScript
+    from ..metrics import Run
+    from ..prune import PruneSettings
+    from ..restic_binary import ResticCapabilities
+    from ..restic_cache import CacheEntry
+    from ..snapshot_cache import SnapshotCache
+    from ..snapshots import Snapshot
+    from ..streams import StreamTarget
+
+
+# text output, or the summary of `restic backup --json`:
+_SNAPSHOT_RE = re.compile(r'snapshot (.*?) saved|"snapshot_id":\s*"(\w+)"')
 
 
 class SortableMeta(abc.ABCMeta):
@@ -106,9 +117,28 @@ class Repository(abc.ABC, metaclass=SortableMeta):
         os.environ["RESTIC_HOST"] = os.environ.get("RESTIC_HOST") or self.hostarg
         os.environ["RESTIC_REPOSITORY"] = os.environ.get("RESTIC_REPOSITORY") or self.uri
 
+    def _add_restic_cache_dir(self):
+        """
+        Use the managed (shared) cache root, unless RESTIC_CACHE_DIR is set explicitly.
+        Restic creates a subdirectory per repository ID in there, so repositories never mix.
+        """
+        os.environ["RESTIC_CACHE_DIR"] = os.environ.get("RESTIC_CACHE_DIR") or str(self.restic_cache_root)
+
+    def _add_restic_backup_args(self):
+        """
+        $RESTIC_BACKUP_ARGS: the fastest `restic backup` flags the installed restic supports,
+        for use in the backup scripts (e.g. `restic backup $RESTIC_BACKUP_ARGS ...`).
+        """
+        read_concurrency = self.env_config.get("RESTIC_READ_CONCURRENCY")
+        args = self.capabilities.backup_args(int(read_concurrency) if read_concurrency else None)
+        os.environ["RESTIC_BACKUP_ARGS"] = " ".join(args)
+
     def prepare_env_for_restic(self, c: Context):
-        self.prepare_for_restic(c)  # <- abstract method used by all Repositories
-        self._add_missing_boilerpalte_restic_vars()  # <- add $HOST and other common variables that could be missing
+        with tracing.span("backend.prepare", repository=self.__class__.__name__):
+            self.prepare_for_restic(c)  # <- abstract method used by all Repositories
+            self._add_missing_boilerpalte_restic_vars()  # <- add $HOST and other common variables that could be missing
+            self._add_restic_cache_dir()
+            self._add_restic_backup_args()
 
     def __repr__(self):
         cls = self.__class__.__name__
@@ -135,6 +165,11 @@ class Repository(abc.ABC, metaclass=SortableMeta):
         "__pycache__",
     ]
 
+    # rclone tuning for `move`, per backend: parallel transfers/checkers and whether --fast-list pays off.
+    rclone_transfers: int = 4
+    rclone_checkers: int = 8
+    rclone_fast_list: bool = False
+
     _env_path: Path
     env_config: dict[str, str]
 
@@ -147,8 +182,8 @@ class Repository(abc.ABC, metaclass=SortableMeta):
         env_path.touch(exist_ok=True)
         print("start repo init", self.__class__.__name__)
         self._env_path = env_path
-        self.env_config = env = read_dotenv(env_path)
-        os.environ |= env
+        # shared by all repositories using this file, copied to os.environ once per version of the file:
+        self.env_config = env = export(env_path)
         self._restichostname = env.get("RESTICHOSTNAME")  # or None if it is not there
         print("end repo init", self)
 
@@ -176,13 +211,26 @@ class Repository(abc.ABC, metaclass=SortableMeta):
         self.env_config[key] = value
         return value
 
+    @property
+    def capabilities(self) -> "ResticCapabilities":
+        """What the installed restic supports (probed once per binary, see restic_binary)."""
+        from ..restic_binary import capabilities
+
+        return capabilities()
+
     def _restic_self_update(self, c: Context) -> None:
-        if not c.run("restic self-update", hide=True, warn=True):
-            # done
-            return
+        from ..restic_binary import forget_restic
 
-        with contextlib.suppress(AuthFailure):
-            return c.sudo("restic self-update", hide=True, warn=True)
+        try:
+            if not tracing.run(c, "restic self-update", hide=True, warn=True):
+                # done
+                return
+
+            with contextlib.suppress(AuthFailure):
+                return c.sudo("restic self-update", hide=True, warn=True)
+        finally:
+            # a new binary means new capabilities:
+            forget_restic()
 
     def configure(self, c: Context):
         """Configure the backup environment variables."""
@@ -191,13 +239,31 @@ class Repository(abc.ABC, metaclass=SortableMeta):
         # First, make sure restic is up-to-date
         self._restic_self_update(c)
         # This is the command used to configure the environment variables properly.
-        c.run(f"restic init --repository-version 2 -r {self.uri}")
+        version_args = "--repository-version 2 " if self.capabilities.repository_version_2 else ""
+        tracing.run(c, f"restic init {version_args}{self.restic_options} -r {self.uri}")
+
+    @property
+    def restic_cache_root(self) -> Path:
+        """Directory holding restic's cache, shared by all repositories (see RESTIC_CACHE_ROOT)."""
+        from ..restic_cache import cache_root
+
+        return cache_root(self.env_config)
 
     @property
     def hostarg(self):
         """Return the host argument for restic command."""
         return f" --host {self._restichostname} " if self._restichostname else ""
 
+    @property
+    def restic_options(self) -> str:
+        """Extra `-o key=value` options restic needs for this repository (e.g. sftp.command), if any."""
+        return ""
+
+    @property
+    def log_dir(self) -> typing.Optional[str]:
+        """Where the complete output of the captain-hooks scripts is written (RESTIC_LOG_DIR), if anywhere."""
+        return self.env_config.get("RESTIC_LOG_DIR") or os.environ.get("RESTIC_LOG_DIR")
+
     @property
     def targets(self):
         """Return the target files and directories for the backup."""
@@ -215,12 +281,12 @@ class Repository(abc.ABC, metaclass=SortableMeta):
         Parses the stdout from a Restic command to extract the snapshot ID.
 
         Args:
-        - stdout (str): The stdout output from a Restic command.
+        - stdout (str): The stdout output from a Restic command (text, or the summary of `backup --json`).
 
         Returns:
         - The snapshot ID as a string.
         """
-        snapshots_ids = re.findall(r"snapshot (.*?) saved", stdout)
+        snapshots_ids = [text or json_id for text, json_id in _SNAPSHOT_RE.findall(stdout)]
         return snapshots_ids[-1] if snapshots_ids else None
 
     @staticmethod
@@ -234,8 +300,10 @@ class Repository(abc.ABC, metaclass=SortableMeta):
         For example, the verb could be "backup" or "restore". The verb is used in combination with the target to
         search for the backup script files that contain the restic command.
         """
+        from ..hooks import discover
+
         # get files by verb and target. EXAMPLE backup_files_*.sh
-        files = [str(file) for file in DEFAULT_BACKUP_FOLDER.glob(f"{verb}_{target}*")]
+        files = discover(target, verb, DEFAULT_BACKUP_FOLDER)
         # check if no files are found
         if not files:
             print("no files found with target:", target)
@@ -243,6 +311,28 @@ class Repository(abc.ABC, metaclass=SortableMeta):
 
         return files
 
+    @staticmethod
+    def get_hooks(target: str, verb: str, timeout: float = None) -> list["HookScript | StreamTarget"]:
+        """
+        The scripts for 'target' and 'verb', and the stream targets declared in captain-hooks/streams.py
+        (see streams.py; on restore only the ones with a `restore` consumer).
+
+        Args:
+        - target (str): the target of the backup/restore, matched against the start of the script name.
+        - verb (str): "backup" or "restore".
+        - timeout (float, optional): Default maximum runtime per script/stream in seconds.
+        """
+        from ..hooks import HookScript, discover
+        from ..streams import load_streams
+
+        files = discover(target, verb, DEFAULT_BACKUP_FOLDER)
+        streams = load_streams(target, DEFAULT_BACKUP_FOLDER, default_timeout=timeout, verb=verb)
+        if not files and not streams:
+            print("no files found with target:", target)
+            sys.exit(255)
+
+        return [HookScript.from_path(file, default_timeout=timeout) for file in files] + streams
+
     def execute_files(
         self,
         c: Context,
@@ -251,9 +341,12 @@ class Repository(abc.ABC, metaclass=SortableMeta):
         verbose: bool,
         message: str = None,
         snapshot: str = "latest",
+        parallel: int = 1,
+        timeout: float = None,
+        metrics: typing.Optional["Run"] = None,
     ):
         """
-        Executes the backup scripts retrieved by 'get_scripts' function.
+        Executes the backup scripts (and declared streams) retrieved by 'get_hooks'.
 
         Args:
         - verbose (bool): A flag indicating whether to display verbose output.
@@ -262,7 +355,16 @@ class Repository(abc.ABC, metaclass=SortableMeta):
         - message (str, optional): The message to be associated with the backup.
         If not provided, the current local time is used. Defaults to None.
         - snapshot (str, optional): The snapshot to be used for the backup. Defaults to "latest".
+        - parallel (int, optional): How many scripts may run at the same time. Defaults to 1 (one by one).
+        Scripts sharing a `# captain-hooks: group=...` header always run in sequence.
+        - timeout (float, optional): Default maximum runtime per script in seconds.
+        Can be overridden per script with `# captain-hooks: timeout=...`.
+        - metrics (metrics.Run, optional): collects the results per script for the Prometheus metrics.
         """
+        from tqdm import tqdm
+
+        from ..hooks import HookRunner
+
         self.prepare_env_for_restic(c)
 
         # set snapshot available in environment for sh files
@@ -276,52 +378,44 @@ class Repository(abc.ABC, metaclass=SortableMeta):
         # set MSG in environment for sh files
         os.environ["MSG"] = message
 
-        # get files by target and verb. see self.get_scripts for more info
-        files = self.get_scripts(target, verb)
+        # get scripts (and declared streams) by target and verb. see self.get_hooks for more info
+        scripts = self.get_hooks(target, verb, timeout)
 
-        snapshots_created = []
-        file_codes = []
         # run all backup/restore files
-        for file in tqdm(files):
-            if verbose:
-                print("\033[1m running", file, "\033[0m")
-
-            # run the script by default with pty=True,
-            # when the script crashes run the script again but then grab the stdout
+        # (on a pty in sequential mode; with parallel > 1 output is captured and printed per script)
+        runner = HookRunner(c, verbose=verbose, workers=parallel, log_dir=self.log_dir, verb=verb)
+        results = runner.run(scripts, progress=tqdm)
 
-            print(f"{file} output: " if verbose else "", file=sys.stderr)
-            try:
-                ran_script: invoke.runners.Result = c.run(file, hide=not verbose, pty=True)
-                file_codes.append(0)
-            except invoke.exceptions.UnexpectedExit as e:
-                ran_script = e.result
-                file_codes.append(e.result.exited)
+        if metrics is not None:
+            metrics.add_hook_results(results)
 
-            snapshot = self.get_snapshot_from(ran_script.stdout)
-            snapshots_created.append(snapshot)
+        file_codes = [result.exited for result in results]
+        snapshots_created = [result.snapshots[-1] if result.snapshots else None for result in results]
 
-        # send message with backup. see message for more info
-        # also if a tag in tags is None it will be removed by fix_tags
+        # store the message with the backup. see message for more info
+        # also if a snapshot in snapshots_created is None it will be removed by fix_tags
         if verb != "restore":
-            tags = fix_tags(["message", *snapshots_created])
-            c.run(
-                f"restic {self.hostarg} -r {self.uri} backup --tag {','.join(tags)} --stdin --stdin-filename message",
-                in_stream=io.StringIO(message),
-                hide=True,
-            )
+            # (tagging gives the snapshots a new ID)
+            renamed = self.tag_message(c, fix_tags(snapshots_created), message) or {}
+            for result in results:
+                result.snapshots = [renamed.get(snapshot_id, snapshot_id) for snapshot_id in result.snapshots]
 
         print("\n\nfile status codes:")
 
-        for filename, status_code in zip(files, file_codes):
-            if status_code == 0:
-                cprint(f"[success] {filename}", color="green")
+        for result in results:
+            filename = result.script.path
+            if result.timed_out:
+                cprint(f"[timeout ({result.script.timeout}s)] {filename}", color="red")
+            elif result.ok:
+                snapshot = f" (snapshot {result.snapshots[-1][:8]})" if result.snapshots else ""
+                cprint(f"[success] {filename}{snapshot}", color="green")
             else:
-                cprint(f"[failure ({status_code})] {filename}", color="red")
+                cprint(f"[failure ({result.exited})] {filename}", color="red")
 
-        if worst_status_code := max(file_codes) > 0:
+        if (worst_status_code := max(file_codes)) > 0:
             exit(worst_status_code)
 
-    def backup(self, c, verbose: bool, target: str, message: str | None):
+    def backup(self, c, verbose: bool, target: str, message: str | None, parallel: int = 1, timeout: float = None):
         """
         Backs up the specified target.
 
@@ -330,10 +424,17 @@ class Repository(abc.ABC, metaclass=SortableMeta):
         - target (str): The target of the backup (e.g. 'files', 'stream'; default is all types).
         - verb (str): The verb associated with the backup.
         - message (str): The message to be associated with the backup.
+        - parallel (int): How many backup scripts may run at the same time.
+        - timeout (float): Default maximum runtime per script in seconds.
         """
-        self.execute_files(c, target, "backup", verbose, message)
+        from ..metrics import recording
+
+        with recording(self, "backup") as run:
+            self.execute_files(c, target, "backup", verbose, message, parallel=parallel, timeout=timeout, metrics=run)
 
-    def restore(self, c, verbose: bool, target: str, snapshot: str = "latest"):
+    def restore(
+        self, c, verbose: bool, target: str, snapshot: str = "latest", parallel: int = 1, timeout: float = None
+    ):
         """
         Restores the specified target using the specified snapshot or the latest if None is given.
 
@@ -342,17 +443,259 @@ class Repository(abc.ABC, metaclass=SortableMeta):
         - target (str): The target of the restore.
         - verb (str): The verb associated with the restore.
         - snapshot (str, optional): The snapshot to be used for the restore. Defaults to "latest".
+        - parallel (int): How many restore scripts may run at the same time.
+        - timeout (float): Default maximum runtime per script in seconds.
         """
-        self.execute_files(c, target, "restore", verbose, snapshot=snapshot)
+        self.execute_files(c, target, "restore", verbose, snapshot=snapshot, parallel=parallel, timeout=timeout)
 
-    def check(self, c):
+    def check(self, c, mode: str = "full", parts: int = None, budget: str = None) -> None:
         """
         Checks the integrity of the backup repository.
+
+        Args:
+        - mode (str): 'full' reads all data (restic check --read-data), 'rotate' reads the next part of a rotating
+          check (see checks.py), 'metadata' only checks the structure (fast, for daily use).
+        - parts (int): rotate: the number of parts that make up the whole repository
+          (default: RESTIC_CHECK_PARTS, or 10).
+        - budget (str): rotate: read at most this much per run, e.g. '50G' (default: RESTIC_CHECK_BUDGET).
         """
+        import time
+
+        from .. import checks, prune
+        from ..metrics import recording
+
+        if mode not in checks.MODES:
+            raise ValueError(f"Unknown check mode {mode!r}, choose from {', '.join(checks.MODES)}")
+
+        # (the state is stored by uri, which some repositories only know after prepare)
         self.prepare_env_for_restic(c)
-        c.run(f"restic {self.hostarg} -r {self.uri} check --read-data")
+        state = checks.CheckState.load(self.uri)
+        total_bytes = prune.load_state(self.uri).total_bytes
+        subset, part, read_bytes, args = None, None, None, ""
+        if mode == "full":
+            subset, read_bytes, args = "all", total_bytes, "--read-data"
+        elif mode == "rotate":
+            parts = parts or int(self.env_config.get("RESTIC_CHECK_PARTS") or os.environ.get("RESTIC_CHECK_PARTS") or 0)
+            budget_bytes = checks.subset_size(
+                budget or self.env_config.get("RESTIC_CHECK_BUDGET") or os.environ.get("RESTIC_CHECK_BUDGET")
+            )
+            if count := checks.parts_for(parts, budget_bytes, total_bytes):
+                part = state.next_part(count)
+                subset = f"{part}/{count}"
+                read_bytes = total_bytes // count if total_bytes else None
+            else:
+                cprint(
+                    "Repository size unknown (run restic.du --mode raw-data or restic.prune first): "
+                    "reading a random subset within the budget, coverage is not tracked.",
+                    color="yellow",
+                )
+                subset, read_bytes = f"{max(1, budget_bytes // 1024**2)}M", budget_bytes
+            args = f"--read-data-subset={subset}"
+
+        # one metrics file per mode, so a daily metadata check doesn't hide when data was last read:
+        with recording(self, "check" if mode == "full" else f"check-{mode}") as run:
+            started = time.monotonic()
+            ran = tracing.run(c, f"restic {self.hostarg} {self.restic_options} -r {self.uri} check {args}", pty=True)
+
+            result = None
+            if subset:
+                result = checks.CheckRun(
+                    time.time(), subset, time.monotonic() - started, checks.packs_read(ran.stdout), read_bytes
+                )
+                state.record(result, part)
+                print(state.describe())
+            run.values |= checks.check_values(state, result)
+
+    def repository_id(self, c: Context, cache: "SnapshotCache", refresh: bool = False) -> str:
+        """
+        The unique ID of the restic repository (from `restic cat config`), remembered per uri in the cache.
+        """
+        if not refresh and (repo_id := cache.get_repo_id(self.uri)):
+            return repo_id
 
-    def snapshot(self, c: Context, tags: list[str] = None, n: int = 2, verbose: bool = False):
+        config = json.loads(tracing.run(c, f"restic {self.restic_options} -r {self.uri} cat config", hide=True).stdout)
+        cache.set_repo_id(self.uri, config["id"])
+        return config["id"]
+
+    def _fetch_snapshots(self, c: Context, snapshot_ids: typing.Iterable[str] = (), verbose: bool = False):
+        """
+        Get snapshot metadata from the repository, either for specific IDs or everything.
+        """
+        from ..snapshots import parse_snapshots
+
+        command = f"restic {self.restic_options} -r {self.uri} snapshots --json {' '.join(snapshot_ids)}"
+        if verbose:
+            print("$", command, file=sys.stderr)
+
+        # no host filter here, filtering happens on the cached records:
+        return parse_snapshots(tracing.run(c, command, hide=True, env={"RESTIC_HOST": ""}).stdout)
+
+    def list_snapshots(self, c: Context, refresh: bool = False, verbose: bool = False) -> list["Snapshot"]:
+        """
+        All snapshots in this repository (oldest first), via the local snapshot cache.
+
+        The cache is refreshed incrementally: only IDs are listed remotely, and only new snapshots are fetched.
+
+        Args:
+        - refresh (bool): throw away the cached data for this repository and fetch everything again.
+        - verbose (bool): Show more info about what's happening?
+        """
+        from ..snapshot_cache import SnapshotCache
+
+        self.prepare_env_for_restic(c)
+
+        with SnapshotCache() as cache:
+            repo_id = self.repository_id(c, cache, refresh=refresh)
+            if refresh:
+                cache.remove(repo_id, cache.known_ids(repo_id))
+
+            if not cache.known_ids(repo_id):
+                # cold cache: one full listing is cheaper than fetching in batches
+                snapshots = self._fetch_snapshots(c, verbose=verbose)
+                cache.store(repo_id, snapshots)
+                cache.sync(repo_id, [snapshot.id for snapshot in snapshots], fetch=lambda _: [])
+            else:
+                command = f"restic {self.restic_options} -r {self.uri} list snapshots"
+                remote_ids = tracing.run(c, command, hide=True).stdout.split()
+                added, removed = cache.sync(
+                    repo_id, remote_ids, fetch=lambda ids: self._fetch_snapshots(c, ids, verbose=verbose)
+                )
+                if verbose:
+                    print(f"snapshot cache: {added} new, {removed} removed", file=sys.stderr)
+
+            return cache.load(repo_id)
+
+    def index_files(
+        self,
+        c: Context,
+        refresh: bool = False,
+        verbose: bool = False,
+        snapshots: typing.Optional[list["Snapshot"]] = None,
+    ) -> tuple[int, int]:
+        """
+        Bring the local file index (see file_index.py) up to date: `restic ls` only the snapshots that weren't
+        indexed yet, and drop the ones that were forgotten.
+
+        Args:
+        - refresh (bool): Ignore the local snapshot cache and fetch all snapshot metadata again.
+        - verbose (bool): Show more info about what's happening?
+        - snapshots (list, optional): The result of a list_snapshots just before, so it isn't listed again.
+
+        Returns:
+        - (indexed, removed) snapshot counts.
+        """
+        import subprocess
+
+        from tqdm import tqdm
+
+        from ..file_index import FileIndex, parse_nodes
+        from ..snapshot_cache import SnapshotCache
+
+        if snapshots is None:
+            snapshots = self.list_snapshots(c, refresh=refresh)
+        snapshots = [snapshot for snapshot in snapshots if not snapshot.is_message]
+        with SnapshotCache() as cache:
+            repo_id = self.repository_id(c, cache)
+
+        with FileIndex() as index:
+            indexed = index.indexed_ids(repo_id)
+            current = {snapshot.id for snapshot in snapshots}
+            removed = indexed - current
+            index.remove(repo_id, removed)
+
+            todo = [snapshot for snapshot in snapshots if snapshot.id not in indexed]
+            for snapshot in tqdm(todo, disable=not todo):
+                command = f"restic {self.restic_options} -r {self.uri} ls --json {snapshot.id}"
+                if verbose:
+                    print("$", command, file=sys.stderr)
+
+                # streamed, so huge snapshots don't have to fit in memory:
+                with (
+                    tracing.span("restic ls", command=command) as span,
+                    subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE, text=True) as process,
+                ):
+                    entries = index.add(repo_id, snapshot, parse_nodes(process.stdout))
+                span.set(exit_code=process.returncode, entries=entries)
+                if process.returncode:
+                    # not marked complete, so it's tried again next time
+                    cprint(f"restic ls {snapshot.short_id} failed ({process.returncode})", color="red", file=sys.stderr)
+                elif verbose:
+                    print(f"{snapshot.short_id}: {entries} entries", file=sys.stderr)
+
+            if removed:
+                index.vacuum()
+
+        return len(todo), len(removed)
+
+    def find_files(
+        self,
+        c: Context,
+        pattern: str,
+        snapshot_ids: typing.Iterable[str] = None,
+        limit: int = None,
+        update: bool = True,
+    ) -> list["FileMatch"]:
+        """
+        Which snapshots contain files matching 'pattern' (a path, path glob or file name), from the local file index.
+
+        Args:
+        - pattern (str): see file_index.to_glob.
+        - snapshot_ids (list, optional): Only search these snapshots (full IDs).
+        - limit (int, optional): Maximum number of matches.
+        - update (bool): Index new snapshots first (otherwise only the local index is used).
+        """
+        from ..file_index import FileIndex
+        from ..snapshot_cache import SnapshotCache
+
+        self.prepare_env_for_restic(c)
+        if update:
+            self.index_files(c)
+
+        with SnapshotCache() as cache:
+            repo_id = self.repository_id(c, cache)
+        with FileIndex() as index:
+            return index.find(repo_id, pattern, snapshot_ids=snapshot_ids, limit=limit)
+
+    def restore_includes(self, c: Context, patterns: typing.Iterable[str], snapshot: str = "latest") -> list[str]:
+        """
+        Paths for `restic restore --include` matching 'patterns', from the file index.
+
+        For 'latest' (resolved per tag by the restore scripts) paths from any snapshot are used.
+        """
+        from ..file_index import minimal_includes
+
+        snapshot_ids = None if not snapshot or snapshot == "latest" else [snapshot]
+        self.index_files(c)
+        paths = [
+            match.path
+            for pattern in patterns
+            for match in self.find_files(c, pattern, snapshot_ids=snapshot_ids, update=False)
+        ]
+        return minimal_includes(paths)
+
+    def resolve_snapshot(
+        self, c: Context, snapshot: str, refresh: bool = False, snapshots: typing.Optional[list["Snapshot"]] = None
+    ) -> str:
+        """
+        Resolve a (short) snapshot ID to the full ID using the snapshot cache, so typos fail early.
+
+        'latest' is passed through as-is, since restic resolves it per tag in the restore scripts.
+        `snapshots` can be the result of a list_snapshots just before, so it isn't listed again.
+        """
+        if not snapshot or snapshot == "latest":
+            return snapshot
+
+        if snapshots is None:
+            snapshots = self.list_snapshots(c, refresh=refresh)
+        matches = [s.id for s in snapshots if s.id.startswith(snapshot)]
+        if not matches:
+            raise ValueError(f"Snapshot {snapshot} not found in {self!r}.")
+        if len(matches) > 1:
+            raise ValueError(f"Snapshot {snapshot} is ambiguous, could be any of {', '.join(matches)}.")
+
+        return matches[0]
+
+    def snapshot(self, c: Context, tags: list[str] = None, n: int = 2, verbose: bool = False, refresh: bool = False):
         """
         a list of all the backups with a message
 
@@ -360,81 +703,238 @@ class Repository(abc.ABC, metaclass=SortableMeta):
         - tags (list, optional): A list of tags to use for the snapshot. Defaults to None.
         - n (int, optional): The number of latest snapshots to show. Defaults to 2.
         - verbose (bool): Show more info about what's happening?
+        - refresh (bool): Ignore the local snapshot cache and fetch all snapshot metadata again.
 
         Returns:
         None. This function only prints the output to the console.
         """
+        from ..snapshots import MESSAGE_TAG, filter_snapshots, render_table
+
         # choose to see only the files or the stream snapshots
         if tags is None:
             tags = ["files", "stream"]
 
-        self.prepare_env_for_restic(c)
-        tags_flag = "--tag " + " --tag ".join(tags) if tags else ""
-        command = f"restic {self.hostarg} -r {self.uri} snapshots --latest {n} {tags_flag} -c"
-        if verbose:
-            print("$", command, file=sys.stderr)
+        # message snapshots are selected too, so they can be linked to the snapshots they describe:
+        snapshots = filter_snapshots(
+            self.list_snapshots(c, refresh=refresh, verbose=verbose),
+            tags=[*tags, MESSAGE_TAG] if tags else (),
+            host=self._restichostname,
+            latest=n,
+        )
+        messages = self._legacy_messages(c, snapshots, verbose=verbose)
 
-        stdout = c.run(
-            command,
-            hide=True,
-        ).stdout
+        print(render_table(snapshots, messages))
 
-        if verbose:
-            print(stdout, file=sys.stderr)
+    def warm_cache(self, c: Context, verbose: bool = False) -> typing.Optional["CacheEntry"]:
+        """
+        Fill restic's local cache before a backup window: snapshots, index and the trees of the latest snapshots
+        (which restic needs as parents for the next backup).
+
+        Args:
+        - verbose (bool): Show more info about what's happening?
+
+        Returns:
+        The cache entry for this repository after warming, if restic created one.
+        """
+        from tqdm import tqdm
+
+        from ..restic_cache import scan_entry, share
+        from ..snapshot_cache import SnapshotCache
+        from ..snapshots import filter_snapshots
+
+        snapshots = self.list_snapshots(c, verbose=verbose)
+        with SnapshotCache() as cache:
+            repo_id = self.repository_id(c, cache)
+
+        latest = filter_snapshots(
+            [snapshot for snapshot in snapshots if not snapshot.is_message],
+            host=self._restichostname,
+            latest=1,
+        )
+        for snapshot in tqdm(latest, desc="warming"):
+            command = f"restic {self.restic_options} -r {self.uri} ls {snapshot.id}"
+            if verbose:
+                print("$", command, file=sys.stderr)
+            tracing.run(c, command, hide=True, warn=True)
+
+        path = Path(os.environ["RESTIC_CACHE_DIR"]) / repo_id
+        if not path.exists():
+            return None
+
+        if self.env_config.get("RESTIC_CACHE_ROOT"):
+            share(path)
+
+        return scan_entry(path)
+
+    def tag_message(self, c: Context, snapshot_ids: list[str], message: str) -> typing.Optional[dict[str, str]]:
+        """
+        Store a run's message as a tag on the snapshots created in that run, using a single `restic tag` call.
+
+        Restic rewrites tagged snapshots, so they get a new ID: the old ones are dropped from the snapshot cache
+        (the next listing fetches the new ones).
+
+        Returns:
+            None when tagging failed, otherwise the new full ID per ID in `snapshot_ids` (as far as restic reports
+            them, restic >= 0.18 with --json).
+        """
+        from ..snapshot_cache import SnapshotCache
+        from ..snapshots import encode_message_tag, parse_tag_output
+
+        if not snapshot_ids or not message.strip():
+            return {}
+
+        tag = shlex.quote(encode_message_tag(message))
+        command = f"restic {self.restic_options} -r {self.uri} tag --json --add {tag} {' '.join(snapshot_ids)}"
+        ran = tracing.run(c, command, hide=True, warn=True)
+        if not ran.ok:
+            cprint(f"Storing the message on {', '.join(snapshot_ids)} failed: {ran.stderr.strip()}", color="red")
+            return None
+
+        renamed = parse_tag_output(ran.stdout)
+        with SnapshotCache() as cache:
+            if repo_id := cache.get_repo_id(self.uri):
+                known = cache.known_ids(repo_id)
+                cache.remove(repo_id, {full for full in known for short in snapshot_ids if full.startswith(short)})
+
+        return {
+            snapshot_id: new_id
+            for snapshot_id in snapshot_ids
+            for old_id, new_id in renamed.items()
+            if old_id.startswith(snapshot_id)
+        }
+
+    def _legacy_messages(self, c: Context, snapshots: list["Snapshot"], verbose: bool = False) -> dict[str, str]:
+        """
+        Read messages from old-style 'message' snapshots, for snapshots that don't have a message tag yet.
+
+        Use `restic.migrate-messages` to convert these, so listing doesn't need a `restic dump` per message.
+        """
+        from ..snapshots import link_messages
+
+        visible_ids = {
+            snapshot.short_id for snapshot in snapshots if not snapshot.is_message and snapshot.message is None
+        }
 
-        snapshot_lines = re.findall(r"^([0-9a-z]{8})\s", stdout, re.MULTILINE)
-        main_tag_per_snapshot = {
-            snapshot: re.findall(rf"^{snapshot}.*?(\w*)$", stdout, re.MULTILINE)
-            for snapshot in snapshot_lines
-            # snapshot: re.findall(rf"^{snapshot}", stdout) for snapshot in snapshots
+        # key is the short id of the source snapshot, value is the snapshot containing its message
+        message_snapshot_per_snapshot = {
+            snapshot_id: message_snapshot
+            for snapshot_id, message_snapshot in link_messages(snapshots).items()
+            if snapshot_id in visible_ids
         }
 
-        message_snapshot_per_snapshot = defaultdict(list)  # key is source, value is snapshot containing the message
-        for snapshot, possible_tag_names in main_tag_per_snapshot.items():
-            tag_name = possible_tag_names[0]
-            if tag_name != "message":
+        # multiple snapshots from one run share the same message snapshot, so only dump each one once:
+        message_per_message_snapshot: dict[str, str] = {}
+        for message_snapshot in message_snapshot_per_snapshot.values():
+            if message_snapshot.id in message_per_message_snapshot:
                 continue
-            for _, is_message_for_snapshot_id in re.findall(rf"\n{snapshot}.*(\n\s+(.*)\n)+", stdout):
-                message_snapshot_per_snapshot[is_message_for_snapshot_id].append(snapshot)
 
-        for snapshot, message_snapshots in message_snapshot_per_snapshot.items():
-            # print all Restic messages
-            command = f"restic {self.hostarg} -r {self.uri} dump {message_snapshots[0]} --tag message message"
+            command = (
+                f"restic {self.hostarg} {self.restic_options} -r {self.uri} "
+                f"dump {message_snapshot.id} --tag message message"
+            )
             if verbose:
                 print("$", command, file=sys.stderr)
 
-            restore_output = c.run(
+            ran = tracing.run(
+                c,
                 command,
                 hide=True,
                 warn=True,
-            ).stdout
+            )
 
             if verbose:
-                print(restore_output, file=sys.stderr)
+                print(ran.stdout, file=sys.stderr)
+                print("---\n", file=sys.stderr)
 
-            message = restore_output.strip()
-            stdout = re.sub(rf"\n{snapshot}(.*)\n", rf"\n{snapshot}\1 : [{message}]\n", stdout)
+            # (a failed dump counts as no message)
+            message_per_message_snapshot[message_snapshot.id] = ran.stdout.strip() if ran.ok else ""
 
-            if verbose:
-                print("---\n", file=sys.stderr)
+        return {
+            snapshot_id: message_per_message_snapshot[message_snapshot.id]
+            for snapshot_id, message_snapshot in message_snapshot_per_snapshot.items()
+        }
+
+    def migrate_message_snapshots(self, c: Context, dry: bool = False, verbose: bool = False) -> None:
+        """
+        Fold old-style 'message' snapshots into message tags on the snapshots they describe,
+        then forget the message snapshots whose message is now stored on every snapshot it describes.
+        The others (empty or unreadable message, tagging failed, no snapshot to move it to) are kept and reported.
+
+        Args:
+        - dry (bool): only show what would happen.
+        - verbose (bool): Show more info about what's happening?
+        """
+        from ..snapshots import link_messages
 
-        print(stdout)
+        snapshots = self.list_snapshots(c, refresh=True, verbose=verbose)
+        message_snapshots = [snapshot for snapshot in snapshots if snapshot.is_message]
+        if not message_snapshots:
+            cprint("No message snapshots to migrate.", color="green")
+            return
 
-    def determine_forget_policy(self) -> typing.Optional[ResticForgetPolicy]:
-        for option in (
-            self._short_name,
-            *self._aliases,
-            "default",
-        ):
-            if policy := ResticForgetPolicy.get_or_copy_policy(option):
-                return policy
+        existing = {snapshot.short_id: snapshot for snapshot in snapshots if not snapshot.is_message}
+        # (only contains snapshots without a message tag yet)
+        messages = self._legacy_messages(c, snapshots, verbose=verbose)
+
+        described: dict[str, list[str]] = {}
+        for snapshot_id, message_snapshot in link_messages(snapshots).items():
+            if snapshot_id in existing:
+                described.setdefault(message_snapshot.id, []).append(snapshot_id)
+
+        ids_per_message: dict[str, list[str]] = {}
+        for snapshot_id, message in messages.items():
+            if snapshot_id in existing and message:
+                ids_per_message.setdefault(message, []).append(snapshot_id)
+
+        # snapshots that have their message as a tag now (or already had one):
+        tagged = {snapshot_id for snapshot_id, snapshot in existing.items() if snapshot.message is not None}
+        for message, snapshot_ids in ids_per_message.items():
+            cprint(f"{message!r} -> {', '.join(snapshot_ids)}", color="blue")
+            if dry or self.tag_message(c, snapshot_ids, message) is not None:
+                tagged.update(snapshot_ids)
+
+        done, kept = [], []
+        for message_snapshot in message_snapshots:
+            snapshot_ids = described.get(message_snapshot.id, [])
+            if not snapshot_ids:
+                kept.append(f"{message_snapshot.short_id}: describes no snapshot that is still there")
+            elif pending := [snapshot_id for snapshot_id in snapshot_ids if snapshot_id not in tagged]:
+                why = "tagging failed" if messages.get(pending[0]) else "its message is empty or could not be read"
+                kept.append(f"{message_snapshot.short_id}: {why} ({', '.join(pending)})")
+            else:
+                done.append(message_snapshot)
+
+        if kept:
+            cprint(f"Keeping {len(kept)} message snapshots:", color="yellow")
+            for line in kept:
+                print(f"  {line}")
+
+        if not done:
+            return
 
-        return None
+        forget_ids = " ".join(snapshot.id for snapshot in done)
+        cprint(f"$ restic forget {len(done)} message snapshots", color="blue")
+        if not dry:
+            tracing.run(c, f"restic {self.restic_options} -r {self.uri} forget {forget_ids}", hide=not verbose)
+            # IDs changed because of tagging and forgetting:
+            self.list_snapshots(c, verbose=verbose)
+
+    def determine_forget_policy(self, copy: bool = False) -> typing.Optional[ResticForgetPolicy]:
+        """
+        The forget policy for this repository from .toml or default.toml (short name, aliases, then 'default').
+
+        Args:
+        - copy (bool): write a policy that comes from default.toml into .toml. Defaults to False (read only).
+        """
+        return PolicyResolver().resolve([self._short_name, *self._aliases], copy=copy)
 
     def forget(self, c: Context, policy: typing.Optional[ResticForgetPolicy] = None, dry: bool = False) -> None:
         """
         Prepare environment and execute restic forget command.
 
+        Forget itself never prunes: `prune` runs afterwards when its thresholds are met (see prune.py), unless
+        the repository's prune settings have `after-forget = false` and the policy doesn't have `prune = true`.
+
         Args:
             c (Context): The context in which the task is executed.
             policy (Optional[ResticForgetPolicy]): An optional forgetting policy. If not provided, it will be determined
@@ -442,6 +942,11 @@ class Repository(abc.ABC, metaclass=SortableMeta):
             dry (bool): If set to True, performs a dry run of the forget operation without making any changes.
                 Defaults to False.
         """
+        import dataclasses
+
+        from .. import prune
+        from ..metrics import recording
+
         self.prepare_env_for_restic(c)
 
         policy = policy or self.determine_forget_policy()
@@ -451,13 +956,66 @@ class Repository(abc.ABC, metaclass=SortableMeta):
 
         policy.dry = dry
 
-        args = policy.to_string()
+        args = dataclasses.replace(policy, prune=False).to_string()
 
         cprint(f"$ restic forget {args}", color="blue")
-        c.run(
-            f"restic forget {args}",
-            pty=True,
-        )
+        # a dry run says nothing about the state of the repository:
+        with recording(self, "forget", enabled=not dry) as run:
+            # (stderr for errors and warnings, the JSON is summarized below)
+            ran = tracing.run(c, f"restic {self.restic_options} forget --json {args}", hide="out")
+            result = prune.ForgetResult.parse(ran.stdout)
+            run.values["forget_removed_snapshots"] = result.removed
+
+        for host, paths, kept, removed in result.groups:
+            print(f"{host} {', '.join(paths)}: keep {kept}, {'would remove' if dry else 'removed'} {removed}")
+
+        if not dry:
+            prune.record_forget(self.uri, result)
+            if policy.prune or self.determine_prune_settings().after_forget:
+                self.prune(c)
+
+    def determine_prune_settings(self) -> "PruneSettings":
+        """
+        The prune thresholds for this repository, from [restic.prune.<name>] in .toml or default.toml
+        (short name, aliases, then 'default'), or the defaults of PruneSettings.
+        """
+        from ..prune import PruneSettings
+
+        if found := PolicyResolver().find([self._short_name, *self._aliases], table="prune"):
+            return PruneSettings.from_section(found[2])
+        return PruneSettings()
+
+    def prune(self, c: Context, force: bool = False, dry: bool = False) -> bool:
+        """
+        Run restic prune if one of the thresholds is met (or when forced), and remember the outcome locally.
+
+        Args:
+        - force (bool): prune regardless of the thresholds.
+        - dry (bool): only show what restic prune would do.
+
+        Returns:
+            bool: whether restic prune was run.
+        """
+        from .. import prune
+        from ..metrics import recording
+
+        # (the state is stored by uri, which some repositories only know after prepare)
+        self.prepare_env_for_restic(c)
+        settings = self.determine_prune_settings()
+        state = prune.load_state(self.uri)
+        if not (reason := "forced" if force else prune.due(settings, state)):
+            cprint(f"prune not needed yet: {state.describe()}", color="blue")
+            return False
+
+        args = " ".join(filter(None, [settings.to_string(), "--dry-run" if dry else ""]))
+
+        cprint(f"$ restic prune {args}  # {reason}", color="blue")
+        with recording(self, "prune", enabled=not dry):
+            ran = tracing.run(c, f"restic {self.restic_options} prune {args}", pty=True)
+
+        if not dry:
+            prune.record_prune(self.uri, ran.stdout)
+        return True
 
     # noop gt, lt etc methods
 
@@ -472,64 +1030,134 @@ class RepositoryRegistration(typing.TypedDict):
     short_name: str
     aliases: NotRequired[tuple[str, ...]]
     priority: NotRequired[int]
+    # submodule of .repositories that defines the class, so it can be imported on demand:
+    module: NotRequired[str]
 
 
 class RepositoryRegistrations:
+    """
+    Registry of Repository classes by short name and aliases.
+
+    Names, aliases and priorities of the builtin backends come from the static `manifest`,
+    so resolving a name only imports the one backend module that is actually used.
+    """
+
     def __init__(self) -> None:
         # _queue is for internal use by heapq only!
         # external api should use .queue !!!
-        self._queue: list[tuple[int, typing.Type[Repository], RepositoryRegistration]] = []
-        # aliases stores a reference for each name to the Repo class
-        self._aliases: dict[str, typing.Type[Repository]] = {}
+        self._queue: list[tuple[int, str]] = []
+        # settings per short name, for both loaded and not-yet-imported (manifest) repositories
+        self._settings: dict[str, RepositoryRegistration] = {}
+        # classes that have been imported/registered, per short name
+        self._classes: dict[str, typing.Type[Repository]] = {}
+        # aliases stores a reference for each name to the short name
+        self._aliases: dict[str, str] = {}
+        self._manifest_loaded = False
 
-    def push(self, repo: typing.Type[Repository], settings: RepositoryRegistration):
+    @staticmethod
+    def _priority(settings: RepositoryRegistration) -> int:
         priority = settings.get("priority", -1)
         if priority < 0:
             priority = sys.maxsize - priority  # very high int
+        return priority
+
+    def _add(self, settings: RepositoryRegistration) -> None:
+        short_name = settings["short_name"]
+        if short_name not in self._settings:
+            heapq.heappush(self._queue, (self._priority(settings), short_name))
 
-        heapq.heappush(self._queue, (priority, repo, settings))
-        self._aliases[settings["short_name"]] = repo
+        self._settings[short_name] = settings
+        self._aliases[short_name] = short_name
         for alias in settings.get("aliases", []):
-            self._aliases[alias] = repo
+            self._aliases[alias] = short_name
 
-    @property
-    def queue(self):
-        if not self._queue:
-            self._find_items()
+    def push(self, repo: typing.Type[Repository], settings: RepositoryRegistration):
+        self._add(settings)
+        self._classes[settings["short_name"]] = repo
+
+    def _ensure_manifest(self) -> None:
+        """
+        Add the builtin repositories from the manifest (without importing them).
+
+        Skipped when custom repositories were registered on an empty registry (e.g. in tests after .clear()).
+        """
+        if self._manifest_loaded:
+            return
+
+        if any(not repo.__module__.startswith(__name__) for repo in self._classes.values()):
+            return
+
+        from .manifest import MANIFEST
+
+        for settings in MANIFEST:
+            if settings["short_name"] not in self._settings:
+                self._add(typing.cast(RepositoryRegistration, dict(settings)))
+
+        self._manifest_loaded = True
+
+    def _load(self, short_name: str) -> typing.Type[Repository] | None:
+        if repo := self._classes.get(short_name):
+            return repo
+
+        if module := self._settings[short_name].get("module"):
+            # importing the module runs @register, which pushes the class:
+            importlib.import_module(f".{module}", package=__name__)
 
-        return self._queue
+        return self._classes.get(short_name)
+
+    def names(self) -> list[str]:
+        """
+        Short names of all repositories in priority order, without importing any backend module.
+        """
+        self._ensure_manifest()
+        return [short_name for _, short_name in sorted(self._queue)]
+
+    @property
+    def queue(self) -> list[tuple[int, typing.Type[Repository], RepositoryRegistration]]:
+        """
+        (priority, class, settings) for every repository in priority order. Imports all backends!
+        """
+        return [
+            (priority, repo, self._settings[short_name])
+            for priority, short_name in sorted(self._queue)
+            if (repo := self._load(short_name))
+        ]
 
     def clear(self):
         self._queue = []
+        self._settings = {}
+        self._classes = {}
         self._aliases = {}
+        self._manifest_loaded = False
 
     def get(self, name: str) -> typing.Type[Repository] | None:
-        return self._aliases.get(name)
+        """
+        Find a repository class by short name or alias, importing only its own module.
+        """
+        if name not in self._aliases:
+            self._ensure_manifest()
+
+        if not (short_name := self._aliases.get(name)):
+            return None
+
+        return self._load(short_name)
 
     def to_sorted_list(self):
-        # No need for sorting here; heapq maintains the heap property
         return list(self)
 
     def to_ordered_dict(self) -> OrderedDict[str, typing.Type[Repository]]:
+        self._ensure_manifest()
         ordered_dict = OrderedDict()
         for _, item, settings in self.queue:
             ordered_dict[settings["short_name"]] = item
         return ordered_dict
 
     def __iter__(self) -> typing.Generator[typing.Type[Repository], None, None]:
+        self._ensure_manifest()
         return (item[1] for item in self.queue)
 
     def __bool__(self):
-        return bool(self.queue)
-
-    def _find_items(self) -> None:
-        # import all registrations in this folder, so @register adds them to _queue
-        package_path = Path(__file__).resolve().parent
-
-        for file_path in package_path.glob("*.py"):
-            pkg = file_path.stem
-            if not pkg.startswith("__"):
-                importlib.import_module(f".{pkg}", package=__name__)
+        return bool(self.names())
 
 
 def register(
@@ -551,6 +1179,7 @@ def register(
             "short_name": name_or_derived,
             "aliases": aliases,
             "priority": priority,
+            "module": cls.__module__.removeprefix(f"{__name__}."),
         }
 
         registrations.push(cls, settings)
@@ -1,14 +1,21 @@
 import os
+from pathlib import Path
 
 from invoke import Context
 
+from ..env import DOTENV
 from . import Repository, register
 
 
 @register(priority=3)
 class B2Repository(Repository):
-    def __init__(self):
-        super().__init__()
+    # object storage handles many parallel requests well:
+    rclone_transfers = 32
+    rclone_checkers = 64
+    rclone_fast_list = True
+
+    def __init__(self, env_path: Path = DOTENV):
+        super().__init__(env_path)
         self.key = None
         self.keyid = None
         self.bucket_name = None
@@ -1,16 +1,21 @@
 import os
+from pathlib import Path
 
 from edwh.helpers import generate_password
 from invoke import Context
-from restic_reaper import LocalConfig, wipe_repository_sync
 
+from ..env import DOTENV
 from . import Repository, register
 
 
 @register()
 class LocalRepository(Repository):
-    def __init__(self):
-        super().__init__()
+    # bound by the local disk:
+    rclone_transfers = 8
+    rclone_checkers = 16
+
+    def __init__(self, env_path: Path = DOTENV):
+        super().__init__(env_path)
         self.password = None
         self.name = None
 
@@ -47,7 +52,16 @@ class LocalRepository(Repository):
         """
         return getattr(self, "name", None) or self.env_config.get("LOCAL_NAME")
 
+    @property
+    def bucket(self):
+        return self.env_config["LOCAL_NAME"]
+
+    def prepare_rclone_config(self):
+        return """type = local"""
+
     def wipe(self, dry: bool = False):
+        from restic_reaper import LocalConfig, wipe_repository_sync
+
         config = LocalConfig(
             root=self.env_config["LOCAL_NAME"],
         )
@@ -0,0 +1,77 @@
+"""
+Static metadata of the builtin repositories, so names can be resolved without importing every backend.
+
+Generated from the @register() decorators, regenerate after adding or changing a backend:
+
+    python -m edwh_restic_plugin.repositories.manifest
+"""
+
+from pathlib import Path
+
+MANIFEST = (
+    # -- generated, do not edit by hand --
+    {"short_name": "hetzner", "aliases": (), "priority": 1, "module": "hetzner"},
+    {"short_name": "os", "aliases": ("swift", "openstack"), "priority": 2, "module": "swift"},
+    {"short_name": "b2", "aliases": (), "priority": 3, "module": "b2"},
+    {"short_name": "r2", "aliases": (), "priority": 4, "module": "r2"},
+    {"short_name": "s3", "aliases": (), "priority": 5, "module": "s3"},
+    {"short_name": "oracle", "aliases": (), "priority": 6, "module": "oracle"},
+    {"short_name": "sftp", "aliases": (), "priority": 10, "module": "sftp"},
+    {"short_name": "local", "aliases": (), "priority": -1, "module": "local"},
+)
+
+
+def build_manifest() -> list[dict]:
+    """
+    Import every backend module and collect the registration settings of the repositories it defines.
+    """
+    import importlib
+
+    from . import RepositoryRegistrations
+
+    package_path = Path(__file__).resolve().parent
+    package = __package__
+
+    entries = []
+    for file_path in sorted(package_path.glob("*.py")):
+        pkg = file_path.stem
+        if pkg.startswith("__") or pkg == "manifest":
+            continue
+
+        module = importlib.import_module(f".{pkg}", package=package)
+        for cls in vars(module).values():
+            # only classes decorated with @register in this very module:
+            if isinstance(cls, type) and cls.__module__ == module.__name__ and "_short_name" in vars(cls):
+                entries.append(
+                    {
+                        "short_name": cls._short_name,
+                        "aliases": tuple(cls._aliases),
+                        "priority": cls._priority,
+                        "module": pkg,
+                    }
+                )
+
+    return sorted(entries, key=lambda item: (RepositoryRegistrations._priority(item), item["short_name"]))
+
+
+def _format_entry(entry: dict) -> str:
+    # black-compatible (double quoted) literal
+    aliases = ", ".join(f'"{alias}"' for alias in entry["aliases"])
+    aliases = f"({aliases},)" if len(entry["aliases"]) == 1 else f"({aliases})"
+    return (
+        f'    {{"short_name": "{entry["short_name"]}", "aliases": {aliases}, '
+        f'"priority": {entry["priority"]}, "module": "{entry["module"]}"}},\n'
+    )
+
+
+def write_manifest() -> None:
+    entries = "".join(_format_entry(entry) for entry in build_manifest())
+    source = Path(__file__).read_text()
+    start = source.index("MANIFEST = (\n") + len("MANIFEST = (\n")
+    end = source.index(")\n", start)
+    marker = "    # -- generated, do not edit by hand --\n"
+    Path(__file__).write_text(source[:start] + marker + entries + source[end:])
+
+
+if __name__ == "__main__":
+    write_manifest()
@@ -1,14 +1,22 @@
 import os
+import typing
 
 from edwh.helpers import generate_password
 from invoke import Context
-from restic_reaper import S3Config, wipe_repository_sync
 
 from . import Repository, register
 
+if typing.TYPE_CHECKING:
+    from restic_reaper import S3Config
+
 
 @register("s3", priority=5)
 class S3Repository(Repository):
+    # object storage handles many parallel requests well:
+    rclone_transfers = 32
+    rclone_checkers = 64
+    rclone_fast_list = True
+
     # todo: currently tested on Oracle s3 compat and other non-Amazon S3 compatible services, so check with actual S3!
     def setup(self) -> None:
         self.check_env(
@@ -54,7 +62,9 @@ class S3Repository(Repository):
         return f"s3:{base}/{bucket}"
 
     # TODO add region for wipe
-    def s3_wipe_config(self) -> S3Config:
+    def s3_wipe_config(self) -> "S3Config":
+        from restic_reaper import S3Config
+
         bucket = self.bucket
         endpoint = self.uri.removeprefix("s3:").removesuffix(f"/{bucket}").strip("/")
         return S3Config(
@@ -66,6 +76,8 @@ class S3Repository(Repository):
         )
 
     def wipe(self, dry: bool = False):
+        from restic_reaper import wipe_repository_sync
+
         # assumes 'prepare_for_restic' was ran
         config = self.s3_wipe_config()
         return wipe_repository_sync(**config, dry=dry)
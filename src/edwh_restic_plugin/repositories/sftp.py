@@ -1,17 +1,20 @@
 import os
+import sys
+from pathlib import Path
 
-from restic_reaper import SftpConfig, wipe_repository_sync
-
+from ..env import DOTENV
+from ..ssh_master import SSHMaster
 from . import Repository, register
 
 
 @register("sftp", priority=10)
 class SFTPRepository(Repository):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, env_path: Path = DOTENV):
+        super().__init__(env_path)
         self.hostname = None
         self.password = None
         self.name = None
+        self.ssh_master = None
 
     def setup(self):
         """Ensure the required settings are defined in the .env file."""
@@ -41,20 +44,30 @@ class SFTPRepository(Repository):
             comment="Path to the private key file used for SFTP authentication (for wipe operations; optional).",
         )
 
-    def prepare_for_restic(self, c):
+    def prepare_for_restic(self, _):
         """read out of .env file"""
         env = self.env_config
 
         self.name = env["SFTP_NAME"]
         self.password = env["SFTP_PASSWORD"]
         self.hostname = env["SFTP_HOSTNAME"]
-        os.environ["HOST"] = self.hostarg
+        self.ssh_master = SSHMaster.from_env(self.hostname, env)
+        try:
+            self.ssh_master.socket_dir
+        except ValueError as e:
+            # restic can still connect by itself, just without the shared connection:
+            print(e, file=sys.stderr)
+            self.ssh_master = None
+        # scripts call `restic $HOST -r $URI ...`, so $HOST also carries the option to use the shared connection:
+        os.environ["HOST"] = f"{self.hostarg} {self.restic_options} "
         os.environ["URI"] = self.uri
         os.environ["RESTIC_HOST"] = self.hostarg
         os.environ["RESTIC_REPOSITORY"] = self.uri
         os.environ["RESTIC_PASSWORD"] = self.password
-        ran = c.run(f'ssh {self.hostname} "exit"', warn=True, hide=True)
-        if not ran.ok:
+        # reachability check, which also starts the master connection (or reuses a running one):
+        ok, error = self.ssh_master.start() if self.ssh_master else (True, "")
+        if not ok:
+            print(error)
             print(
                 """
                 SSH config file not (properly) configured, configure according to the following format:
@@ -68,6 +81,10 @@ class SFTPRepository(Repository):
             )
             exit(1)
 
+    @property
+    def restic_options(self) -> str:
+        return self.ssh_master.restic_option() if self.ssh_master else ""
+
     @property
     def uri(self):
         """
@@ -75,7 +92,19 @@ class SFTPRepository(Repository):
         """
         return f"sftp:{self.hostname}:{self.name}"
 
+    @property
+    def bucket(self):
+        return self.env_config["SFTP_NAME"]
+
+    def prepare_rclone_config(self):
+        env = self.env_config
+        # rclone uses the ssh config for the host alias, like restic does:
+        return f"""type = sftp
+    ssh = ssh {env["SFTP_HOSTNAME"]}"""
+
     def wipe(self, dry: bool = False):
+        from restic_reaper import SftpConfig, wipe_repository_sync
+
         env = self.env_config
         config = SftpConfig(
             endpoint=env["SFTP_HOSTNAME"],
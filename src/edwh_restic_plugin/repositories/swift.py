@@ -1,8 +1,10 @@
 import os
+import sys
+from pathlib import Path
 
 from invoke import Context
-from restic_reaper import SwiftConfig, wipe_repository_sync
 
+from ..env import DOTENV
 from . import Repository, register
 
 
@@ -12,8 +14,13 @@ from . import Repository, register
     priority=2,  # high prio
 )
 class SwiftRepository(Repository):
-    def __init__(self):
-        super().__init__()
+    # object storage, but Swift clusters tend to rate limit earlier than S3:
+    rclone_transfers = 16
+    rclone_checkers = 32
+    rclone_fast_list = True
+
+    def __init__(self, env_path: Path = DOTENV):
+        super().__init__(env_path)
         self.restic_password = None
         self.password = None
         self.container_name = None
@@ -91,6 +98,25 @@ class SwiftRepository(Repository):
         os.environ["RESTIC_HOST"] = self.hostarg
         os.environ["HOST"] = self.hostarg
         os.environ["URI"] = self.uri
+        self._add_auth_token()
+
+    def _add_auth_token(self):
+        """
+        Authenticate once and let restic use the (cached) token, instead of a Keystone login per restic process.
+        """
+        from ..keystone import KeystoneConfig, KeystoneError, TokenCache
+
+        try:
+            token = TokenCache().get(KeystoneConfig.from_env(self.env_config))
+        except KeystoneError as e:
+            # restic can still authenticate with the password itself:
+            print(f"{e} Falling back to password authentication.", file=sys.stderr)
+            os.environ.pop("OS_AUTH_TOKEN", None)
+            os.environ.pop("OS_STORAGE_URL", None)
+            return
+
+        os.environ["OS_AUTH_TOKEN"] = token.token
+        os.environ["OS_STORAGE_URL"] = token.storage_url
 
     @property
     def uri(self):
@@ -104,6 +130,8 @@ class SwiftRepository(Repository):
         return f"{self.env_config['OS_CONTAINERNAME']}/{self.env_config['OS_NAME']}"
 
     def wipe(self, dry: bool = False):
+        from restic_reaper import SwiftConfig, wipe_repository_sync
+
         env = self.env_config
         config = SwiftConfig(
             container=env["OS_CONTAINERNAME"],
@@ -0,0 +1,153 @@
+"""
+Finding the restic binary and knowing what it can do.
+
+Discovery uses `shutil.which` (no subprocess) and is cached per process.
+`restic version` is only executed once per binary: the result is stored on disk, keyed by path, mtime and size,
+so a `restic self-update` automatically triggers a new probe.
+"""
+
+import functools
+import os
+import re
+import shutil
+import subprocess
+import typing
+from dataclasses import dataclass
+from typing import Optional, Self
+
+from .helpers import cache_dir
+
+_VERSION_RE = re.compile(r"restic (?P<major>\d+)\.(?P<minor>\d+)\.(?P<patch>\d+)")
+
+Version = tuple[int, int, int]
+
+
+@dataclass(frozen=True)
+class ResticCapabilities:
+    """
+    Features of the installed restic, based on its version.
+
+    Attributes:
+        path (str): full path to the restic binary.
+        version (tuple[int, int, int]): (major, minor, patch), (0, 0, 0) if unknown.
+    """
+
+    path: str
+    version: Version = (0, 0, 0)
+
+    @classmethod
+    def from_version_output(cls, path: str, output: str) -> Self:
+        if not (match := _VERSION_RE.search(output)):
+            return cls(path=path)
+        return cls(path=path, version=(int(match["major"]), int(match["minor"]), int(match["patch"])))
+
+    @property
+    def version_string(self) -> str:
+        return ".".join(str(part) for part in self.version)
+
+    def supports(self, minimum: Version) -> bool:
+        return self.version >= minimum
+
+    @property
+    def repository_version_2(self) -> bool:
+        """`init --repository-version 2` (compression)"""
+        return self.supports((0, 14, 0))
+
+    @property
+    def no_scan(self) -> bool:
+        """`backup --no-scan`: skip counting files upfront (only used for the progress ETA)"""
+        return self.supports((0, 15, 0))
+
+    @property
+    def read_concurrency(self) -> bool:
+        """`backup --read-concurrency N`"""
+        return self.supports((0, 15, 0))
+
+    @property
+    def stdin_from_command(self) -> bool:
+        """`backup --stdin-from-command`: restic runs the producer and fails if it fails"""
+        return self.supports((0, 17, 0))
+
+    @property
+    def snapshot_summary(self) -> bool:
+        """backup statistics are stored in the snapshot (`summary` in `snapshots --json`)"""
+        return self.supports((0, 17, 0))
+
+    def backup_args(self, read_concurrency: Optional[int] = None) -> list[str]:
+        """
+        The fastest flags for `restic backup` that don't change what ends up in the snapshot.
+
+        Args:
+            read_concurrency: number of files to read in parallel (restic's default is 2), if configured.
+        """
+        args = []
+        if self.no_scan:
+            args.append("--no-scan")
+        if read_concurrency and self.read_concurrency:
+            args.extend(["--read-concurrency", str(read_concurrency)])
+        return args
+
+
+@functools.cache
+def find_restic() -> Optional[str]:
+    """
+    Full path of the restic binary on $PATH, or None. Cached, see `forget_restic` after (re)installing.
+    """
+    return shutil.which("restic")
+
+
+def forget_restic() -> None:
+    """
+    Clear the cached discovery, e.g. after restic was installed.
+    """
+    find_restic.cache_clear()
+    capabilities.cache_clear()
+
+
+def _probe_key(path: str) -> str:
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def _load_probes() -> dict[str, dict[str, typing.Any]]:
+    import json
+
+    try:
+        return json.loads((cache_dir() / "restic-version.json").read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _store_probes(probes: dict[str, dict[str, typing.Any]]) -> None:
+    import json
+
+    target = cache_dir() / "restic-version.json"
+    tmp = target.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(probes, indent=2))
+    tmp.replace(target)
+
+
+@functools.cache
+def capabilities(path: Optional[str] = None) -> ResticCapabilities:
+    """
+    Capabilities of the restic at `path` (default: the one on $PATH).
+
+    Only runs `restic version` if this exact binary (path + mtime + size) hasn't been probed before.
+    """
+    path = path or find_restic()
+    if not path:
+        return ResticCapabilities(path="restic")
+
+    key = _probe_key(path)
+    probes = _load_probes()
+    if (probe := probes.get(path)) and probe.get("key") == key:
+        return ResticCapabilities.from_version_output(path, probe["output"])
+
+    try:
+        output = subprocess.run([path, "version"], capture_output=True, text=True, timeout=30).stdout
+    except (OSError, subprocess.SubprocessError):
+        return ResticCapabilities(path=path)
+
+    probes[path] = {"key": key, "output": output.strip()}
+    _store_probes(probes)
+    return ResticCapabilities.from_version_output(path, output)
@@ -0,0 +1,204 @@
+"""
+Management of restic's local cache directories.
+
+Restic stores its cache as `<cache dir>/<repository id>/{index,snapshots,data}`.
+By pointing every repository to the same (managed) cache root, different project directories and cron jobs
+using the same restic repository share one warm cache.
+
+Settings (.env):
+- RESTIC_CACHE_ROOT: shared cache root, e.g. /var/cache/restic (default: restic's own, ~/.cache/restic, so existing
+  caches stay warm).
+- RESTIC_CACHE_MAX_SIZE: disk budget for all caches under the root, e.g. 10G.
+- RESTIC_CACHE_MAX_AGE: caches not used for this many days are evicted.
+"""
+
+import datetime as dt
+import os
+import re
+import shutil
+import stat
+import sys
+import time
+import typing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+
+# subdirectories restic keeps per repository:
+CACHE_KINDS = ("index", "snapshots", "data")
+
+_SIZE_RE = re.compile(r"^\s*(?P<number>\d+(?:\.\d+)?)\s*(?P<unit>[KMGT]?)i?B?\s*$", re.IGNORECASE)
+_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(size: str | int | None) -> Optional[int]:
+    """
+    Parse a human readable size like '500M' or '10GiB' into bytes.
+    """
+    if size is None or size == "":
+        return None
+    if isinstance(size, int):
+        return size
+
+    if not (match := _SIZE_RE.match(str(size))):
+        raise ValueError(f"Invalid size {size!r}, use e.g. 500M or 10G.")
+
+    return int(float(match["number"]) * _UNITS[match["unit"].upper()])
+
+
+def format_size(size: int) -> str:
+    value = float(size)
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if value < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} TiB"
+
+
+def default_root() -> Path:
+    """
+    Where restic keeps its cache by default (Go's os.UserCacheDir() + '/restic').
+    """
+    if sys.platform == "darwin":
+        base = Path.home() / "Library" / "Caches"
+    elif os.name == "nt" and os.environ.get("LOCALAPPDATA"):
+        base = Path(os.environ["LOCALAPPDATA"])
+    else:
+        base = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+    return base / "restic"
+
+
+def cache_root(env: dict[str, str]) -> Path:
+    """
+    The managed cache root for restic, from RESTIC_CACHE_ROOT or restic's own default location
+    (so caches restic built before keep being used).
+    """
+    if configured := env.get("RESTIC_CACHE_ROOT"):
+        root = Path(configured).expanduser()
+        # setgid, so caches created by different users (in the same group) stay shared:
+        root.mkdir(mode=0o2775, parents=True, exist_ok=True)
+        return root
+
+    root = default_root()
+    root.mkdir(parents=True, exist_ok=True)
+    return root
+
+
+@dataclass
+class CacheEntry:
+    """
+    The restic cache for one repository.
+
+    Attributes:
+        repo_id (str): restic repository ID (= directory name).
+        path (Path): the cache directory.
+        size (int): total bytes on disk.
+        files (dict[str, int]): number of cached files per kind (index, snapshots, data).
+        last_used (float): timestamp of the most recent modification in the cache.
+    """
+
+    repo_id: str
+    path: Path
+    size: int
+    files: dict[str, int]
+    last_used: float
+
+    @property
+    def age_days(self) -> float:
+        return (time.time() - self.last_used) / 86400
+
+    @property
+    def last_used_at(self) -> dt.datetime:
+        return dt.datetime.fromtimestamp(self.last_used)
+
+
+def scan_entry(path: Path) -> CacheEntry:
+    size = 0
+    last_used = path.stat().st_mtime
+    files = dict.fromkeys(CACHE_KINDS, 0)
+
+    for kind in CACHE_KINDS:
+        for dirpath, _, filenames in os.walk(path / kind):
+            for filename in filenames:
+                file_stat = os.stat(os.path.join(dirpath, filename))
+                size += file_stat.st_size
+                last_used = max(last_used, file_stat.st_mtime)
+                files[kind] += 1
+
+    return CacheEntry(repo_id=path.name, path=path, size=size, files=files, last_used=last_used)
+
+
+def scan(root: Path) -> list[CacheEntry]:
+    """
+    All repository caches under a root, least recently used first.
+    """
+    if not root.exists():
+        return []
+
+    # restic marks its cache dirs with a 'version' file:
+    entries = [scan_entry(path) for path in root.iterdir() if path.is_dir() and (path / "version").exists()]
+    return sorted(entries, key=lambda entry: entry.last_used)
+
+
+def select_evictions(
+    entries: list[CacheEntry],
+    max_size: Optional[int] = None,
+    max_age_days: Optional[float] = None,
+    keep: typing.Container[str] = (),
+) -> list[CacheEntry]:
+    """
+    Decide which caches to remove: everything older than max_age_days,
+    then least recently used caches until the total fits within max_size.
+
+    Args:
+        entries: caches, least recently used first (see `scan`).
+        max_size: disk budget in bytes for all caches together.
+        max_age_days: caches unused for longer than this are always evicted.
+        keep: repository IDs that should never be evicted (e.g. the active repository).
+    """
+    evictions = []
+    remaining = []
+    for entry in entries:
+        if entry.repo_id not in keep and max_age_days is not None and entry.age_days > max_age_days:
+            evictions.append(entry)
+        else:
+            remaining.append(entry)
+
+    if max_size is not None:
+        total = sum(entry.size for entry in remaining)
+        for entry in remaining:
+            if total <= max_size:
+                break
+            if entry.repo_id in keep:
+                continue
+            evictions.append(entry)
+            total -= entry.size
+
+    return evictions
+
+
+def evict(entries: typing.Iterable[CacheEntry]) -> int:
+    """
+    Remove caches from disk, returns the number of bytes freed.
+    """
+    freed = 0
+    for entry in entries:
+        shutil.rmtree(entry.path, ignore_errors=True)
+        freed += entry.size
+    return freed
+
+
+def share(path: Path) -> None:
+    """
+    Make a cache dir usable by other users in the same group (restic creates it user-only).
+    """
+    for dirpath, _, filenames in os.walk(path):
+        with_perms = [(dirpath, stat.S_IRWXG | stat.S_ISGID)]
+        with_perms += [(os.path.join(dirpath, name), stat.S_IRGRP | stat.S_IWGRP) for name in filenames]
+        for file, extra in with_perms:
+            try:
+                os.chmod(file, os.stat(file).st_mode | extra)
+            except OSError:
+                # not our file, nothing to do
+                continue
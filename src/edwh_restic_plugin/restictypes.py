@@ -1,5 +1,7 @@
 from typing import Optional, TypedDict
 
+from typing_extensions import NotRequired
+
 
 class State(TypedDict):
     Status: str
@@ -219,3 +221,38 @@ class DockerContainer(TypedDict):
     Mounts: list[Mount]
     Config: Config
     NetworkSettings: NetworkSettings
+
+
+class ResticSnapshotSummary(TypedDict):
+    backup_start: str
+    backup_end: str
+    files_new: int
+    files_changed: int
+    files_unmodified: int
+    dirs_new: int
+    dirs_changed: int
+    dirs_unmodified: int
+    data_blobs: int
+    tree_blobs: int
+    data_added: int
+    data_added_packed: int
+    total_files_processed: int
+    total_bytes_processed: int
+
+
+class ResticSnapshot(TypedDict):
+    # output of `restic snapshots --json`
+    time: str
+    parent: NotRequired[str]
+    tree: str
+    paths: list[str]
+    hostname: str
+    username: NotRequired[str]
+    uid: NotRequired[int]
+    gid: NotRequired[int]
+    excludes: NotRequired[list[str]]
+    tags: NotRequired[Optional[list[str]]]
+    program_version: NotRequired[str]
+    summary: NotRequired[ResticSnapshotSummary]
+    id: str
+    short_id: str
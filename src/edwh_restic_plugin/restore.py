@@ -0,0 +1,139 @@
+"""
+The restore pipeline: prepare (find the paths to restore, stop services, remove their containers and volumes),
+restore (run the restore scripts, concurrently with --parallel) and verify (run `verify_<target>*` scripts, if any).
+
+Every phase is timed, and the timings are reported at the end, also when a phase fails,
+to show where the recovery time goes.
+"""
+
+import contextlib
+import json
+import os
+import sys
+import time
+import typing
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from edwh.tasks import DOCKER_COMPOSE
+from invoke import Context
+from termcolor import cprint
+
+from . import tracing
+
+if typing.TYPE_CHECKING:
+    from .restictypes import DockerContainer
+
+# services whose data is replaced by a restore:
+DATABASE_SERVICES = ("pg-0", "pg-1", "pgpool")
+# services that own volumes (pgpool has none):
+VOLUME_SERVICES = ("pg-0", "pg-1")
+
+
+@dataclass
+class Phases:
+    """
+    Wall clock time per phase, in the order the phases ran.
+    """
+
+    durations: dict[str, float] = field(default_factory=dict)
+    failed: Optional[str] = None
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> typing.Generator[None, None, None]:
+        started = time.monotonic()
+        try:
+            with tracing.span(f"restore.{name}"):
+                yield
+        except BaseException:
+            # also SystemExit, which execute_files uses for failing scripts
+            self.failed = name
+            raise
+        finally:
+            self.durations[name] = time.monotonic() - started
+
+    @property
+    def total(self) -> float:
+        return sum(self.durations.values())
+
+    def report(self) -> None:
+        print("\nrestore phases:", file=sys.stderr)
+        for name, duration in self.durations.items():
+            status = "failed" if name == self.failed else "done"
+            cprint(
+                f"  {name:<10} {duration:8.1f}s  {status}",
+                color="red" if name == self.failed else "green",
+                file=sys.stderr,
+            )
+        print(f"  {'total':<10} {self.total:8.1f}s", file=sys.stderr)
+
+
+def volumes_of(inspected: list["DockerContainer"]) -> list[str]:
+    """
+    Names of the (named) volumes mounted by these containers, in order and without duplicates.
+    """
+    volumes = [mount["Name"] for container in inspected for mount in container["Mounts"] if mount["Type"] == "volume"]
+    return list(dict.fromkeys(volumes))
+
+
+def export_includes(paths: list[str]) -> Path:
+    """
+    Make the paths to restore available to the restore scripts:
+
+    - $INCLUDE: `--include <path>` for every path (for paths without spaces or other special characters).
+    - $INCLUDE_FILE: a file with one path per line, for `--include-file` (restic >= 0.17).
+    """
+    from .helpers import cache_dir
+
+    include_file = cache_dir("restore") / "include.txt"
+    include_file.write_text("".join(f"{path}\n" for path in paths))
+    # used unquoted in scripts, so quoting would end up in the paths:
+    os.environ["INCLUDE"] = " ".join(f"--include {path}" for path in paths)
+    os.environ["INCLUDE_FILE"] = str(include_file)
+    return include_file
+
+
+def teardown(c: Context, services: tuple[str, ...] = DATABASE_SERVICES) -> list[str]:
+    """
+    Stop the database services and remove their containers and volumes, with one docker call per step.
+
+    Returns:
+        the removed volumes.
+    """
+    c.run(f"{DOCKER_COMPOSE} stop -t 1 {' '.join(services)}", warn=True, hide=True)
+
+    volume_services = [service for service in services if service in VOLUME_SERVICES]
+    docker_inspect = c.run(f"docker inspect {' '.join(volume_services)}", hide=True, warn=True)
+    if not docker_inspect.ok:
+        # the containers don't exist, so neither do their volumes
+        return []
+
+    volumes = volumes_of(json.loads(docker_inspect.stdout))
+    # containers have to go before their volumes can be removed:
+    c.run(f"{DOCKER_COMPOSE} rm -f {' '.join(volume_services)}")
+    if volumes:
+        c.run(f"docker volume rm {' '.join(volumes)}")
+    return volumes
+
+
+def verify(c: Context, target: str, verbose: bool, parallel: int = 1, timeout: float = None) -> bool:
+    """
+    Run the `verify_<target>*` scripts (e.g. a query on the restored database). No scripts is fine.
+    """
+    from .helpers import DEFAULT_BACKUP_FOLDER
+    from .hooks import HookRunner, HookScript, discover
+
+    files = discover(target, "verify", DEFAULT_BACKUP_FOLDER)
+    scripts = [HookScript.from_path(file, default_timeout=timeout) for file in files]
+    results = HookRunner(c, verbose=verbose, workers=parallel).run(scripts)
+
+    for result in results:
+        if result.ok:
+            cprint(f"[verified] {result.script.path}", color="green")
+        else:
+            cprint(f"[failure ({result.exited})] {result.script.path}", color="red")
+            if not verbose:
+                print(result.stdout.rstrip())
+
+    return all(result.ok for result in results)
@@ -0,0 +1,180 @@
+"""
+On-disk cache of snapshot metadata, so listing snapshots doesn't require a full `restic snapshots` every time.
+
+The cache is a SQLite database in the plugin's cache dir, keyed by restic repository ID (from `restic cat config`).
+Refreshing is incremental: `restic list snapshots` only returns IDs (cheap), after which only the new snapshots
+are fetched and the ones that were forgotten are dropped.
+"""
+
+import json
+import sqlite3
+import time
+import typing
+from pathlib import Path
+from typing import Optional
+
+from .helpers import cache_dir
+from .snapshots import Snapshot
+
+# how many snapshot IDs to pass to one `restic snapshots --json <ids>` call
+FETCH_BATCH_SIZE = 100
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS repositories (
+    uri TEXT PRIMARY KEY,
+    repo_id TEXT NOT NULL,
+    refreshed_at REAL
+);
+CREATE TABLE IF NOT EXISTS snapshots (
+    repo_id TEXT NOT NULL,
+    id TEXT NOT NULL,
+    time TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (repo_id, id)
+);
+CREATE TABLE IF NOT EXISTS replicated (
+    source_repo_id TEXT NOT NULL,
+    target_repo_id TEXT NOT NULL,
+    snapshot_id TEXT NOT NULL,
+    copied_at REAL NOT NULL,
+    PRIMARY KEY (source_repo_id, target_repo_id, snapshot_id)
+);
+"""
+
+
+class SnapshotCache:
+    """
+    Local snapshot metadata per restic repository.
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = path or cache_dir() / "snapshots.sqlite"
+        self.db = sqlite3.connect(self.path)
+        self.db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "SnapshotCache":
+        return self
+
+    def __exit__(self, *_: typing.Any) -> None:
+        self.close()
+
+    # repository uri -> id mapping, saves a `restic cat config` for every lookup:
+
+    def get_repo_id(self, uri: str) -> Optional[str]:
+        row = self.db.execute("SELECT repo_id FROM repositories WHERE uri = ?", (uri,)).fetchone()
+        return row[0] if row else None
+
+    def set_repo_id(self, uri: str, repo_id: str) -> None:
+        with self.db:
+            self.db.execute(
+                "INSERT INTO repositories (uri, repo_id) VALUES (?, ?) "
+                "ON CONFLICT (uri) DO UPDATE SET repo_id = excluded.repo_id",
+                (uri, repo_id),
+            )
+
+    def repositories(self) -> dict[str, list[str]]:
+        """
+        Known repository IDs with the uri(s) they are used with.
+        """
+        known: dict[str, list[str]] = {}
+        for uri, repo_id in self.db.execute("SELECT uri, repo_id FROM repositories ORDER BY uri"):
+            known.setdefault(repo_id, []).append(uri)
+        return known
+
+    def forget_repository(self, uri: str) -> None:
+        """
+        Remove everything known about the repository at `uri` (e.g. after a wipe).
+        """
+        if not (repo_id := self.get_repo_id(uri)):
+            return
+
+        with self.db:
+            self.db.execute("DELETE FROM snapshots WHERE repo_id = ?", (repo_id,))
+            self.db.execute("DELETE FROM repositories WHERE uri = ?", (uri,))
+            self.db.execute("DELETE FROM replicated WHERE source_repo_id = ? OR target_repo_id = ?", (repo_id, repo_id))
+
+    # snapshots:
+
+    def known_ids(self, repo_id: str) -> set[str]:
+        return {row[0] for row in self.db.execute("SELECT id FROM snapshots WHERE repo_id = ?", (repo_id,))}
+
+    def count(self, repo_id: str) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM snapshots WHERE repo_id = ?", (repo_id,)).fetchone()[0]
+
+    def load(self, repo_id: str) -> list[Snapshot]:
+        """
+        All cached snapshots of a repository, oldest first.
+        """
+        rows = self.db.execute("SELECT data FROM snapshots WHERE repo_id = ? ORDER BY time", (repo_id,))
+        return [Snapshot.from_json(json.loads(data)) for (data,) in rows]
+
+    def store(self, repo_id: str, snapshots: typing.Iterable[Snapshot]) -> None:
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO snapshots (repo_id, id, time, data) VALUES (?, ?, ?, ?)",
+                [
+                    (repo_id, snapshot.id, snapshot.time.isoformat(), json.dumps(snapshot.to_json()))
+                    for snapshot in snapshots
+                ],
+            )
+
+    def remove(self, repo_id: str, snapshot_ids: typing.Iterable[str]) -> None:
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM snapshots WHERE repo_id = ? AND id = ?",
+                [(repo_id, snapshot_id) for snapshot_id in snapshot_ids],
+            )
+
+    def sync(
+        self,
+        repo_id: str,
+        remote_ids: typing.Iterable[str],
+        fetch: typing.Callable[[list[str]], list[Snapshot]],
+    ) -> tuple[int, int]:
+        """
+        Bring the cache in line with the list of snapshot IDs in the repository.
+
+        Args:
+            repo_id: restic repository ID.
+            remote_ids: full IDs of all snapshots currently in the repository.
+            fetch: called with the IDs of new snapshots (in batches), should return their metadata.
+
+        Returns:
+            (added, removed) counts.
+        """
+        remote_ids = set(remote_ids)
+        known = self.known_ids(repo_id)
+
+        new_ids = sorted(remote_ids - known)
+        removed_ids = known - remote_ids
+
+        for idx in range(0, len(new_ids), FETCH_BATCH_SIZE):
+            self.store(repo_id, fetch(new_ids[idx : idx + FETCH_BATCH_SIZE]))
+
+        self.remove(repo_id, removed_ids)
+
+        with self.db:
+            self.db.execute("UPDATE repositories SET refreshed_at = ? WHERE repo_id = ?", (time.time(), repo_id))
+
+        return len(new_ids), len(removed_ids)
+
+    # snapshots copied to other repositories (see replicate):
+
+    def replicated_ids(self, source_repo_id: str, target_repo_id: str) -> set[str]:
+        rows = self.db.execute(
+            "SELECT snapshot_id FROM replicated WHERE source_repo_id = ? AND target_repo_id = ?",
+            (source_repo_id, target_repo_id),
+        )
+        return {row[0] for row in rows}
+
+    def mark_replicated(self, source_repo_id: str, target_repo_id: str, snapshot_ids: typing.Iterable[str]) -> None:
+        now = time.time()
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO replicated (source_repo_id, target_repo_id, snapshot_id, copied_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(source_repo_id, target_repo_id, snapshot_id, now) for snapshot_id in snapshot_ids],
+            )
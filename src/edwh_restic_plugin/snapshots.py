@@ -0,0 +1,238 @@
+"""
+Typed snapshot records, built from `restic snapshots --json`.
+"""
+
+import datetime as dt
+import json
+import typing
+import urllib.parse
+from dataclasses import dataclass, field
+from typing import Optional, Self
+
+from .restictypes import ResticSnapshot
+
+# tag used for the (legacy) snapshots that store a backup run's message
+MESSAGE_TAG = "message"
+# current way to store a run's message: as a tag on the snapshots of that run
+MESSAGE_TAG_PREFIX = "msg="
+# restic splits tags on ',', so those (and '%' itself) have to be escaped:
+_MESSAGE_SAFE_CHARS = " !#$&'()*+-./:;<=>?@[]^_`{|}~"
+
+
+def encode_message_tag(message: str) -> str:
+    """
+    Turn a run message into a single restic tag, e.g. 'nightly, db' -> 'msg=nightly%2C db'.
+    """
+    return MESSAGE_TAG_PREFIX + urllib.parse.quote(message.strip(), safe=_MESSAGE_SAFE_CHARS)
+
+
+def decode_message_tag(tag: str) -> Optional[str]:
+    """
+    Inverse of encode_message_tag, None for tags that don't contain a message.
+    """
+    if not tag.startswith(MESSAGE_TAG_PREFIX):
+        return None
+    return urllib.parse.unquote(tag.removeprefix(MESSAGE_TAG_PREFIX))
+
+
+@dataclass
+class Snapshot:
+    """
+    One restic snapshot.
+
+    Attributes:
+        id (str): full snapshot ID.
+        short_id (str): the 8 character ID restic shows in tables (and prints after 'snapshot ... saved').
+        time (datetime): when the snapshot was made.
+        hostname (str): host that made the snapshot.
+        paths (list[str]): paths included in the snapshot.
+        tags (list[str]): snapshot tags, e.g. 'files' or 'stream'.
+        summary (dict): the backup summary restic >= 0.17 stores in the snapshot (may be empty).
+    """
+
+    id: str
+    short_id: str
+    time: dt.datetime
+    hostname: str
+    paths: list[str] = field(default_factory=list)
+    tags: list[str] = field(default_factory=list)
+    summary: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_json(cls, data: ResticSnapshot) -> Self:
+        return cls(
+            id=data["id"],
+            short_id=data.get("short_id") or data["id"][:8],
+            time=dt.datetime.fromisoformat(data["time"]),
+            hostname=data.get("hostname", ""),
+            paths=data.get("paths") or [],
+            # restic emits `null` for snapshots without tags:
+            tags=data.get("tags") or [],
+            summary=dict(data.get("summary") or {}),
+        )
+
+    def to_json(self) -> ResticSnapshot:
+        """
+        Inverse of from_json (only the fields this class keeps).
+        """
+        data: ResticSnapshot = {
+            "id": self.id,
+            "short_id": self.short_id,
+            "time": self.time.isoformat(),
+            "hostname": self.hostname,
+            "paths": self.paths,
+            "tags": self.tags,
+        }
+        if self.summary:
+            data["summary"] = self.summary
+        return data
+
+    @property
+    def is_message(self) -> bool:
+        """
+        Is this a legacy snapshot that only holds a run message?
+        """
+        return MESSAGE_TAG in self.tags
+
+    @property
+    def message(self) -> Optional[str]:
+        """
+        The run message stored as tag on this snapshot, if any.
+        """
+        for tag in self.tags:
+            if (message := decode_message_tag(tag)) is not None:
+                return message
+        return None
+
+    @property
+    def display_tags(self) -> list[str]:
+        """
+        Tags without the encoded run message.
+        """
+        return [tag for tag in self.tags if not tag.startswith(MESSAGE_TAG_PREFIX)]
+
+    @property
+    def linked_ids(self) -> list[str]:
+        """
+        For message snapshots: the (short) IDs of the snapshots this message belongs to.
+        """
+        return [tag for tag in self.tags if tag != MESSAGE_TAG]
+
+
+def parse_snapshots(stdout: str) -> list[Snapshot]:
+    """
+    Parse the output of `restic snapshots --json` into Snapshot records, oldest first.
+    """
+    stdout = stdout.strip()
+    if not stdout:
+        return []
+
+    data: list[ResticSnapshot] = json.loads(stdout) or []
+    return sorted((Snapshot.from_json(item) for item in data), key=lambda s: s.time)
+
+
+def filter_snapshots(
+    snapshots: typing.Iterable[Snapshot],
+    tags: typing.Iterable[str] = (),
+    host: Optional[str] = None,
+    latest: Optional[int] = None,
+) -> list[Snapshot]:
+    """
+    Apply restic's snapshot filters locally, e.g. on cached snapshots.
+
+    Args:
+        snapshots: snapshots to filter, oldest first.
+        tags: like `--tag a --tag b,c`: a snapshot matches if it has 'a', or both 'b' and 'c'.
+        host: only snapshots made by this hostname.
+        latest: like `--latest n`: only the last n snapshots per (host, paths) group.
+    """
+    tag_sets = [set(tag.split(",")) for tag in tags if tag]
+
+    selected = [
+        snapshot
+        for snapshot in snapshots
+        if (not host or snapshot.hostname == host)
+        and (not tag_sets or any(tag_set.issubset(snapshot.tags) for tag_set in tag_sets))
+    ]
+
+    if not latest:
+        return selected
+
+    per_group: dict[tuple, list[Snapshot]] = {}
+    for snapshot in selected:
+        per_group.setdefault((snapshot.hostname, tuple(sorted(snapshot.paths))), []).append(snapshot)
+
+    keep = {id(snapshot) for group in per_group.values() for snapshot in group[-latest:]}
+    return [snapshot for snapshot in selected if id(snapshot) in keep]
+
+
+def parse_tag_output(stdout: str) -> dict[str, str]:
+    """
+    Old -> new full snapshot ID from `restic tag --json` (restic rewrites every snapshot it tags).
+    Empty for a restic that doesn't report them.
+    """
+    renamed: dict[str, str] = {}
+    for line in stdout.splitlines():
+        try:
+            message = json.loads(line) if line.startswith("{") else None
+        except ValueError:
+            continue
+        if isinstance(message, dict) and message.get("old_snapshot_id") and message.get("new_snapshot_id"):
+            renamed[message["old_snapshot_id"]] = message["new_snapshot_id"]
+    return renamed
+
+
+def link_messages(snapshots: typing.Iterable[Snapshot]) -> dict[str, Snapshot]:
+    """
+    Map each snapshot's short ID to the (newest) message snapshot that references it, in a single pass.
+    """
+    linked: dict[str, Snapshot] = {}
+    for snapshot in snapshots:
+        if not snapshot.is_message:
+            continue
+        for snapshot_id in snapshot.linked_ids:
+            short_id = snapshot_id[:8]
+            previous = linked.get(short_id)
+            if previous is None or previous.time <= snapshot.time:
+                linked[short_id] = snapshot
+
+    return linked
+
+
+def render_table(snapshots: typing.Iterable[Snapshot], messages: Optional[dict[str, str]] = None) -> str:
+    """
+    Render snapshots as a compact text table (like `restic snapshots -c`),
+    with the run message appended after each snapshot that has one.
+
+    Args:
+        snapshots: the snapshots to show; legacy message snapshots themselves are skipped.
+        messages: short snapshot ID -> message text, for snapshots without a message tag (legacy message snapshots).
+    """
+    messages = messages or {}
+    header = ("ID", "Time", "Host", "Tags")
+    snapshots = [snapshot for snapshot in snapshots if not snapshot.is_message]
+    rows = [
+        (
+            snapshot.short_id,
+            snapshot.time.strftime("%Y-%m-%d %H:%M:%S"),
+            snapshot.hostname,
+            ",".join(snapshot.display_tags),
+        )
+        for snapshot in snapshots
+    ]
+
+    widths = [max(len(row[idx]) for row in (header, *rows)) for idx in range(len(header))]
+
+    def fmt(row: tuple[str, ...]) -> str:
+        return "  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip()
+
+    separator = "-" * len(fmt(tuple("-" * w for w in widths)))
+    lines = [fmt(header), separator]
+    for snapshot, row in zip(snapshots, rows):
+        line = fmt(row)
+        if message := snapshot.message or messages.get(snapshot.short_id):
+            line += f" : [{message}]"
+        lines.append(line)
+    lines.extend([separator, f"{len(rows)} snapshots"])
+
+    return "\n".join(lines)
@@ -0,0 +1,147 @@
+"""
+Persistent, multiplexed SSH connections for the SFTP backend.
+
+Every restic process normally does its own SSH handshake. With a ControlMaster, the first connection stays open
+in the background (for `persist` seconds after the last use) and every following ssh/restic call reuses it.
+
+Restic is pointed to the master through `-o sftp.command=<wrapper>`: a small generated script that runs ssh
+with the right options, so the option has no spaces and survives unquoted use in scripts (`restic $HOST ...`).
+Restic splits `sftp.command` on whitespace, so a cache dir with whitespace can't be used for this: the sftp backend
+then lets restic connect by itself (see SSHMaster.socket_dir).
+
+Settings (.env):
+- SFTP_SSH_PERSIST: seconds the master stays open after the last connection (default 600).
+- SFTP_SSH_CIPHER: cipher(s) for ssh, e.g. aes128-gcm@openssh.com (fast on CPUs with AES-NI).
+- SFTP_SSH_COMPRESSION: 'yes' to enable ssh compression (only useful on slow links, restic data is compressed).
+"""
+
+import re
+import shlex
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Self
+
+from .helpers import cache_dir
+
+DEFAULT_PERSIST = 600
+
+_UNSAFE_RE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+@dataclass
+class SSHMaster:
+    """
+    A multiplexed ssh connection to one host (ssh config alias or user@host).
+
+    Attributes:
+        host (str): what would be passed to `ssh`.
+        persist (int): seconds the master connection is kept open after the last client disconnects.
+        cipher (str | None): value for `ssh -c`, None for the ssh default.
+        compression (bool): enable ssh compression.
+    """
+
+    host: str
+    persist: int = DEFAULT_PERSIST
+    cipher: Optional[str] = None
+    compression: bool = False
+
+    @classmethod
+    def from_env(cls, host: str, env: dict[str, str]) -> Self:
+        return cls(
+            host=host,
+            persist=int(env.get("SFTP_SSH_PERSIST") or DEFAULT_PERSIST),
+            cipher=env.get("SFTP_SSH_CIPHER") or None,
+            compression=(env.get("SFTP_SSH_COMPRESSION") or "").lower() in ("1", "yes", "true", "on"),
+        )
+
+    @property
+    def socket_dir(self) -> Path:
+        """
+        Raises:
+            ValueError: if the path contains whitespace, which restic splits `sftp.command` on (and ssh -o on).
+        """
+        path = cache_dir("ssh")
+        if any(char.isspace() for char in str(path)):
+            raise ValueError(
+                f"The ssh socket directory {str(path)!r} contains whitespace, which restic's sftp.command can't "
+                "handle. Set EDWH_RESTIC_CACHE_DIR to a path without spaces to share ssh connections."
+            )
+        # sockets give access to an authenticated connection, keep them private:
+        path.chmod(0o700)
+        return path
+
+    @property
+    def _slug(self) -> str:
+        return _UNSAFE_RE.sub("_", self.host)
+
+    def options(self) -> list[str]:
+        """
+        ssh arguments for using (or becoming) the master.
+        """
+        # %C is a hash of local host, remote host, port and user; short enough for the unix socket path limit.
+        options = [
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={self.socket_dir / '%C'}",
+            "-o",
+            f"ControlPersist={self.persist}",
+        ]
+        if self.cipher:
+            options.extend(["-c", self.cipher])
+        if self.compression:
+            options.extend(["-o", "Compression=yes"])
+        return options
+
+    def command(self, *args: str) -> list[str]:
+        return ["ssh", *self.options(), self.host, *args]
+
+    def is_alive(self) -> bool:
+        """
+        Is a master connection running? (local check on the socket, no network traffic)
+        """
+        check = ["ssh", "-O", "check", *self.options(), self.host]
+        return subprocess.run(check, stdin=subprocess.DEVNULL, capture_output=True).returncode == 0
+
+    def start(self, timeout: int = 30) -> tuple[bool, str]:
+        """
+        Make sure the master is running, also serves as reachability check.
+
+        Returns:
+            (ok, error output of ssh)
+        """
+        if self.is_alive():
+            return True, ""
+
+        # the backgrounded master inherits stdout/stderr: use a file, a pipe would never be closed.
+        log = self.socket_dir / f"{self._slug}.log"
+        with log.open("w") as stderr:
+            try:
+                ran = subprocess.run(
+                    self.command("exit"),
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=stderr,
+                    timeout=timeout,
+                )
+            except subprocess.TimeoutExpired:
+                return False, f"ssh {self.host} timed out after {timeout} seconds"
+
+        return ran.returncode == 0, log.read_text().strip()
+
+    def sftp_command(self) -> Path:
+        """
+        Write the wrapper script restic uses as `sftp.command`, returns its path.
+        """
+        wrapper = self.socket_dir / f"sftp-{self._slug}"
+        content = f"#!/bin/sh\nexec {shlex.join(self.command('-s', 'sftp'))}\n"
+        if not wrapper.exists() or wrapper.read_text() != content:
+            tmp = wrapper.with_name(f"{wrapper.name}.tmp")
+            tmp.write_text(content)
+            tmp.chmod(0o700)
+            tmp.replace(wrapper)
+        return wrapper
+
+    def restic_option(self) -> str:
+        return f"-o sftp.command={shlex.quote(str(self.sftp_command()))}"
@@ -0,0 +1,470 @@
+"""
+Stream targets declared in Python, as an alternative to `backup_stream_*` shell scripts.
+
+A `captain-hooks/streams.py` file lists them in a `STREAMS` variable:
+
+    from edwh_restic_plugin.streams import StreamTarget
+
+    def export(out):
+        out.write(b"...")
+
+    STREAMS = [
+        StreamTarget(
+            "postgres",
+            "docker compose exec -T db pg_dump -Fc app",
+            filename="app.dump",
+            tags=["db"],
+            restore="docker compose exec -T db pg_restore --clean -d app",
+        ),
+        StreamTarget("export", export, filename="export.json"),
+    ]
+
+They are run by `execute_files` next to the scripts (matching `stream_<name>` against the backup target).
+Command producers are handed to restic with `--stdin-from-command` when the installed restic supports it,
+otherwise (and for Python callables) the data is piped into `restic backup --stdin` by this module.
+Either way a failing producer fails the backup without creating a snapshot, and the throughput is measured.
+Like `backup_stream*` scripts, every snapshot is tagged 'stream' (plus the stream's own tags).
+
+On restore, streams with a `restore` consumer get the `restic dump` of their file (from $SNAPSHOT, or the latest
+stream snapshot with that file) on stdin, or as a readable file for a Python callable.
+"""
+
+import contextlib
+import dataclasses
+import json
+import os
+import runpy
+import shlex
+import subprocess
+import threading
+import time
+import traceback
+import typing
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from .helpers import DEFAULT_BACKUP_FOLDER
+from .hooks import TIMEOUT_EXIT_CODE, HookResult
+from .output import OutputHandler, Timeout
+
+# declaration file in the captain-hooks folder:
+STREAMS_FILE = "streams.py"
+# size of the chunks piped from a producer into restic:
+CHUNK_SIZE = 1024 * 1024
+
+Producer = str | list[str] | typing.Callable[[typing.BinaryIO], None]
+Consumer = Producer
+# every stream snapshot gets this tag, like the snapshots of `backup_stream*` scripts:
+STREAM_TAG = "stream"
+
+
+def _command(value: Producer) -> Optional[list[str]]:
+    if callable(value):
+        return None
+    if isinstance(value, str):
+        return ["sh", "-c", value]
+    return list(value)
+
+
+@dataclass
+class StreamTarget:
+    """
+    One stream to back up.
+
+    Attributes:
+        name (str): short name, matched as `stream_<name>` against the backup target.
+        producer: shell command (str), argument list or a callable that writes the data to the file it is given.
+        filename (str): name of the file in the snapshot (restic --stdin-filename). Defaults to the name.
+        tags (list[str]): extra tags for the snapshot, besides 'stream'.
+        group (str): streams/scripts with the same group run sequentially. Defaults to the path (= no ordering).
+        timeout (Optional[float]): seconds after which the backup (or restore) is killed, or None for no limit.
+        restore (Optional[Consumer]): shell command (str), argument list or callable that gets the data back on
+            restore (on stdin, or as the readable file it is given). Without it, restore skips the stream.
+    """
+
+    name: str
+    producer: Producer
+    filename: str = ""
+    tags: list[str] = field(default_factory=list)
+    group: str = ""
+    timeout: Optional[float] = None
+    restore: Optional[Consumer] = None
+
+    def __post_init__(self) -> None:
+        self.filename = self.filename or self.name
+        self.group = self.group or self.path
+
+    @property
+    def path(self) -> str:
+        # shown in reports, like the path of a script
+        return f"stream:{self.name}"
+
+    def producer_command(self) -> Optional[list[str]]:
+        """
+        The producer as an argument list, or None for a Python callable.
+        """
+        return _command(self.producer)
+
+    def consumer_command(self) -> Optional[list[str]]:
+        """
+        The restore consumer as an argument list, or None for a Python callable.
+        """
+        return _command(self.restore)
+
+    def restic_command(self, restic: str = "restic", from_command: bool = False) -> list[str]:
+        """
+        `restic backup` for this stream, using the repository settings exported by prepare_env_for_restic.
+        """
+        command = [
+            restic,
+            *shlex.split(os.environ.get("HOST", "")),
+            "-r",
+            os.environ["URI"],
+            "backup",
+            "--json",
+            "--stdin-filename",
+            self.filename,
+        ]
+        for tag in dict.fromkeys([STREAM_TAG, *self.tags]):
+            command.extend(["--tag", tag])
+
+        if from_command:
+            return [*command, "--stdin-from-command", "--", *self.producer_command()]
+        return [*command, "--stdin"]
+
+    def dump_command(self, restic: str = "restic", snapshot: str = "latest") -> list[str]:
+        """
+        `restic dump` of this stream's file; 'latest' is the latest stream snapshot that contains it.
+        """
+        path = f"/{self.filename}"
+        return [
+            restic,
+            *shlex.split(os.environ.get("HOST", "")),
+            "-r",
+            os.environ["URI"],
+            "dump",
+            "--tag",
+            STREAM_TAG,
+            "--path",
+            path,
+            snapshot,
+            path,
+        ]
+
+
+@dataclass
+class StreamResult(HookResult):
+    """
+    HookResult of a stream, with the amount of data and where the time went.
+
+    Attributes:
+        snapshot (Optional[str]): ID of the created snapshot.
+        bytes (int): size of the stream.
+        producer_wait (float): seconds spent waiting for the producer (only known when piped by this module).
+        restic_wait (float): seconds spent waiting for restic to accept data (backpressure, idem).
+        summary (Optional[dict]): restic's JSON summary of the backup.
+    """
+
+    snapshot: Optional[str] = None
+    bytes: int = 0
+    producer_wait: float = 0.0
+    restic_wait: float = 0.0
+    summary: Optional[dict] = None
+
+    @property
+    def throughput(self) -> float:
+        """
+        Bytes per second.
+        """
+        return self.bytes / self.duration if self.duration else 0.0
+
+
+def load_streams(
+    target: str, folder: Path = DEFAULT_BACKUP_FOLDER, default_timeout: Optional[float] = None, verb: str = "backup"
+) -> list[StreamTarget]:
+    """
+    Stream targets from `<folder>/streams.py` matching the backup/restore target ('' for all).
+    For 'restore', only the streams that have a `restore` consumer.
+    """
+    file = folder / STREAMS_FILE
+    if not file.exists():
+        return []
+
+    streams: list[StreamTarget] = runpy.run_path(str(file)).get("STREAMS", [])
+    return [
+        dataclasses.replace(stream, timeout=default_timeout) if stream.timeout is None else stream
+        for stream in streams
+        if f"stream_{stream.name}".startswith(target) and (verb != "restore" or stream.restore is not None)
+    ]
+
+
+def parse_output(output: str) -> tuple[Optional[dict], list[str]]:
+    """
+    Find the summary in `restic backup --json` output (also when prefixed by the fan-out shim, then the last one).
+
+    Returns:
+        (summary or None, lines that aren't JSON messages, e.g. errors)
+    """
+    summary = None
+    lines = []
+    for line in output.splitlines():
+        start = line.find("{")
+        try:
+            message = json.loads(line[start:]) if start >= 0 else None
+        except ValueError:
+            message = None
+
+        if not isinstance(message, dict):
+            lines.append(line)
+        elif message.get("message_type") == "summary":
+            summary = message
+        elif message.get("message_type") == "error":
+            lines.append(line)
+
+    return summary, lines
+
+
+class _Pipe:
+    """
+    Writable file for callable producers: hands everything to restic, keeping count.
+    """
+
+    def __init__(self, sink: typing.BinaryIO) -> None:
+        self.sink = sink
+        self.bytes = 0
+        self.wait = 0.0
+
+    def write(self, data: bytes) -> int:
+        started = time.monotonic()
+        self.sink.write(data)
+        self.wait += time.monotonic() - started
+        self.bytes += len(data)
+        return len(data)
+
+    def flush(self) -> None:
+        self.sink.flush()
+
+    def writable(self) -> bool:
+        return True
+
+
+class _Source:
+    """
+    Readable file for callable consumers: restic dump's output, keeping count.
+    """
+
+    def __init__(self, source: typing.BinaryIO) -> None:
+        self.source = source
+        self.bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.source.read(size)
+        self.bytes += len(data)
+        return data
+
+    def readable(self) -> bool:
+        return True
+
+
+def _collect(
+    process: subprocess.Popen, handler: OutputHandler, source: Optional[typing.BinaryIO] = None
+) -> threading.Thread:
+    fd = (source or process.stdout).fileno()
+
+    def read() -> None:
+        with handler:
+            while chunk := os.read(fd, CHUNK_SIZE):
+                handler.feed(chunk)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    return reader
+
+
+def _pump(stream: StreamTarget, pipe: _Pipe, timeout: Timeout) -> tuple[int, str, float]:
+    """
+    Produce the stream into restic's stdin. Returns (producer exit code, error output, producer wait).
+    """
+    if (command := stream.producer_command()) is None:
+        try:
+            stream.producer(pipe)
+            return 0, "", 0.0
+        except Exception:
+            return 1, traceback.format_exc(), 0.0
+
+    producer = subprocess.Popen(command, stdout=subprocess.PIPE)
+    # a producer that hangs without output is killed on timeout too:
+    timeout.processes.append(producer)
+    waited = 0.0
+    fd = producer.stdout.fileno()
+    while True:
+        started = time.monotonic()
+        chunk = os.read(fd, CHUNK_SIZE)
+        waited += time.monotonic() - started
+        if not chunk:
+            break
+        try:
+            pipe.write(chunk)
+        except OSError:
+            # restic went away, stop producing
+            producer.kill()
+            break
+
+    exited = producer.wait()
+    return exited, f"producer {shlex.join(command)} exited with {exited}" if exited else "", waited
+
+
+def run_stream(
+    stream: StreamTarget, restic: str = "restic", from_command: Optional[bool] = None, log: Optional[Path] = None
+) -> StreamResult:
+    """
+    Back up one stream, never raising on failure.
+
+    Args:
+        stream: what to back up.
+        restic: the restic executable (resolved on $PATH, so the fan-out shim works too).
+        from_command: use `--stdin-from-command`; by default when possible (command producer, restic >= 0.17).
+        log: write restic's complete output to this file.
+    """
+    from .restic_binary import capabilities
+
+    if stream.producer_command() is None:
+        from_command = False
+    elif from_command is None:
+        from_command = capabilities().stdin_from_command
+
+    started = time.monotonic()
+    process = subprocess.Popen(
+        stream.restic_command(restic, from_command=from_command),
+        stdin=subprocess.DEVNULL if from_command else subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        # unbuffered, so backpressure from restic is measured per chunk:
+        bufsize=0,
+        # like for scripts, lets the fan-out shim know which target called it:
+        env=os.environ | {"CAPTAIN_HOOKS_SCRIPT": stream.path},
+    )
+    # restic's --json progress isn't kept, only errors and the summary:
+    handler = OutputHandler(log=log)
+    reader = _collect(process, handler)
+
+    pipe = _Pipe(process.stdin)
+    producer_exit, producer_error, producer_wait = 0, "", 0.0
+    with Timeout(stream.timeout, process) as timeout:
+        if not from_command:
+            producer_exit, producer_error, producer_wait = _pump(stream, pipe, timeout)
+            if producer_exit:
+                # restic would save whatever it got so far when stdin is closed normally:
+                process.kill()
+            with contextlib.suppress(OSError):
+                process.stdin.close()
+
+        reader.join()
+        exited = process.wait()
+
+    summary = handler.summaries[-1] if handler.summaries else None
+    _, lines = parse_output(handler.stdout)
+    if producer_error:
+        lines.append(producer_error.rstrip())
+
+    duration = time.monotonic() - started
+    snapshot = summary.get("snapshot_id") if summary and not producer_exit else None
+    size = (summary or {}).get("total_bytes_processed") or pipe.bytes
+    if snapshot:
+        lines.append(f"snapshot {snapshot} saved")
+    lines.append(f"{size} bytes in {duration:.1f}s ({size / duration / 1024**2 if duration else 0:.1f} MiB/s)")
+
+    exited = TIMEOUT_EXIT_CODE if timeout.expired else producer_exit or exited
+
+    return StreamResult(
+        script=stream,
+        exited=exited,
+        stdout="\n".join(lines),
+        duration=duration,
+        timed_out=timeout.expired,
+        snapshot=snapshot,
+        bytes=size,
+        producer_wait=producer_wait,
+        restic_wait=pipe.wait,
+        summary=summary,
+        snapshots=[snapshot] if snapshot else [],
+        output_bytes=handler.bytes,
+        log=str(log) if log else None,
+    )
+
+
+def run_restore(
+    stream: StreamTarget, snapshot: str = "latest", restic: str = "restic", log: Optional[Path] = None
+) -> StreamResult:
+    """
+    Restore one stream: `restic dump` of its file, handed to its `restore` consumer. Never raises on failure.
+
+    Args:
+        stream: what to restore (with a `restore` consumer).
+        snapshot: snapshot ID, or 'latest' (the latest stream snapshot with the stream's file).
+        restic: the restic executable.
+        log: write the complete output of the consumer to this file.
+    """
+    started = time.monotonic()
+    env = os.environ | {"CAPTAIN_HOOKS_SCRIPT": stream.path}
+    dump = subprocess.Popen(
+        stream.dump_command(restic, snapshot), stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env
+    )
+    errors = OutputHandler()
+    readers = [_collect(dump, errors, dump.stderr)]
+    handler = OutputHandler(log=log)
+
+    consumer_exit, consumer_error = 0, ""
+    with Timeout(stream.timeout, dump) as timeout:
+        if (command := stream.consumer_command()) is None:
+            source = _Source(dump.stdout)
+            try:
+                stream.restore(source)
+            except Exception:
+                consumer_exit, consumer_error = 1, traceback.format_exc()
+            size = source.bytes
+        else:
+            consumer = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0, env=env
+            )
+            timeout.processes.append(consumer)
+            readers.append(_collect(consumer, handler))
+            pipe = _Pipe(consumer.stdin)
+            while chunk := os.read(dump.stdout.fileno(), CHUNK_SIZE):
+                try:
+                    pipe.write(chunk)
+                except OSError:
+                    # the consumer went away, its exit code tells why
+                    break
+            with contextlib.suppress(OSError):
+                consumer.stdin.close()
+            consumer_exit = consumer.wait()
+            if consumer_exit:
+                consumer_error = f"restore {shlex.join(command)} exited with {consumer_exit}"
+            size = pipe.bytes
+
+        if consumer_exit:
+            dump.kill()
+        # (restic gets a broken pipe when the consumer didn't read everything)
+        dump.stdout.close()
+        for reader in readers:
+            reader.join()
+        dump_exit = dump.wait()
+
+    lines = [*errors.stdout.splitlines(), *handler.stdout.splitlines()]
+    if consumer_error:
+        lines.append(consumer_error.rstrip())
+    duration = time.monotonic() - started
+    lines.append(f"{size} bytes restored in {duration:.1f}s ({size / duration / 1024**2 if duration else 0:.1f} MiB/s)")
+
+    return StreamResult(
+        script=stream,
+        exited=TIMEOUT_EXIT_CODE if timeout.expired else consumer_exit or dump_exit,
+        stdout="\n".join(lines),
+        duration=duration,
+        timed_out=timeout.expired,
+        bytes=size,
+        output_bytes=handler.bytes,
+        log=str(log) if log else None,
+    )
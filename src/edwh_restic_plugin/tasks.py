@@ -1,54 +1,77 @@
-import json
 import os
 import subprocess
 import tempfile
+import time
 import typing
 from pathlib import Path
 
-import edwh.tasks
-import invoke
 from edwh import task
-from edwh.tasks import DOCKER_COMPOSE
 from invoke import Context
+from termcolor import cprint
 
-from .env import DOTENV, read_dotenv, set_env_value
+from . import tracing
+from .env import DOTENV, batch, read_dotenv, set_env_value
 from .forget import ResticForgetPolicy
 from .helpers import _require_restic
 from .repositories import Repository, registrations
-from .restictypes import DockerContainer
 
 
-def cli_repo(connection_choice: str = None, restichostname: str = None) -> Repository:
+def cli_repo(connection_choice: str = None, restichostname: str = None, env_path: Path = DOTENV) -> Repository:
     """
     Create a repository object and set up the connection to the backend.
     :param connection_choice: choose where you want to store the repo (local, SFTP, B2, swift)
     :param restichostname: which hostname to force for restic, or blank for default.
+    :param env_path: .env file with the repository settings (default: ./.env)
     :return: repository object
     """
-    env = read_dotenv(DOTENV)
-    if restichostname:
-        set_env_value(DOTENV, "RESTICHOSTNAME", restichostname)
+    with batch(env_path) as env:
+        if restichostname:
+            set_env_value(env_path, "RESTICHOSTNAME", restichostname)
+
+        # names only: the backend module itself is imported once the choice is made
+        options = registrations.names()
+
+        connection_lowercase = ""
+        if connection_choice is None:
+            # search for the most important backup and use it as default
+            for option in options:
+                if f"{option.upper()}_PASSWORD" in env:
+                    connection_lowercase = option.lower()
+                    break
+        else:
+            connection_lowercase = connection_choice.lower()
+
+        if not (repoclass := registrations.get(connection_lowercase)):
+            _options = ", ".join(list(options))
+            raise ValueError(f"Invalid connection type {connection_choice}. Please use one of {_options}!")
+
+        print("Use connection: ", connection_lowercase)
+        repo = repoclass(env_path)
+        # the settings `setup` asks for are written in one go:
+        repo.setup()
+    return repo
 
-    options = registrations.to_ordered_dict()
 
-    connection_lowercase = ""
-    if connection_choice is None:
-        # search for the most important backup and use it as default
-        for option in options:
-            if f"{option.upper()}_PASSWORD" in env:
-                connection_lowercase = option.lower()
-                break
+def cli_repos(connection_choice: str = None, restichostname: str = None) -> list[Repository]:
+    """
+    Like cli_repo, but for one or more repositories: 'os,b2' or 'all' (every repository with a password in .env).
+    """
+    if connection_choice is None or ("," not in connection_choice and connection_choice.lower() != "all"):
+        return [cli_repo(connection_choice, restichostname)]
+
+    if connection_choice.lower() == "all":
+        env = read_dotenv(DOTENV)
+        choices = [option for option in registrations.names() if f"{option.upper()}_PASSWORD" in env]
     else:
-        connection_lowercase = connection_choice.lower()
+        choices = [choice.strip() for choice in connection_choice.split(",") if choice.strip()]
 
-    if not (repoclass := registrations.get(connection_lowercase)):
-        _options = ", ".join(list(options))
-        raise ValueError(f"Invalid connection type {connection_choice}. Please use one of {_options}!")
+    repos: dict[str, Repository] = {}
+    for choice in choices:
+        repo = cli_repo(choice, restichostname)
+        # 'os,swift' is one repository:
+        repos.setdefault(repo._short_name, repo)
 
-    print("Use connection: ", connection_lowercase)
-    repo = repoclass()
-    repo.setup()
-    return repo
+    return list(repos.values())
 
 
 @task
@@ -57,6 +80,7 @@ def require_restic(c):
 
 
 @task(aliases=("setup", "init"))
+@tracing.traced("task.configure")
 def configure(c, connection_choice=None, restichostname=None):
     """Setup or update the backup command for your environment.
     connection_choice: choose where you want to store the repo (local, SFTP, B2, swift)
@@ -70,6 +94,7 @@ def configure(c, connection_choice=None, restichostname=None):
 
 
 @task
+@tracing.traced("task.backup")
 def backup(
     c,
     target: str = "",
@@ -77,6 +102,8 @@ def backup(
     message: str = None,
     verbose: bool = True,
     without_forget: bool = False,
+    parallel: int = 1,
+    timeout: float = None,
 ):
     """Performs a backup operation using restic on a local or remote/cloud file system.
 
@@ -85,10 +112,15 @@ def backup(
         target (str): The target of the backup (e.g. 'files', 'stream'; default is all types).
         connection_choice (str): The name of the connection to use for the backup.
             Defaults to None, which means the default connection will be used.
+            Use a comma separated list (e.g. 'os,b2') or 'all' to back up to multiple repositories at once:
+            the scripts run once and restic uploads to every repository concurrently.
         message (str): A message to attach to the backup snapshot.
             Defaults to None, which means no message will be attached.
         verbose (bool): If True, outputs more information about the backup process. Defaults to False.
         without_forget (bool): don't execute forget policy to purge old snapshots
+        parallel (int): how many captain-hooks scripts may run at the same time. Defaults to 1 (one by one).
+            Scripts with the same `# captain-hooks: group=...` header still run in sequence.
+        timeout (float): default maximum runtime in seconds per script (override with `# captain-hooks: timeout=...`).
 
     Raises:
         Exception: If an error occurs during the backup process.
@@ -109,16 +141,68 @@ def backup(
     # a file called 'foo' (optionally having a given header, no wildcards for the file name supported).
     # --exclude-larger-than 'size', Specified once to excludes files larger than the given size.
     # Please see 'restic help backup' for more specific information about each exclude option.
-    repo = cli_repo(connection_choice)
-    repo.backup(c, verbose, target, message)
+    repos = cli_repos(connection_choice)
+    if len(repos) > 1:
+        return _fan_out_backup(c, repos, target, message, verbose, with_forget, parallel, timeout)
+
+    repo = repos[0]
+    repo.backup(c, verbose, target, message, parallel=parallel, timeout=timeout)
 
     # if policy is available: execute forget after backing up:
     if with_forget and (policy := repo.determine_forget_policy()):
         repo.forget(c, policy)
 
 
-@task
-def restore(c, connection_choice: str = None, snapshot: str = "latest", target: str = "", verbose: bool = True):
+def _fan_out_backup(
+    c: Context,
+    repos: list[Repository],
+    target: str,
+    message: str | None,
+    verbose: bool,
+    with_forget: bool,
+    parallel: int,
+    timeout: float | None,
+):
+    from . import fanout, metrics
+
+    started = time.monotonic()
+    hook_results, per_target = fanout.backup(
+        c, repos, target, message, verbose=verbose, parallel=parallel, timeout=timeout
+    )
+    exit_code = fanout.report(hook_results, per_target)
+
+    for repo in repos:
+        run = metrics.start(repo, "backup")
+        run.duration, run.finished = time.monotonic() - started, time.time()
+        run.add_fan_out_results(hook_results, per_target[repo._short_name])
+        metrics.write(run)
+
+    # forget per repository with its own policy, but never for a repository whose backup just failed:
+    failed = fanout.failed_targets(per_target)
+    for repo in repos:
+        if not with_forget or repo._short_name in failed:
+            continue
+        if policy := repo.determine_forget_policy():
+            with fanout.restored_environ():
+                repo.forget(c, policy)
+
+    if exit_code > 0:
+        exit(exit_code)
+
+
+@task(iterable=["include"])
+@tracing.traced("task.restore")
+def restore(
+    c,
+    connection_choice: str = None,
+    snapshot: str = "latest",
+    target: str = "",
+    verbose: bool = True,
+    parallel: int = 1,
+    timeout: float = None,
+    refresh: bool = False,
+    include: list[str] = None,
+):
     """
     The restore function restores the latest backed-up files by default and puts them in a restore folder.
 
@@ -130,34 +214,57 @@ def restore(c, connection_choice: str = None, snapshot: str = "latest", target:
     :param snapshot: the ID where the files are backed up, default value is 'latest'.
     :param target: The target of the backup (e.g. 'files', 'stream'; default is all types).
     :param verbose: display verbose logs (inv restore -v).
+    :param parallel: how many restore scripts may run at the same time (default: 1, one by one).
+    :param timeout: default maximum runtime in seconds per script.
+    :param refresh: ignore the local snapshot cache when resolving the snapshot ID.
+    :param include: paths, path globs or file names to restore (repeatable), looked up in the local file index and
+                    passed to the scripts as $INCLUDE / $INCLUDE_FILE.
     :return: None
+
+    The restore runs in phases (prepare, restore, verify: `verify_<target>*` scripts, if any), which are timed.
     """
     # For restore, --target is the location where the restore should be placed, --path is the file/path that should be
     # retrieved from the repository.
     # 'which_restore' is a user input to enable restoring an earlier backup (default = latest).
-    # Stop the postgres services.
-    c.run(f"{DOCKER_COMPOSE} stop -t 1 pg-0 pg-1 pgpool", warn=True, hide=True)
-
-    # Get the volumes that are being used.
-    docker_inspect: invoke.Result = c.run("docker inspect pg-0 pg-1", hide=True, warn=True)
-    if docker_inspect.ok:
-        # Only if ok, because if pg-0 and pg-1 do not exist, this does not exist either, and nothing needs to be removed
-        inspected: list[DockerContainer] = json.loads(docker_inspect.stdout)
-        volumes_to_remove: list[str] = []
-        for service in inspected:
-            volumes_to_remove.extend(mount["Name"] for mount in service["Mounts"] if mount["Type"] == "volume")
-        # Remove the containers before a volume can be removed.
-        c.run(f"{DOCKER_COMPOSE} rm -f pg-0 pg-1")
-        # Remove the volumes.
-        for volume_name in volumes_to_remove:
-            c.run(f"docker volume rm {volume_name}")
-
-    cli_repo(connection_choice).restore(c, verbose, target, snapshot)
+    from .restore import Phases, export_includes, teardown, verify
+
+    phases = Phases()
+    try:
+        with phases.phase("prepare"):
+            repo = cli_repo(connection_choice)
+            # resolve (short) snapshot IDs via the snapshot cache before anything is torn down:
+            snapshot = repo.resolve_snapshot(c, snapshot, refresh=refresh)
+            if include:
+                paths = repo.restore_includes(c, include, snapshot)
+                if not paths:
+                    cprint(f"Nothing matching {', '.join(include)} found in the file index.", color="red")
+                    exit(1)
+                export_includes(paths)
+            # stop the postgres services and remove their containers and volumes
+            teardown(c)
+
+        with phases.phase("restore"):
+            repo.restore(c, verbose, target, snapshot, parallel=parallel, timeout=timeout)
+
+        with phases.phase("verify"):
+            if not verify(c, target, verbose, parallel=parallel, timeout=timeout):
+                exit(1)
+    finally:
+        phases.report()
+
     # print("`inv up` to restart the services.")
 
 
 @task(iterable=["tag"], aliases=["list"])
-def snapshots(c, connection_choice: str = None, tag: list[str] = None, n: int = 1, verbose: bool = False):
+@tracing.traced("task.snapshots")
+def snapshots(
+    c,
+    connection_choice: str = None,
+    tag: list[str] = None,
+    n: int = 1,
+    verbose: bool = False,
+    refresh: bool = False,
+):
     """
     With this you can see per repo which repo is made when and where, \
         the repo-id can be used at inv restore as an option
@@ -167,13 +274,53 @@ def snapshots(c, connection_choice: str = None, tag: list[str] = None, n: int =
     :param tag: files, stream ect
     :param n: amount of snapshot to view, default=1(latest)
     :param verbose: show which commands are being executed?
+    :param refresh: ignore the local snapshot cache and fetch all snapshot metadata again
     :return: None
     """
     # if tags is None set tag to default tags
     if tag is None:
         tag = ["files", "stream"]
 
-    cli_repo(connection_choice).snapshot(c, tags=tag, n=n, verbose=verbose)
+    cli_repo(connection_choice).snapshot(c, tags=tag, n=n, verbose=verbose, refresh=refresh)
+
+
+@task()
+@tracing.traced("task.find")
+def find(
+    c: Context,
+    pattern: str,
+    connection: str = None,
+    snapshot: str = None,
+    limit: int = 100,
+    update: bool = True,
+    refresh: bool = False,
+):
+    """
+    Find which snapshots contain a path, using a local index of `restic ls` (only new snapshots are listed).
+
+    :param pattern: absolute path ('/data/uploads', includes everything below it), path glob ('/data/*.sql')
+                    or file name ('*.sql', matched in any directory).
+    :param connection: service
+    :param snapshot: only search this snapshot (ID or prefix)
+    :param limit: maximum number of results (0 for all)
+    :param update: index new snapshots first (--no-update only uses what is indexed already)
+    :param refresh: ignore the local snapshot cache and fetch all snapshot metadata again
+    """
+    from .file_index import render_matches
+
+    repo = cli_repo(connection)
+    # one listing (and so at most one refresh) for both:
+    snapshots = repo.list_snapshots(c, refresh=refresh) if snapshot or update else None
+    snapshot_ids = [repo.resolve_snapshot(c, snapshot, snapshots=snapshots)] if snapshot else None
+    if update:
+        repo.index_files(c, snapshots=snapshots)
+
+    matches = repo.find_files(c, pattern, snapshot_ids=snapshot_ids, limit=limit or None, update=False)
+    if not matches:
+        cprint(f"Nothing matching {pattern} found.", color="yellow")
+        return
+
+    print(render_matches(matches))
 
 
 def interactive(conn: Repository):
@@ -181,6 +328,7 @@ def interactive(conn: Repository):
 
 
 @task(pre=[require_restic])
+@tracing.traced("task.run")
 def run(c, connection_choice: str = None, command: typing.Optional[str] = None):
     """
     This function prepares for restic and runs the input command until the user types "exit".
@@ -195,12 +343,15 @@ def run(c, connection_choice: str = None, command: typing.Optional[str] = None):
     if command:
         if not command.startswith("restic "):
             command = f"restic {command}"
-        print(c.run(command, hide=True, warn=True, pty=True))
+        if conn.restic_options:
+            command = command.replace("restic ", f"restic {conn.restic_options} ", 1)
+        print(tracing.run(c, command, hide=True, warn=True, pty=True))
     else:
         interactive(conn)
 
 
 @task()
+@tracing.traced("task.env")
 def env(c, connection_choice: str = None):
     """
 
@@ -217,10 +368,21 @@ def env(c, connection_choice: str = None):
             print(f"export {k.upper()}={v}")
 
 
-@task()
-def forget(c: Context, connection: str = None, policy: str = None, dry: bool = False):
+@task(iterable=["compare"])
+@tracing.traced("task.forget")
+def forget(
+    c: Context,
+    connection: str = None,
+    policy: str = None,
+    dry: bool = False,
+    copy_policy: bool = False,
+    simulate: bool = False,
+    compare: list[str] = None,
+    verbose: bool = False,
+):
     """
-    Run restic forget (with prune) based on a specific policy defined in a TOML configuration file.
+    Run restic forget based on a specific policy defined in a TOML configuration file.
+    Restic prune follows when its thresholds are met (see the prune task).
 
     This task retrieves a forgetting policy based on the active connection's short name (e.g. 'os')
     or its aliases (e.g. 'openstack', 'swift'), with a fallback to the key "default" if no specific policy is found.
@@ -251,21 +413,139 @@ def forget(c: Context, connection: str = None, policy: str = None, dry: bool = F
                                 If not provided, the policy will be retrieved from the TOML files as described above.
         dry (bool): If set to True, performs a dry run of the forget operation without making any changes.
             This allows users to see what would happen without actually deleting any snapshots.
+        copy_policy (bool): copy the policy found in 'default.toml' into '.toml' (under the connection's short name),
+            so it can be tuned per project. The TOML files are only read otherwise.
+        simulate (bool): don't run restic forget, but show what the policy would keep and remove, computed locally
+            from the (cached) snapshot list. Use --compare to put more policies next to it.
+        compare (list[str]): with --simulate: more policies, as restic arguments ('--keep-daily 7') or the name of
+            a [restic.forget.<name>] section. Can be repeated.
+        verbose (bool): with --simulate: show per snapshot whether (and why) each policy keeps it.
 
     See also:
         https://restic.readthedocs.io/en/latest/060_forget.html#removing-snapshots-according-to-a-policy
     """
 
     repo = cli_repo(connection)
+    resolved = ResticForgetPolicy.from_string(policy) if policy else repo.determine_forget_policy(copy=copy_policy)
 
-    repo.forget(
-        c,
-        policy=policy and ResticForgetPolicy.from_string(policy),
-        dry=dry,
-    )
+    if simulate:
+        return _simulate_forget(c, repo, resolved, compare or [], verbose)
+
+    repo.forget(c, policy=resolved, dry=dry)
+
+
+def _simulate_forget(
+    c: Context, repo: Repository, policy: ResticForgetPolicy | None, compare: list[str], verbose: bool
+) -> None:
+    import dataclasses
+
+    from . import forget_simulator
+    from .forget import PolicyResolver
+
+    candidates: list[tuple[str, ResticForgetPolicy]] = [("", policy)] if policy else []
+    for option in compare:
+        if option.lstrip().startswith("-"):
+            candidates.append(("", ResticForgetPolicy.from_string(option)))
+        elif named := PolicyResolver().named(option):
+            candidates.append((f"{option}: ", named))
+        else:
+            cprint(f"No [restic.forget.{option}] section in .toml or default.toml", color="red")
+            exit(1)
+
+    if not candidates:
+        cprint("Error: no forget policy could be found. Update your .toml or specify --policy", color="red")
+        exit(1)
+
+    snapshots = repo.list_snapshots(c)
+    simulations = {
+        # prune and dry-run don't change which snapshots are kept:
+        prefix + dataclasses.replace(candidate, prune=False, dry_run=False).to_string(): forget_simulator.simulate(
+            snapshots, candidate
+        )
+        for prefix, candidate in candidates
+    }
+    print(forget_simulator.render_comparison(simulations, snapshots if verbose else None))
+
+
+@task()
+@tracing.traced("task.prune")
+def prune(c: Context, connection: str = None, if_due: bool = False, dry: bool = False):
+    """
+    Run restic prune: remove the data that no snapshot uses anymore (after forget).
+
+    Prune is expensive (it repacks data and locks the repository), so after forget it only runs when one of the
+    thresholds in [restic.prune.<name>] (or [restic.prune.default]) of .toml/default.toml is met:
+
+        [restic.prune.default]
+        min-unused = "10%"      # estimated unused space
+        every-days = 30         # days since the last prune
+        after-forgets = 7       # forget runs that removed snapshots since the last prune
+        max-unused = "5%"       # passed to restic prune
+        max-repack-size = "2G"  # passed to restic prune
+        after-forget = false    # don't prune after forget (unless the policy has prune = true)
+
+    Args:
+        c (Context): The context in which the task is executed.
+        connection (str, optional): The name of the connection to use.
+        if_due (bool): only prune when a threshold is met (like after forget), instead of always.
+        dry (bool): show what restic prune would do, without changing the repository.
+    """
+    cli_repo(connection).prune(c, force=not if_due, dry=dry)
 
 
 @task()
+@tracing.traced("task.check")
+def check(
+    c: Context,
+    connection: str = None,
+    mode: typing.Literal["metadata", "rotate", "full"] = "full",
+    parts: int = None,
+    budget: str = None,
+    status: bool = False,
+):
+    """
+    Run restic check: verify the structure of the repository and (part of) its data.
+
+    Args:
+        c (Context): The context in which the task is executed.
+        connection (str, optional): The name of the connection to use.
+        mode (Literal): what to check:
+            - "metadata": only the structure (index, snapshots, trees), no data is downloaded. Fast, for daily use.
+            - "rotate": the next part of the data (--read-data-subset=n/t), all data is read in t runs.
+            - "full": all data (--read-data), downloads the whole repository.
+        parts (int): rotate: in how many runs all data is read (default: RESTIC_CHECK_PARTS in .env, or 10).
+        budget (str): rotate: read at most this much per run, e.g. '50G' (default: RESTIC_CHECK_BUDGET in .env).
+            Uses more parts when needed, based on the repository size as known locally.
+        status (bool): only show the progress of the rotating check and the last data read, without checking.
+    """
+    from .checks import CheckState
+
+    repo = cli_repo(connection)
+    if status:
+        repo.prepare_env_for_restic(c)
+        return print(CheckState.load(repo.uri).describe())
+
+    repo.check(c, mode=mode, parts=parts, budget=budget)
+
+
+@task()
+@tracing.traced("task.migrate-messages")
+def migrate_messages(c: Context, connection: str = None, dry: bool = False, verbose: bool = False):
+    """
+    Convert old-style 'message' snapshots (one extra snapshot per backup run) into message tags on the snapshots
+    of that run, then forget the message snapshots.
+
+    Args:
+        c (Context): The context in which the task is executed.
+        connection (str, optional): The name of the connection to use.
+        dry (bool): only show which messages would be moved.
+        verbose (bool): show the restic commands that are executed.
+    """
+    cli_repo(connection).migrate_message_snapshots(c, dry=dry, verbose=verbose)
+
+
+@task()
+@tracing.traced("task.unlock")
 def unlock(c: Context, connection: str = None, remove_all: bool = False):
     """
     Run restic unlock.
@@ -275,15 +555,16 @@ def unlock(c: Context, connection: str = None, remove_all: bool = False):
 
     repo.prepare_env_for_restic(c)
 
-    args = ["restic", "unlock"]
+    args = ["restic", repo.restic_options, "unlock"]
 
     if remove_all:
         args.append("--remove-all")
 
-    c.run(" ".join(args))
+    tracing.run(c, " ".join(args))
 
 
 @task(aliases=("stats", "stat"))
+@tracing.traced("task.du")
 def du(
     c: Context,
     connection: str = None,
@@ -307,13 +588,127 @@ def du(
                 - "raw-data": Provides the most detailed information about the repository's data.
 
     """
+    from .metrics import parse_stats, recording
+
     repo = cli_repo(connection)
-    repo.prepare_env_for_restic(c)
+    with recording(repo, "du") as run:
+        repo.prepare_env_for_restic(c)
+
+        ran = tracing.run(c, f"restic {repo.restic_options} stats --mode {mode}")
+        run.values |= parse_stats(ran.stdout)
 
-    c.run(f"restic stats --mode {mode}")
+    if mode == "raw-data" and (size := run.values.get("repository_size_bytes")):
+        from .prune import record_size
+
+        # the unused space is estimated relative to this (see the prune task):
+        record_size(repo.uri, int(size))
 
 
 @task()
+@tracing.traced("task.warm-cache")
+def warm_cache(c: Context, connection: str = None, verbose: bool = False):
+    """
+    Fill restic's local cache (snapshots, index and the trees of the latest snapshots),
+    e.g. from a cron job shortly before the backup window.
+
+    Args:
+        c (Context): The context in which the task is executed.
+        connection (str, optional): The name of the connection to use.
+        verbose (bool): show the restic commands that are executed.
+    """
+    from . import restic_cache
+
+    repo = cli_repo(connection)
+    started = time.monotonic()
+    entry = repo.warm_cache(c, verbose=verbose)
+    duration = time.monotonic() - started
+
+    if entry is None:
+        cprint(f"No restic cache was created in {repo.restic_cache_root}", color="yellow")
+        return
+
+    cprint(
+        f"Warmed {entry.path} in {duration:.1f}s: {restic_cache.format_size(entry.size)}, "
+        f"{entry.files['snapshots']} snapshots, {entry.files['index']} index files, {entry.files['data']} packs",
+        color="green",
+    )
+
+
+@task(name="cache")
+@tracing.traced("task.cache")
+def cache_(
+    c: Context,
+    connection: str = None,
+    evict: bool = False,
+    max_size: str = None,
+    max_age: float = None,
+    dry: bool = False,
+):
+    """
+    Show the restic caches in the managed cache root, and optionally evict old ones.
+
+    Args:
+        c (Context): The context in which the task is executed.
+        connection (str, optional): Use the cache settings of this connection, and never evict its cache.
+        evict (bool): remove caches that exceed the budget (see max_size and max_age).
+        max_size (str): disk budget for all caches together, e.g. 10G. Defaults to RESTIC_CACHE_MAX_SIZE.
+        max_age (float): evict caches unused for this many days. Defaults to RESTIC_CACHE_MAX_AGE.
+        dry (bool): only show which caches would be evicted.
+    """
+    from . import restic_cache
+    from .snapshot_cache import SnapshotCache
+
+    keep = set()
+    if connection:
+        repo = cli_repo(connection)
+        repo.prepare_env_for_restic(c)
+        env = repo.env_config
+        with SnapshotCache() as snapshot_cache:
+            keep.add(repo.repository_id(c, snapshot_cache))
+    else:
+        env = read_dotenv(DOTENV)
+
+    root = restic_cache.cache_root(env)
+    entries = restic_cache.scan(root)
+
+    with SnapshotCache() as snapshot_cache:
+        uris = snapshot_cache.repositories()
+        known_snapshots = {entry.repo_id: snapshot_cache.count(entry.repo_id) for entry in entries}
+
+    print(f"restic cache root: {root}")
+    for entry in entries:
+        # 'coverage' of the cache: how many of the repository's snapshots are cached locally
+        total = known_snapshots.get(entry.repo_id) or 0
+        coverage = f"{entry.files['snapshots']}/{total} snapshots" if total else f"{entry.files['snapshots']} snapshots"
+        print(
+            f"- {entry.repo_id[:8]} {', '.join(uris.get(entry.repo_id, ['?']))}: "
+            f"{restic_cache.format_size(entry.size)}, {coverage}, {entry.files['index']} index files, "
+            f"{entry.files['data']} packs, last used {entry.last_used_at:%Y-%m-%d %H:%M} ({entry.age_days:.0f}d ago)"
+        )
+    print(f"total: {restic_cache.format_size(sum(entry.size for entry in entries))}")
+
+    if not evict:
+        return
+
+    max_size_bytes = restic_cache.parse_size(max_size or env.get("RESTIC_CACHE_MAX_SIZE"))
+    max_age = max_age if max_age is not None else env.get("RESTIC_CACHE_MAX_AGE")
+    evictions = restic_cache.select_evictions(
+        entries,
+        max_size=max_size_bytes,
+        max_age_days=float(max_age) if max_age else None,
+        keep=keep,
+    )
+
+    for entry in evictions:
+        cprint(f"evict {entry.path} ({restic_cache.format_size(entry.size)})", color="yellow")
+
+    if not dry:
+        freed = restic_cache.evict(evictions)
+        cprint(f"freed {restic_cache.format_size(freed)}", color="green")
+
+
+@task()
+@tracing.traced("task.wipe")
 def wipe(c, connection: str = None):
     repo = cli_repo(connection)
     repo.prepare_env_for_restic(c)
@@ -325,9 +720,96 @@ def wipe(c, connection: str = None):
 
     print(repo.wipe())
 
+    from .snapshot_cache import SnapshotCache
+
+    # cached snapshot metadata no longer matches the repository:
+    with SnapshotCache() as cache:
+        cache.forget_repository(repo.uri)
+
+
+@task(iterable=["tag"])
+@tracing.traced("task.replicate")
+def replicate(
+    c: Context,
+    source: str = None,
+    target: str = None,
+    source_env: str = None,
+    target_env: str = None,
+    tag: list[str] = None,
+    host: str = None,
+    since: str = None,
+    parallel: int = 1,
+    batch_size: int = 20,
+    init: bool = False,
+    dry: bool = False,
+    refresh: bool = False,
+    verbose: bool = False,
+):
+    """
+    Copy snapshots from one repository to another with `restic copy` (only new data is transferred).
+
+    Snapshots copied by earlier runs are remembered locally, so repeated runs only copy new snapshots.
+
+    Args:
+        c: invoke Context
+        source (str): connection to copy from (e.g. 'os').
+        target (str): connection to copy to (e.g. 'b2').
+        source_env (str): .env file with the source settings (default: ./.env).
+        target_env (str): .env file with the target settings (default: ./.env),
+            e.g. to copy between two repositories of the same type.
+        tag (list[str]): only snapshots with this tag (repeatable, 'a,b' means both).
+        host (str): only snapshots made by this host.
+        since (str): only snapshots newer than a date (2024-05-01) or age (7d, 12h).
+        parallel (int): how many `restic copy` batches run at the same time.
+        batch_size (int): snapshots per `restic copy` call.
+        init (bool): initialize the target repository (with the source's chunker parameters) if it doesn't exist.
+        dry (bool): only show how many snapshots would be copied.
+        refresh (bool): ignore the local snapshot cache of the source.
+        verbose (bool): show the restic commands and their output.
+    """
+    from .replicate import Replicator, parse_since
+    from .restic_binary import find_restic
+
+    if not source or not target:
+        raise ValueError("Please specify both --source and --target.")
+
+    source_repo = cli_repo(source, env_path=Path(source_env) if source_env else DOTENV)
+    target_repo = cli_repo(target, env_path=Path(target_env) if target_env else DOTENV)
+
+    replicator = Replicator(c, source_repo, target_repo, restic=find_restic() or "restic", verbose=verbose)
+    result = replicator.run(
+        tags=tag or (),
+        host=host,
+        since=parse_since(since) if since else None,
+        parallel=parallel,
+        batch_size=batch_size,
+        dry=dry,
+        refresh=refresh,
+        init=init,
+    )
+
+    if dry:
+        print(f"{len(result.copied)} snapshots would be copied, {result.skipped} were copied before.")
+        return
+
+    cprint(f"{len(result.copied)} snapshots copied, {result.skipped} were copied before.", color="green")
+    if result.failed:
+        cprint(f"{len(result.failed)} snapshots failed to copy.", color="red")
+        exit(1)
+
 
 @task()
-def move(c: Context, source: str = "", target: str = "", dry: bool = False):
+@tracing.traced("task.move")
+def move(
+    c: Context,
+    source: str = "",
+    target: str = "",
+    dry: bool = False,
+    restart: bool = False,
+    server_side: bool = True,
+    transfers: int = None,
+    checkers: int = None,
+):
     """Moves everything from source bucket to target bucket
     Args:
         c: Context
@@ -335,7 +817,15 @@ def move(c: Context, source: str = "", target: str = "", dry: bool = False):
         target: target bucket
         dry: set to True to do a dry run of move. This mimics the function without actually moving files.
              NOTE, It's recommended to do a dry run first since dataloss is possible.
+        restart: ignore the progress of an earlier, interrupted move and start over.
+        server_side: copy objects server-side when both buckets are on the same provider (--no-server-side to disable).
+        transfers: number of parallel file transfers (default: depends on the backends).
+        checkers: number of parallel checkers (default: depends on the backends).
     """
+    from edwh.tasks import confirm
+
+    from .move import MoveCheckpoint, RcloneMove, rclone_flags, write_rclone_config
+
     print(source, target)
     source_repo = cli_repo(source)
     source_repo.prepare_env_for_restic(c)
@@ -343,25 +833,30 @@ def move(c: Context, source: str = "", target: str = "", dry: bool = False):
     target_repo = cli_repo(target)
     target_repo.prepare_env_for_restic(c)
 
+    checkpoint = MoveCheckpoint.load(source_repo.uri, target_repo.uri)
+    if restart:
+        checkpoint.clear()
+
     with tempfile.TemporaryDirectory() as rclone:
         rclone_config = Path(rclone) / "rclone.config"
-        rclone_config.write_text(f"""[{source}]
-{source_repo.prepare_rclone_config()}
-
-[{target}]
-{target_repo.prepare_rclone_config()}""")
-
-        rclone = f"rclone --config {rclone_config}"
-        check_target_files = c.run(
-            f"{rclone} lsf -R --files-only {target}:{target_repo.bucket} | wc -l", hide=True
-        ).stdout.strip()
-        if int(check_target_files) > 0:
-            if not edwh.tasks.confirm(
-                f"There are {check_target_files} files in the target bucket. Continuing might overwrite them. Continue? [Yn] ",
-                default=True,
-            ):
-                return
-        params: str = ""
-        if dry:
-            params += "--dry-run"
-        c.run(f"{rclone} sync {source}:{source_repo.bucket} {target}:{target_repo.bucket} {params}")
+        write_rclone_config(rclone_config, source_repo, target_repo)
+
+        mover = RcloneMove(
+            c,
+            rclone=f"rclone --config {rclone_config}",
+            source=f"source:{source_repo.bucket}",
+            target=f"target:{target_repo.bucket}",
+            flags=rclone_flags(source_repo, target_repo, server_side, transfers=transfers, checkers=checkers),
+        )
+
+        if checkpoint.done:
+            print(f"Resuming earlier move: {len(checkpoint.done)} parts were done already (--restart to start over).")
+        elif not mover.target_is_empty() and not confirm(
+            "The target bucket is not empty. Continuing might overwrite files. Continue? [Yn] ",
+            default=True,
+        ):
+            return
+
+        if failed := mover.run(checkpoint, dry=dry):
+            cprint(f"Moving failed for: {', '.join(failed)}. Run again to retry (finished parts are skipped).", "red")
+            exit(1)
@@ -0,0 +1,328 @@
+"""
+Span based tracing of tasks, in the OpenTelemetry (OTLP) JSON format.
+
+Off by default. Set $EDWH_RESTIC_TRACE to enable it:
+- a file path (e.g. /var/log/restic-trace.jsonl): every traced task run is appended as one line of OTLP JSON
+  (an `ExportTraceServiceRequest`, like the file exporter of the OpenTelemetry collector writes).
+- an http(s) URL (e.g. http://localhost:4318): the spans are POSTed to a collector's OTLP/HTTP endpoint
+  (`/v1/traces` is added when the URL has no path).
+
+Spans nest via a context variable: a task is the root span, below it env loading, backend preparation,
+each captain-hooks script/stream and each restic invocation, with wall time, exit code and bytes of output.
+When tracing is off, `span()` returns a shared no-op object, so instrumented code only pays for one lookup.
+"""
+
+import contextvars
+import functools
+import os
+import sys
+import time
+import typing
+from dataclasses import dataclass, field
+from typing import Optional
+
+if typing.TYPE_CHECKING:
+    from invoke import Context, Result
+
+TRACE_ENV = "EDWH_RESTIC_TRACE"
+SERVICE_NAME = "edwh-restic-plugin"
+# seconds to wait for a collector, a slow collector should never hold up a backup:
+EXPORT_TIMEOUT = 5
+
+# OTLP enums:
+SPAN_KIND_INTERNAL = 1
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+# (first word of) restic subcommands, to name spans after 'restic <subcommand>':
+_SUBCOMMANDS = frozenset(
+    {
+        "backup",
+        "cache",
+        "cat",
+        "check",
+        "copy",
+        "diff",
+        "dump",
+        "find",
+        "forget",
+        "init",
+        "key",
+        "list",
+        "ls",
+        "migrate",
+        "mount",
+        "prune",
+        "recover",
+        "repair",
+        "restore",
+        "rewrite",
+        "self-update",
+        "snapshots",
+        "stats",
+        "tag",
+        "unlock",
+        "version",
+        "lsf",
+        "sync",
+    }
+)
+
+T = typing.TypeVar("T", bound=typing.Callable[..., typing.Any])
+
+
+@dataclass
+class Trace:
+    """
+    The finished spans of one root span, exported together when the root span ends.
+    """
+
+    destination: str
+    trace_id: str = field(default_factory=lambda: os.urandom(16).hex())
+    spans: list["Span"] = field(default_factory=list)
+
+
+@dataclass
+class Span:
+    """
+    One timed operation. Use as a context manager, the span is current (= parent of new spans) while inside.
+
+    Attributes:
+        name (str): e.g. 'task.backup' or 'restic snapshots'.
+        trace (Trace): the trace this span belongs to.
+        parent_id (Optional[str]): span ID of the parent, None for the root span.
+        attributes (dict): extra information, e.g. exit_code or stdout_bytes.
+    """
+
+    name: str
+    trace: Trace
+    parent_id: Optional[str] = None
+    attributes: dict[str, typing.Any] = field(default_factory=dict)
+    span_id: str = field(default_factory=lambda: os.urandom(8).hex())
+    start_ns: int = 0
+    end_ns: int = 0
+    error: Optional[str] = None
+    _token: Optional[contextvars.Token] = field(default=None, repr=False)
+
+    # (False for the no-op span, check this before computing expensive attributes)
+    recording = True
+
+    def set(self, **attributes: typing.Any) -> None:
+        self.attributes |= {key: value for key, value in attributes.items() if value is not None}
+
+    @property
+    def traceparent(self) -> str:
+        """W3C trace context, so child processes can continue this trace."""
+        return f"00-{self.trace.trace_id}-{self.span_id}-01"
+
+    def __enter__(self) -> "Span":
+        self.start_ns = time.time_ns()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type: typing.Any, exc: Optional[BaseException], _: typing.Any) -> None:
+        self.end_ns = time.time_ns()
+        _current.reset(self._token)
+
+        if isinstance(exc, SystemExit):
+            # exit(0) is fine, exit(n) is how tasks report failures:
+            if exc.code:
+                self.set(exit_code=exc.code if isinstance(exc.code, int) else 1)
+                self.error = f"exit {exc.code}"
+        elif exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        elif isinstance(exit_code := self.attributes.get("exit_code"), int) and exit_code != 0:
+            self.error = f"exit {exit_code}"
+
+        # appending to a list is thread safe, spans of concurrent scripts can finish at the same time:
+        self.trace.spans.append(self)
+        if self.parent_id is None:
+            export(self.trace)
+
+
+class _NoopSpan:
+    """
+    Stand-in when tracing is off: does nothing, as cheaply as possible.
+    """
+
+    recording = False
+    traceparent = None
+
+    def set(self, **_: typing.Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *_: typing.Any) -> None:
+        pass
+
+
+NOOP = _NoopSpan()
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("edwh_restic_span", default=None)
+
+
+def current() -> Optional[Span]:
+    return _current.get()
+
+
+def span(name: str, **attributes: typing.Any) -> Span | _NoopSpan:
+    """
+    A child of the current span, or a new root span (= a new trace) when $EDWH_RESTIC_TRACE is set.
+    """
+    if (parent := _current.get()) is not None:
+        new = Span(name, parent.trace, parent_id=parent.span_id)
+    elif destination := os.environ.get(TRACE_ENV):
+        new = Span(name, Trace(destination))
+    else:
+        return NOOP
+
+    new.set(**attributes)
+    return new
+
+
+def traced(name: str) -> typing.Callable[[T], T]:
+    """
+    Decorator: run the function in a span. Keeps the signature intact (invoke reads it for the CLI arguments).
+    """
+
+    def decorator(function: T) -> T:
+        @functools.wraps(function)
+        def wrapper(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+            simple = {key: value for key, value in kwargs.items() if isinstance(value, (str, int, float, bool))}
+            with span(name, **{f"arg.{key}": value for key, value in simple.items()}):
+                return function(*args, **kwargs)
+
+        return typing.cast(T, wrapper)
+
+    return decorator
+
+
+def command_name(command: str) -> str:
+    """
+    'restic -r s3:... snapshots --json' -> 'restic snapshots'.
+    """
+    words = command.split()
+    if not words:
+        return "run"
+
+    program = os.path.basename(words[0])
+    subcommand = next((word for word in words[1:] if word in _SUBCOMMANDS), None)
+    return f"{program} {subcommand}" if subcommand else program
+
+
+def output_attributes(result: Optional["Result"]) -> dict[str, typing.Any]:
+    if result is None:
+        return {}
+    return {
+        "exit_code": result.exited,
+        "stdout_bytes": len(result.stdout.encode(errors="replace")),
+        "stderr_bytes": len(result.stderr.encode(errors="replace")),
+    }
+
+
+def run(c: "Context", command: str, **kwargs: typing.Any) -> "Result":
+    """
+    `c.run(command, **kwargs)` in a span named after the command (see command_name).
+    """
+    if _current.get() is None and not os.environ.get(TRACE_ENV):
+        return c.run(command, **kwargs)
+
+    from invoke.exceptions import UnexpectedExit
+
+    with span(command_name(command), command=command) as current_span:
+        try:
+            result = c.run(command, **kwargs)
+        except UnexpectedExit as e:
+            current_span.set(**output_attributes(e.result))
+            raise
+        current_span.set(**output_attributes(result))
+        return result
+
+
+def _value(value: typing.Any) -> dict[str, typing.Any]:
+    # int64 is a string in (proto3) JSON:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _attributes(attributes: dict[str, typing.Any]) -> list[dict[str, typing.Any]]:
+    return [{"key": key, "value": _value(value)} for key, value in attributes.items()]
+
+
+def to_otlp(trace: Trace) -> dict[str, typing.Any]:
+    """
+    The spans of a trace as an OTLP `ExportTraceServiceRequest` (JSON encoding), parents before their children.
+    """
+    import socket
+
+    from .__about__ import __version__
+
+    spans = sorted(trace.spans, key=lambda item: item.start_ns)
+    resource = {"service.name": SERVICE_NAME, "service.version": __version__, "host.name": socket.gethostname()}
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": _attributes(resource)},
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "edwh_restic_plugin", "version": __version__},
+                        "spans": [
+                            {
+                                "traceId": trace.trace_id,
+                                "spanId": item.span_id,
+                                "parentSpanId": item.parent_id or "",
+                                "name": item.name,
+                                "kind": SPAN_KIND_INTERNAL,
+                                "startTimeUnixNano": str(item.start_ns),
+                                "endTimeUnixNano": str(item.end_ns),
+                                "attributes": _attributes(item.attributes),
+                                "status": (
+                                    {"code": STATUS_ERROR, "message": item.error} if item.error else {"code": STATUS_OK}
+                                ),
+                            }
+                            for item in spans
+                        ],
+                    }
+                ],
+            }
+        ]
+    }
+
+
+def export(trace: Trace) -> None:
+    """
+    Write the trace to the file or collector in $EDWH_RESTIC_TRACE. Failing to export never fails the task.
+    """
+    import json
+
+    payload = json.dumps(to_otlp(trace), separators=(",", ":"))
+    destination = trace.destination
+    try:
+        if destination.startswith(("http://", "https://")):
+            _post(destination, payload)
+        else:
+            with open(os.path.expanduser(destination), "a") as f:
+                f.write(payload + "\n")
+    except (OSError, ValueError) as e:
+        print(f"could not export trace to {destination}: {e}", file=sys.stderr)
+
+
+def _post(url: str, payload: str) -> None:
+    import urllib.parse
+    import urllib.request
+
+    if urllib.parse.urlsplit(url).path in ("", "/"):
+        url = url.rstrip("/") + "/v1/traces"
+
+    request = urllib.request.Request(
+        url, data=payload.encode(), headers={"Content-Type": "application/json"}, method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=EXPORT_TIMEOUT):
+        pass
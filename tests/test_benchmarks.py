@@ -0,0 +1,165 @@
+"""
+Micro-benchmarks for the plugin's own Python code, with synthetic inputs and a fake `restic` (so they run offline).
+
+Requires pytest-benchmark (`hatch run bench:check`, see pyproject.toml); skipped otherwise.
+Run `hatch run bench:save` on the main branch to store a baseline in .benchmarks/,
+`hatch run bench:check` fails when the fastest round of a benchmark got more than 25% slower than in
+the baseline (the minimum is less sensitive to noise from other processes than the mean).
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from invoke import Config, Context
+
+from src.edwh_restic_plugin import env, restic_binary
+from src.edwh_restic_plugin.fanout import restored_environ
+from src.edwh_restic_plugin.forget import ResticForgetPolicy
+from src.edwh_restic_plugin.repositories import registrations
+from src.edwh_restic_plugin.repositories.local import LocalRepository
+from src.edwh_restic_plugin.snapshots import parse_snapshots, render_table
+from src.edwh_restic_plugin.tasks import cli_repo
+
+from .test_snapshots import fake_snapshot
+
+SNAPSHOTS = 10_000
+ENV_LINES = 5_000
+TOML_SECTIONS = 1_000
+
+# serves `cat config`, `list snapshots` and `snapshots --json` from <repo>/snapshots.json:
+FAKE_RESTIC = """#!{python}
+import json, sys
+from pathlib import Path
+
+args = sys.argv[1:]
+repo = Path(args[args.index("-r") + 1])
+snapshots = json.loads((repo / "snapshots.json").read_text())
+if "cat" in args:
+    print(json.dumps({{"id": "benchmark"}}))
+elif "list" in args:
+    print("\\n".join(s["id"] for s in snapshots))
+else:
+    print(json.dumps(snapshots))
+"""
+
+
+def synthetic_snapshots(count: int = SNAPSHOTS) -> list[dict]:
+    tags = (["files"], ["stream"], ["files", "msg=nightly%2C all"])
+    return [fake_snapshot(idx, tags[idx % len(tags)], minute=idx % 60) for idx in range(1, count + 1)]
+
+
+@pytest.fixture(scope="module")
+def snapshots_json() -> str:
+    return json.dumps(synthetic_snapshots())
+
+
+@pytest.fixture
+def large_env(tmp_path):
+    path = tmp_path / ".env"
+    lines = [f"# setting {idx}\nSETTING_{idx}=value {idx}  # trailing comment" for idx in range(ENV_LINES)]
+    path.write_text("\n".join([*lines, f"LOCAL_NAME={tmp_path / 'repo'}", "LOCAL_PASSWORD=secret", ""]))
+    return path
+
+
+@pytest.fixture
+def fake_restic(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    restic = bin_dir / "restic"
+    restic.write_text(FAKE_RESTIC.format(python=sys.executable))
+    restic.chmod(0o755)
+
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path / "cache"))
+    restic_binary.forget_restic()
+    yield
+    restic_binary.forget_restic()
+
+
+@pytest.mark.benchmark(group="snapshots")
+def test_parse_snapshots(benchmark, snapshots_json):
+    snapshots = benchmark(parse_snapshots, snapshots_json)
+    assert len(snapshots) == SNAPSHOTS
+
+
+@pytest.mark.benchmark(group="snapshots")
+def test_render_table(benchmark, snapshots_json):
+    snapshots = parse_snapshots(snapshots_json)
+    table = benchmark(render_table, snapshots)
+    assert table.count("\n") >= SNAPSHOTS
+
+
+@pytest.mark.benchmark(group="snapshots")
+@pytest.mark.usefixtures("fake_restic")
+def test_repository_snapshot(benchmark, tmp_path, large_env, snapshots_json, capsys):
+    (tmp_path / "repo").mkdir()
+    (tmp_path / "repo" / "snapshots.json").write_text(snapshots_json)
+
+    with restored_environ():
+        c = Context(Config(overrides={"run": {"in_stream": False}}))
+        repo = LocalRepository(large_env)
+        repo.setup()
+        # the first call fills the snapshot cache, the benchmark measures the warm (incremental) path:
+        repo.snapshot(c, n=SNAPSHOTS)
+        benchmark(repo.snapshot, c, n=SNAPSHOTS)
+
+    assert capsys.readouterr().out.count("00000001") >= 1
+
+
+@pytest.mark.benchmark(group="forget-policy")
+def test_policy_to_string(benchmark):
+    policy = ResticForgetPolicy(keep_last=10, keep_daily=7, keep_tag=[f"tag-{idx}" for idx in range(100)], prune=True)
+    assert benchmark(policy.to_string).count("--keep-tag") == 100
+
+
+@pytest.mark.benchmark(group="forget-policy")
+def test_policy_from_string(benchmark):
+    args = " ".join(["--keep-last 10 --keep-daily=7 --prune", *(f"--keep-tag tag-{idx}" for idx in range(100))])
+    policy = benchmark(ResticForgetPolicy.from_string, args)
+    assert len(policy.keep_tag) == 100
+
+
+@pytest.mark.benchmark(group="forget-policy")
+def test_policy_from_toml_file(benchmark, tmp_path):
+    toml = tmp_path / ".toml"
+    sections = [
+        f"[restic.forget.section-{idx}]\nkeep-last = {idx}\nkeep-within = '{idx}d'\nprune = true\n"
+        for idx in range(TOML_SECTIONS)
+    ]
+    toml.write_text("\n".join(sections))
+
+    policy = benchmark(ResticForgetPolicy.from_toml_file, f"section-{TOML_SECTIONS - 1}", toml)
+    assert policy.keep_last == TOML_SECTIONS - 1
+
+
+@pytest.mark.benchmark(group="env")
+def test_read_dotenv(benchmark, large_env):
+    # without the in-memory cache, to measure the parsing:
+    settings = benchmark.pedantic(env.read_dotenv, args=(large_env,), setup=env._dotenv_settings.clear, rounds=50)
+    assert len(settings) == ENV_LINES + 2
+
+
+@pytest.mark.benchmark(group="env")
+def test_set_env_value(benchmark, large_env):
+    benchmark(env.set_env_value, large_env, "SETTING_2500", "changed")
+    assert "SETTING_2500=changed" in large_env.read_text()
+
+
+@pytest.mark.benchmark(group="registry")
+def test_registry_lookup(benchmark):
+    assert benchmark(registrations.get, "local") is LocalRepository
+
+
+@pytest.mark.benchmark(group="registry")
+@pytest.mark.usefixtures("fake_restic")
+def test_cli_repo(benchmark, large_env, capsys):
+    with restored_environ():
+        repo = benchmark(cli_repo, None, env_path=large_env)
+
+    assert isinstance(repo, LocalRepository)
+    capsys.readouterr()
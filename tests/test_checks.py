@@ -0,0 +1,123 @@
+import os
+import sys
+
+import pytest
+from invoke import Config, Context
+
+from src.edwh_restic_plugin import checks, prune, restic_binary, tasks
+from src.edwh_restic_plugin.fanout import restored_environ
+from src.edwh_restic_plugin.repositories.local import LocalRepository
+from src.edwh_restic_plugin.repositories.sftp import SFTPRepository
+
+FAKE_RESTIC = """#!{python}
+import os, sys
+
+args = sys.argv[1:]
+if "check" in args:
+    with open(os.environ["RESTIC_LOG"], "a") as log:
+        log.write(" ".join(args[args.index("check") :]) + "\\n")
+    print("read group #1 of 12 data packs (out of total 36 packs in 3 groups)")
+    print("no errors were found")
+"""
+
+
+def test_rotation(tmp_path, monkeypatch):
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path))
+
+    assert checks.parts_for(None, None, None) == checks.DEFAULT_PARTS
+    # one part may not exceed the budget:
+    assert checks.parts_for(4, 100, 1000) == 10
+    assert checks.parts_for(20, 100, 1000) == 20
+    # a budget without a known size: no rotation
+    assert checks.parts_for(None, 100, None) is None
+
+    state = checks.CheckState.load("s3:bucket")
+    assert [state.next_part(3) for _ in range(2)] == [1, 1]
+    for part in (1, 3):
+        state.record(checks.CheckRun(1000.0 + part, f"{part}/3", 10.0, read_bytes=500), part)
+    state = checks.CheckState.load("s3:bucket")
+    assert (state.next_part(3), round(state.coverage, 2), state.last_complete) == (2, 0.67, None)
+    assert state.last_run.throughput == 50
+
+    state.record(checks.CheckRun(1010.0, "2/3", 10.0), 2)
+    assert state.last_complete == 1010.0
+    # a complete cycle starts over, just like a different number of parts:
+    assert state.next_part(3) == 1 and state.done == []
+    state.done = [1]
+    assert state.next_part(4) == 1 and state.parts == 4
+
+
+@pytest.fixture
+def fake_restic(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    restic = bin_dir / "restic"
+    restic.write_text(FAKE_RESTIC.format(python=sys.executable))
+    restic.chmod(0o755)
+
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("RESTIC_LOG", str(tmp_path / "restic.log"))
+    monkeypatch.delenv("RESTIC_CHECK_PARTS", raising=False)
+    monkeypatch.delenv("RESTIC_CHECK_BUDGET", raising=False)
+    restic_binary.forget_restic()
+    yield
+    restic_binary.forget_restic()
+
+
+@pytest.mark.usefixtures("fake_restic")
+def test_rotating_check(tmp_path, capsys):
+    env = tmp_path / ".env"
+    env.write_text(f"LOCAL_NAME={tmp_path / 'repo'}\nLOCAL_PASSWORD=secret\nRESTIC_CHECK_PARTS=2\n")
+    log = tmp_path / "restic.log"
+
+    with restored_environ():
+        c = Context(Config(overrides={"run": {"in_stream": False}}))
+        repo = LocalRepository(env)
+        repo.setup()
+
+        repo.check(c, mode="metadata")
+        repo.check(c, mode="rotate")
+        repo.check(c, mode="rotate")
+        assert "rotating check: 2/2 parts read (100%)" in capsys.readouterr().out
+
+        # 3 GiB in parts of at most 1 GiB:
+        prune.record_size(repo.uri, 3 * 1024**3)
+        repo.check(c, mode="rotate", budget="1G")
+        assert log.read_text().splitlines() == [
+            "check",
+            "check --read-data-subset=1/2",
+            "check --read-data-subset=2/2",
+            "check --read-data-subset=1/3",
+        ]
+
+        state = checks.CheckState.load(repo.uri)
+        assert (state.parts, state.done, state.last_run.packs, state.last_run.read_bytes) == (3, [1], 12, 1024**3)
+        assert state.last_complete is not None
+
+        with pytest.raises(ValueError):
+            repo.check(c, mode="quick")
+
+
+@pytest.mark.usefixtures("fake_restic")
+def test_check_state_of_sftp_repository(tmp_path, monkeypatch, capsys):
+    # (a cache dir with spaces: restic connects by itself, so no ssh is needed here)
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path / "my cache"))
+    monkeypatch.chdir(tmp_path)
+    env = tmp_path / ".env"
+    env.write_text(
+        "SFTP_NAME=backups\nSFTP_PASSWORD=secret\nSFTP_HOSTNAME=storagebox\nSFTP_USERNAME=u\nSFTP_PRIVATE_KEY=key\n"
+    )
+    prune.record_size("sftp:storagebox:backups", 3 * 1024**3)
+
+    with restored_environ():
+        c = Context(Config(overrides={"run": {"in_stream": False}}))
+        # the uri of an sftp repository is only known after prepare, state and size must be found by it:
+        SFTPRepository(env).check(c, mode="rotate", budget="1G")
+        SFTPRepository(env).check(c, mode="rotate", budget="1G")
+        assert (tmp_path / "restic.log").read_text().splitlines()[-1] == "check --read-data-subset=2/3"
+        assert checks.CheckState.load("sftp:storagebox:backups").done == [1, 2]
+
+        capsys.readouterr()
+        tasks.check(c, connection="sftp", status=True)
+        assert "rotating check: 2/3 parts read" in capsys.readouterr().out
@@ -0,0 +1,71 @@
+import os
+
+from src.edwh_restic_plugin import env
+
+
+def test_cache_follows_the_file(tmp_path):
+    path = tmp_path / ".env"
+    path.write_text("A=1\n")
+
+    settings = env.read_dotenv(path)
+    assert settings == {"A": "1"}
+    assert env.read_dotenv(path) is settings
+
+    # replaced by another process (new inode), and edited in place:
+    tmp = tmp_path / "other"
+    tmp.write_text("A=2\nB=3\n")
+    os.replace(tmp, path)
+    assert env.read_dotenv(path) is settings
+    assert settings == {"A": "2", "B": "3"}
+
+    with path.open("a") as f:
+        f.write("C=4\n")
+    assert env.read_dotenv(path)["C"] == "4"
+
+
+def test_batched_update_keeps_comments(tmp_path, monkeypatch):
+    path = tmp_path / ".env"
+    path.write_text("# credentials\nLOCAL_NAME=/old  # where\n\nLOCAL_PASSWORD=secret\n")
+    path.chmod(0o640)
+    settings = env.read_dotenv(path)
+
+    answers = iter(["answer", ""])
+    monkeypatch.setattr("builtins.input", lambda _: next(answers))
+    monkeypatch.delenv("FIRST", raising=False)
+    monkeypatch.delenv("SECOND", raising=False)
+
+    with env.batch(path):
+        env.set_env_value(path, "LOCAL_NAME", "/new")
+        assert env.check_env("FIRST", default=None, comment="", path=path) == "answer"
+        assert env.check_env("SECOND", default="default", comment="", path=path) == "default"
+        # already visible, not written yet:
+        assert settings["LOCAL_NAME"] == "/new"
+        assert "FIRST" not in path.read_text()
+
+    assert path.read_text() == (
+        "# credentials\nLOCAL_NAME=/new  # where\n\nLOCAL_PASSWORD=secret\nFIRST=answer\nSECOND=default\n"
+    )
+    assert path.stat().st_mode & 0o777 == 0o640
+    assert [file.name for file in tmp_path.iterdir()] == [".env"]
+    # the written file is the cached version, no reparse needed:
+    assert env.read_dotenv(path) is settings
+    assert env._dotenv_settings[env._key(path)].stamp == env._stamp(path)
+    assert settings["SECOND"] == os.environ["SECOND"] == "default"
+
+
+def test_export_once_per_version(tmp_path, monkeypatch):
+    path = tmp_path / ".env"
+    path.write_text("EXPORTED_SETTING=1\n")
+    monkeypatch.setenv("EXPORTED_SETTING", "0")
+
+    env.export(path)
+    assert os.environ["EXPORTED_SETTING"] == "1"
+
+    # same file: not copied again
+    monkeypatch.setenv("EXPORTED_SETTING", "changed elsewhere")
+    env.export(path)
+    assert os.environ["EXPORTED_SETTING"] == "changed elsewhere"
+
+    env.set_env_value(path, "EXPORTED_SETTING", "2")
+    env.export(path)
+    assert os.environ["EXPORTED_SETTING"] == "2"
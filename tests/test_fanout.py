@@ -0,0 +1,120 @@
+import json
+import os
+import subprocess
+
+from src.edwh_restic_plugin.fanout import FanOut, FanOutTarget, failed_targets, split_producer, strip_repo_args
+
+# records what it was called with, per target (TARGET is set in the target's environment):
+FAKE_RESTIC = """#!/bin/sh
+echo "$@" > "$OUT/$TARGET.args"
+if [ -n "$EARLY" ]; then echo "Fatal: repository is locked"; exit 11; fi
+cat > "$OUT/$TARGET.stdin"
+if [ -n "$FAIL" ]; then echo "Fatal: unable to open repository"; exit 1; fi
+echo "snapshot ${TARGET}0001 saved"
+"""
+
+
+def make_targets(tmp_path, fail: str = "", early: str = "") -> tuple[str, list[FanOutTarget]]:
+    restic = tmp_path / "real-restic"
+    restic.write_text(FAKE_RESTIC)
+    restic.chmod(0o755)
+
+    base = {"PATH": os.environ["PATH"], "OUT": str(tmp_path)}
+    targets = [
+        FanOutTarget(
+            name=name,
+            uri=f"/repos/{name}",
+            env=base | {"TARGET": name, "FAIL": "1" if name == fail else "", "EARLY": "1" if name == early else ""},
+        )
+        for name in ("local", "sftp")
+    ]
+    targets[1].options = ["-o", "sftp.command=/tmp/wrapper"]
+    return str(restic), targets
+
+
+def run_script(fan_out: FanOut, script: str) -> subprocess.CompletedProcess:
+    env = os.environ | fan_out.env() | {"URI": "/ignored", "CAPTAIN_HOOKS_SCRIPT": "backup_stream.sh"}
+    return subprocess.run(["/bin/sh", "-c", script], env=env, capture_output=True, text=True)
+
+
+def test_args():
+    assert strip_repo_args(["-r", "x", "backup", "--repo=y", "--repo", "z", "--tag", "files", "./"]) == [
+        "backup",
+        "--tag",
+        "files",
+        "./",
+    ]
+    # everything after -- is left alone:
+    assert strip_repo_args(["backup", "--", "echo", "-r", "x"]) == ["backup", "--", "echo", "-r", "x"]
+
+    assert split_producer(["backup", "--stdin-from-command", "--", "pg_dump", "db"]) == (
+        ["backup", "--stdin"],
+        ["pg_dump", "db"],
+    )
+    assert split_producer(["backup", "./"]) == (["backup", "./"], None)
+
+
+def test_stdin_is_produced_once_and_sent_to_all(tmp_path):
+    restic, targets = make_targets(tmp_path)
+    with FanOut(targets, restic) as fan_out:
+        ran = run_script(
+            fan_out,
+            f'echo dump >> {tmp_path}/produced; cat {tmp_path}/produced | restic -r "$URI" backup --stdin --tag stream',
+        )
+        assert ran.returncode == 0, ran.stdout + ran.stderr
+        results = fan_out.results()
+
+    assert not fan_out.path.exists()
+    assert (tmp_path / "produced").read_text() == "dump\n"
+    assert (tmp_path / "local.stdin").read_text() == "dump\n"
+    assert (tmp_path / "sftp.stdin").read_text() == "dump\n"
+    local_args = (tmp_path / "local.args").read_text().split()
+    assert local_args == ["-r", "/repos/local", "backup", "--stdin", "--tag", "stream"]
+    assert (tmp_path / "sftp.args").read_text().split()[:4] == ["-r", "/repos/sftp", "-o", "sftp.command=/tmp/wrapper"]
+
+    assert [(r.target, r.snapshot, r.script, r.command) for r in results] == [
+        ("local", "local0001", "backup_stream.sh", "backup"),
+        ("sftp", "sftp0001", "backup_stream.sh", "backup"),
+    ]
+    assert "[sftp] snapshot sftp0001 saved" in ran.stdout
+
+
+def test_failure_per_target(tmp_path):
+    restic, targets = make_targets(tmp_path, fail="sftp")
+    with FanOut(targets, restic) as fan_out:
+        targets_file = json.loads((fan_out.path / "targets.json").read_text())
+        assert [target["name"] for target in targets_file["targets"]] == ["local", "sftp"]
+        assert (fan_out.path / "targets.json").stat().st_mode & 0o777 == 0o600
+
+        ran = run_script(fan_out, "restic backup ./")
+        results = fan_out.results()
+
+    assert ran.returncode == 1
+    per_target = {"local": [results[0]], "sftp": [results[1]]}
+    assert results[0].ok and results[0].snapshot == "local0001"
+    assert not results[1].ok and results[1].snapshot is None
+    assert failed_targets(per_target) == {"sftp"}
+
+
+def test_failing_producer_saves_no_snapshot(tmp_path):
+    restic, targets = make_targets(tmp_path)
+    with FanOut(targets, restic) as fan_out:
+        ran = run_script(fan_out, "restic backup --stdin-from-command -- sh -c 'echo partial; exit 3'")
+        results = fan_out.results()
+
+    assert ran.returncode == 3
+    # restic was killed before stdin was closed, so it never saw a normal end of the data:
+    assert [(r.exited, r.snapshot) for r in results] == [(3, None), (3, None)]
+    assert "snapshot" not in ran.stdout
+
+
+def test_one_dead_target_doesnt_stop_the_others(tmp_path):
+    restic, targets = make_targets(tmp_path, early="sftp")
+    size = 4 * 1024**2
+    with FanOut(targets, restic) as fan_out:
+        ran = run_script(fan_out, f"restic backup --stdin-from-command -- head -c {size} /dev/zero")
+        results = fan_out.results()
+
+    assert ran.returncode == 11
+    assert (tmp_path / "local.stdin").stat().st_size == size
+    assert [(r.target, r.exited, r.snapshot) for r in results] == [("local", 0, "local0001"), ("sftp", 11, None)]
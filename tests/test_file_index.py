@@ -0,0 +1,166 @@
+import json
+import os
+import sys
+
+import pytest
+from invoke import Config, Context
+
+from src.edwh_restic_plugin import restic_binary, tasks
+from src.edwh_restic_plugin.fanout import restored_environ
+from src.edwh_restic_plugin.file_index import FileIndex, minimal_includes, parse_mtime, render_matches, to_glob
+from src.edwh_restic_plugin.repositories.local import LocalRepository
+from src.edwh_restic_plugin.snapshots import parse_snapshots
+
+from .test_snapshots import fake_snapshot
+
+# snapshots.json in the repository directory, `ls` lists <repo>/<short id>.json (a list of paths):
+FAKE_RESTIC = """#!{python}
+import json, os, sys
+from pathlib import Path
+
+args = sys.argv[1:]
+repo = Path(args[args.index("-r") + 1])
+command = next(arg for arg in args if arg in ("cat", "snapshots", "list", "ls"))
+with open(os.environ["RESTIC_LOG"], "a") as log:
+    log.write(" ".join(args[args.index(command) :]) + "\\n")
+
+snapshots = json.loads((repo / "snapshots.json").read_text())
+if command == "cat":
+    print(json.dumps({{"id": "repo-" + repo.name}}))
+elif command == "list":
+    print("\\n".join(s["id"] for s in snapshots))
+elif command == "snapshots":
+    ids = [arg for arg in args[args.index(command) + 1 :] if not arg.startswith("-")]
+    print(json.dumps([s for s in snapshots if not ids or s["id"] in ids]))
+elif command == "ls":
+    snapshot = args[-1]
+    print(json.dumps({{"struct_type": "snapshot", "id": snapshot}}))
+    for path in json.loads((repo / f"{{snapshot[:8]}}.json").read_text()):
+        node = {{"struct_type": "node", "path": path, "name": path.rsplit("/", 1)[-1]}}
+        if path.endswith("/"):
+            node |= {{"type": "dir", "path": path.rstrip("/")}}
+        else:
+            node |= {{"type": "file", "size": len(path), "mtime": "2024-05-01T10:00:00.123456789+02:00"}}
+        print(json.dumps(node))
+"""
+
+
+def nodes(*paths: str) -> list[dict]:
+    return [{"struct_type": "snapshot"}] + [
+        {"struct_type": "node", "path": path, "type": "file", "size": 10, "mtime": "2024-05-01T10:00:00Z"}
+        for path in paths
+    ]
+
+
+def test_index_and_find(tmp_path):
+    first, second = parse_snapshots(json.dumps([fake_snapshot(1, ["files"], 1), fake_snapshot(2, ["files"], 2)]))
+
+    with FileIndex(tmp_path / "files.sqlite") as index:
+        assert index.add("repo", first, nodes("/data/a.sql", "/data/uploads/x.png")) == 2
+        index.add("repo", second, nodes("/data/a.sql", "/data/b.sql"))
+        index.add("other", second, nodes("/data/c.sql"))
+        assert index.indexed_ids("repo") == {first.id, second.id}
+
+        # newest first:
+        assert [(m.short_id, m.path) for m in index.find("repo", "*.sql")] == [
+            ("00000002", "/data/a.sql"),
+            ("00000002", "/data/b.sql"),
+            ("00000001", "/data/a.sql"),
+        ]
+        assert [m.path for m in index.find("repo", "/data/uploads")] == ["/data/uploads/x.png"]
+        # like fnmatch, * also matches /
+        assert [m.path for m in index.find("repo", "/data/*.png")] == ["/data/uploads/x.png"]
+        assert [m.short_id for m in index.find("repo", "a.sql", snapshot_ids=[first.id])] == ["00000001"]
+        assert len(index.find("repo", "/data", limit=2)) == 2
+
+        match = index.find("repo", "b.sql")[0]
+        assert (match.size, match.mtime.isoformat()) == (10, "2024-05-01T10:00:00+00:00")
+        assert "/data/b.sql" in render_matches([match])
+
+        index.remove("repo", [first.id])
+        index.vacuum()
+        assert index.find("repo", "x.png") == []
+        assert len(index.find("other", "*")) == 1
+
+
+def test_helpers():
+    assert to_glob("/data/uploads/") == ["/data/uploads", "/data/uploads/*"]
+    assert to_glob("*.sql") == ["*/*.sql"]
+    assert to_glob("/data/*.sql") == ["/data/*.sql"]
+    assert minimal_includes(["/data/a/1", "/data/a", "/data/ab", "/data/a/2/3"]) == ["/data/a", "/data/ab"]
+    assert parse_mtime("2024-05-01T10:00:00.123456789+02:00") == 1714550400
+    assert parse_mtime("garbage") is None
+
+
+@pytest.fixture
+def fake_restic(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    restic = bin_dir / "restic"
+    restic.write_text(FAKE_RESTIC.format(python=sys.executable))
+    restic.chmod(0o755)
+
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("RESTIC_LOG", str(tmp_path / "restic.log"))
+    restic_binary.forget_restic()
+    yield
+    restic_binary.forget_restic()
+
+
+@pytest.mark.usefixtures("fake_restic")
+def test_incremental_index(tmp_path):
+    repo_dir = tmp_path / "repo"
+    repo_dir.mkdir()
+    snapshots = [fake_snapshot(1, ["files"], 1), fake_snapshot(3, ["message"], 3)]
+    (repo_dir / "snapshots.json").write_text(json.dumps(snapshots))
+    (repo_dir / "00000001.json").write_text(json.dumps(["/data/", "/data/a.sql", "/data/uploads/x.png"]))
+    (repo_dir / "00000002.json").write_text(json.dumps(["/data/", "/data/b.sql"]))
+
+    env = tmp_path / ".env"
+    env.write_text(f"LOCAL_NAME={repo_dir}\nLOCAL_PASSWORD=secret\n")
+    log = tmp_path / "restic.log"
+
+    with restored_environ():
+        c = Context(Config(overrides={"run": {"in_stream": False}}))
+        repo = LocalRepository(env)
+        repo.setup()
+
+        # message snapshots are skipped:
+        assert repo.index_files(c) == (1, 0)
+        assert [m.path for m in repo.find_files(c, "*.sql")] == ["/data/a.sql"]
+
+        snapshots = [snapshots[1], fake_snapshot(2, ["files"], 2)]
+        (repo_dir / "snapshots.json").write_text(json.dumps(snapshots))
+        log.unlink()
+        matches = repo.find_files(c, "*.sql")
+        assert [(m.short_id, m.path) for m in matches] == [("00000002", "/data/b.sql")]
+        # only the new snapshot was listed:
+        assert [line for line in log.read_text().splitlines() if line.startswith("ls")] == [
+            f"ls --json {snapshots[1]['id']}"
+        ]
+
+        assert repo.restore_includes(c, ["/data", "b.sql"]) == ["/data"]
+        assert repo.restore_includes(c, ["nothing"]) == []
+
+
+@pytest.mark.usefixtures("fake_restic")
+def test_find_refreshes_once(tmp_path, monkeypatch, capsys):
+    repo_dir = tmp_path / "repo"
+    repo_dir.mkdir()
+    (repo_dir / "snapshots.json").write_text(json.dumps([fake_snapshot(1, ["files"], 1)]))
+    (repo_dir / "00000001.json").write_text(json.dumps(["/data/", "/data/a.sql"]))
+    (tmp_path / ".env").write_text(f"LOCAL_NAME={repo_dir}\nLOCAL_PASSWORD=secret\n")
+    monkeypatch.chdir(tmp_path)
+
+    with restored_environ():
+        c = Context(Config(overrides={"run": {"in_stream": False}}))
+        tasks.find(c, "*.sql", connection="local", snapshot="00000001", refresh=True)
+        assert "/data/a.sql" in capsys.readouterr().out
+
+    # resolving the snapshot and indexing share one (full) listing:
+    assert [line.split()[0] for line in (tmp_path / "restic.log").read_text().splitlines()] == [
+        "cat",
+        "snapshots",
+        "ls",
+    ]
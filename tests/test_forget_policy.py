@@ -1,11 +1,11 @@
 import tempfile
+import tomllib
 from contextlib import chdir
 from pathlib import Path
 
 import pytest
-from tomlkit.exceptions import ParseError
 
-from src.edwh_restic_plugin.forget import ResticForgetPolicy
+from src.edwh_restic_plugin.forget import PolicyResolver, ResticForgetPolicy
 
 
 def test_from_string():
@@ -223,5 +223,30 @@ def test_invalid_toml_file():
     with tempfile.TemporaryDirectory() as tempdir:
         toml_path = Path(tempdir) / "invalid.toml"
         toml_path.write_text("invalid content")
-        with pytest.raises(ParseError):
+        with pytest.raises(tomllib.TOMLDecodeError):
             ResticForgetPolicy.from_toml_file("s4", str(toml_path))
+
+
+def test_resolver_reads_only(tmp_path):
+    toml_path = tmp_path / ".toml"
+    default_toml_path = tmp_path / "default.toml"
+    toml_path.write_text("[restic.forget.default]\nkeep-last = 1\n\n[restic.forget.swift]\nkeep-last = 2\n")
+    default_toml_path.write_text("[restic.forget.os]\nkeep-last = 3\n\n[restic.forget.b2]\nkeep-daily = 4\n")
+    resolver = PolicyResolver(toml_path, default_toml_path)
+
+    # an alias in .toml wins from its default, .toml wins from default.toml:
+    assert resolver.resolve(["os", "swift"]).keep_last == 2
+    assert resolver.resolve(["s3"]).keep_last == 1
+
+    toml_path.write_text("# only comments\n")
+    before = toml_path.stat().st_mtime_ns
+    assert resolver.resolve(["b2"]).keep_daily == 4
+    assert resolver.resolve(["s3"]) is None
+    # nothing written without asking:
+    assert toml_path.read_text() == "# only comments\n"
+    assert toml_path.stat().st_mtime_ns == before
+
+    assert resolver.resolve(["b2", "backblaze"], copy=True).keep_daily == 4
+    assert "[restic.forget.b2]" in toml_path.read_text()
+    assert "# only comments" in toml_path.read_text()
+    assert ResticForgetPolicy.from_toml_file("b2", toml_path).keep_daily == 4
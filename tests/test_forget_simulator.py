@@ -0,0 +1,122 @@
+import datetime as dt
+import json
+import os
+import shutil
+import subprocess
+import time
+
+import pytest
+
+from src.edwh_restic_plugin.forget import ResticForgetPolicy
+from src.edwh_restic_plugin.forget_simulator import Duration, simulate
+from src.edwh_restic_plugin.snapshots import Snapshot, parse_snapshots
+
+UTC = dt.timezone.utc
+
+
+def snapshot(idx: int, time: dt.datetime, host: str = "web", tags: tuple[str, ...] = ()) -> Snapshot:
+    return Snapshot(id=f"{idx:064x}", short_id=f"{idx:08x}", time=time, hostname=host, paths=["/data"], tags=list(tags))
+
+
+def daily(days: int, start: dt.datetime = dt.datetime(2024, 1, 1, 12, tzinfo=UTC)) -> list[Snapshot]:
+    return [snapshot(idx, start + dt.timedelta(days=idx)) for idx in range(days)]
+
+
+def kept_days(policy: ResticForgetPolicy, snapshots: list[Snapshot]) -> list[str]:
+    return [kept.time.strftime("%m-%d") for kept in simulate(snapshots, policy).keep]
+
+
+def test_counted_buckets():
+    snapshots = daily(60)  # 2024-01-01 .. 2024-02-29
+
+    assert kept_days(ResticForgetPolicy(keep_last=3), snapshots) == ["02-29", "02-28", "02-27"]
+    # the newest snapshot per ISO week (Thursday 02-29 is in week 9, Sundays end a week):
+    assert kept_days(ResticForgetPolicy(keep_weekly=3), snapshots) == ["02-29", "02-25", "02-18"]
+    # counts left at the end: the oldest snapshot is kept too
+    assert kept_days(ResticForgetPolicy(keep_monthly=5), snapshots) == ["02-29", "01-31", "01-01"]
+    assert len(simulate(snapshots, ResticForgetPolicy(keep_daily=-1)).keep) == 60
+
+    result = simulate(snapshots, ResticForgetPolicy(keep_daily=2, keep_monthly=2))
+    assert result.reasons[snapshots[-1].id] == ["daily snapshot", "monthly snapshot"]
+    assert result.reasons[snapshots[30].id] == ["monthly snapshot"]
+    assert len(result.remove) == 57
+
+
+def test_within_tags_and_groups():
+    snapshots = daily(91)  # .. 2024-03-31
+    # 1 month before March 31st is March 2nd (like Go's AddDate), only newer snapshots are kept:
+    assert Duration.parse("1m").before(snapshots[-1].time) == dt.datetime(2024, 3, 2, 12, tzinfo=UTC)
+    assert kept_days(ResticForgetPolicy(keep_within="1m"), snapshots)[-1] == "03-03"
+    # the newest of each week after January 31st:
+    assert kept_days(ResticForgetPolicy(keep_within_weekly="2m"), snapshots)[-2:] == ["02-11", "02-04"]
+    assert str(Duration.parse("1y2d")) == "1y2d"
+    with pytest.raises(ValueError):
+        Duration.parse("2 weeks")
+
+    tagged = [*daily(5), snapshot(99, dt.datetime(2023, 6, 1, tzinfo=UTC), tags=("db", "monthly"))]
+    result = simulate(tagged, ResticForgetPolicy(keep_last=1, keep_tag=["db,monthly", "other"]))
+    assert result.reasons[tagged[-1].id] == ["has tags [db, monthly]"]
+    assert len(result.keep) == 2
+
+    # every host is its own group:
+    other = [snapshot(200 + idx, item.time, host="db") for idx, item in enumerate(daily(5))]
+    result = simulate(daily(5) + other, ResticForgetPolicy(keep_last=2))
+    assert [group.key for group in result.groups] == [("web", ("/data",)), ("db", ("/data",))]
+    assert len(result.keep) == 4
+
+    # like restic: an empty policy removes nothing
+    assert not simulate(daily(5), ResticForgetPolicy()).remove
+
+
+def test_thousands_of_snapshots_quickly():
+    snapshots = [
+        snapshot(idx, dt.datetime(2020, 1, 1, tzinfo=UTC) + dt.timedelta(hours=idx * 3)) for idx in range(10_000)
+    ]
+    policy = ResticForgetPolicy(keep_last=5, keep_hourly=48, keep_daily=14, keep_weekly=8, keep_monthly=24)
+    started = time.perf_counter()
+    result = simulate(snapshots, policy)
+    assert time.perf_counter() - started < 0.5
+    assert len(result.keep) + len(result.remove) == 10_000
+
+
+POLICIES = [
+    "--keep-last 3",
+    "--keep-daily 4 --keep-weekly 3 --keep-monthly 2",
+    "--keep-hourly 5 --keep-yearly 1",
+    "--keep-within 10d --keep-within-monthly 1y",
+    "--keep-last 1 --keep-tag db",
+]
+
+
+@pytest.mark.skipif(not shutil.which("restic"), reason="needs restic")
+def test_matches_restic(tmp_path):
+    env = os.environ | {"RESTIC_REPOSITORY": str(tmp_path / "repo"), "RESTIC_PASSWORD": "test"}
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "file").write_text("content")
+
+    def restic(*args: str) -> str:
+        return subprocess.run(["restic", *args], env=env, capture_output=True, text=True, check=True).stdout
+
+    restic("init")
+    start = dt.datetime(2023, 11, 20, 8)
+    for idx in range(30):
+        moment = start + dt.timedelta(hours=idx * 31)
+        options = ["--time", f"{moment:%Y-%m-%d %H:%M:%S}", "--host", "host-a" if idx % 4 else "host-b"]
+        if idx % 11 == 0:
+            options += ["--tag", "db"]
+        restic("backup", *options, str(data))
+
+    snapshots = parse_snapshots(restic("snapshots", "--json"))
+    for args in POLICIES:
+        expected = json.loads(restic("forget", "--dry-run", "--json", *args.split()))
+        result = simulate(snapshots, ResticForgetPolicy.from_string(args))
+
+        assert {item["id"] for group in expected for item in group["keep"]} == {kept.id for kept in result.keep}, args
+        assert {item["id"] for group in expected for item in group["remove"] or []} == {
+            removed.id for removed in result.remove
+        }, args
+        reasons = {
+            reason["snapshot"]["id"]: reason["matches"] for group in expected for reason in group["reasons"] or []
+        }
+        assert reasons == result.reasons, args
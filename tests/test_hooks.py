@@ -0,0 +1,97 @@
+import time
+from pathlib import Path
+
+import pytest
+from invoke import Context
+
+from src.edwh_restic_plugin.hooks import (
+    TIMEOUT_EXIT_CODE,
+    HookRunner,
+    HookScript,
+    discover,
+    group_scripts,
+    parse_header,
+)
+
+
+def make_script(folder: Path, name: str, body: str, header: str = "") -> Path:
+    script = folder / name
+    script.write_text(f"#!/bin/sh\n{header}\n{body}\n")
+    script.chmod(0o755)
+    return script
+
+
+@pytest.fixture()
+def hooks_folder(tmp_path):
+    folder = tmp_path / "captain-hooks"
+    folder.mkdir()
+    return folder
+
+
+def test_parse_header(hooks_folder):
+    script = make_script(hooks_folder, "backup_stream_pg.sh", "exit 0", "# captain-hooks: group=pg timeout=30")
+    assert parse_header(script) == {"group": "pg", "timeout": "30"}
+
+    plain = make_script(hooks_folder, "backup_files.sh", "exit 0")
+    assert parse_header(plain) == {}
+
+    hook = HookScript.from_path(script, default_timeout=5)
+    assert hook.group == "pg"
+    assert hook.timeout == 30
+
+    hook = HookScript.from_path(plain, default_timeout=5)
+    assert hook.group == str(plain)
+    assert hook.timeout == 5
+
+
+def test_discover_and_group(hooks_folder):
+    make_script(hooks_folder, "backup_stream_b.sh", "exit 0", "# captain-hooks: group=db")
+    make_script(hooks_folder, "backup_files.sh", "exit 0")
+    make_script(hooks_folder, "backup_stream_a.sh", "exit 0", "# captain-hooks: group=db")
+    make_script(hooks_folder, "restore_files.sh", "exit 0")
+
+    files = discover("", "backup", hooks_folder)
+    assert [Path(f).name for f in files] == ["backup_files.sh", "backup_stream_a.sh", "backup_stream_b.sh"]
+
+    groups = group_scripts(HookScript.from_path(f) for f in files)
+    assert [[s.name for s in group] for group in groups] == [
+        ["backup_files.sh"],
+        ["backup_stream_a.sh", "backup_stream_b.sh"],
+    ]
+
+
+def test_parallel_run(hooks_folder):
+    log = hooks_folder / "order.log"
+    scripts = [
+        make_script(hooks_folder, "backup_a.sh", f"sleep 0.5; echo a >> {log}; echo 'snapshot aaaaaaaa saved'"),
+        make_script(hooks_folder, "backup_b.sh", "sleep 0.5; exit 3"),
+        make_script(hooks_folder, "backup_c1.sh", f"sleep 0.2; echo c1 >> {log}", "# captain-hooks: group=c"),
+        make_script(hooks_folder, "backup_c2.sh", f"echo c2 >> {log}", "# captain-hooks: group=c"),
+    ]
+    hooks = [HookScript.from_path(s) for s in scripts]
+
+    started = time.monotonic()
+    results = HookRunner(Context(), workers=4).run(hooks)
+    elapsed = time.monotonic() - started
+
+    # a and b sleep concurrently:
+    assert elapsed < 0.95
+    # results keep the original order:
+    assert [r.script.name for r in results] == ["backup_a.sh", "backup_b.sh", "backup_c1.sh", "backup_c2.sh"]
+    assert [r.exited for r in results] == [0, 3, 0, 0]
+    assert "snapshot aaaaaaaa saved" in results[0].stdout
+
+    # group members ran in order:
+    lines = log.read_text().split()
+    assert lines.index("c1") < lines.index("c2")
+
+
+def test_timeout(hooks_folder):
+    slow = make_script(hooks_folder, "backup_slow.sh", "sleep 5", "# captain-hooks: timeout=0.3")
+    fast = make_script(hooks_folder, "backup_fast.sh", "exit 0")
+
+    results = HookRunner(Context(), workers=2).run([HookScript.from_path(slow), HookScript.from_path(fast)])
+
+    assert results[0].timed_out
+    assert results[0].exited == TIMEOUT_EXIT_CODE
+    assert results[1].ok
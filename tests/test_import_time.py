@@ -0,0 +1,59 @@
+"""
+`edwh` loads every plugin on each CLI call, so importing the tasks module should stay cheap.
+
+The budget can be tuned with EDWH_RESTIC_IMPORT_BUDGET_MS (e.g. on slow CI machines).
+"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = str(Path(__file__).resolve().parent.parent)
+MODULE = "src.edwh_restic_plugin.tasks"
+
+# in milliseconds, for the plugin's own imports (edwh and invoke are loaded by the CLI anyway)
+IMPORT_BUDGET_MS = float(os.environ.get("EDWH_RESTIC_IMPORT_BUDGET_MS", 40))
+
+# only needed by specific tasks, should never be imported at startup:
+LAZY_MODULES = ("tqdm", "restic_reaper", "sqlite3", "tomllib")
+
+
+def run_python(code: str, *args: str, cwd: Path) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args, "-c", f"import sys; sys.path.insert(0, {ROOT!r}); import edwh, invoke; {code}"],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def cumulative_import_us(importtime_output: str, module: str) -> int:
+    for line in importtime_output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.removeprefix("import time:").split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1])
+    raise AssertionError(f"{module} not found in -X importtime output")
+
+
+def test_no_heavy_imports(tmp_path):
+    code = f"import {MODULE}; print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+    ran = run_python(code, cwd=tmp_path)
+
+    assert ran.stdout.strip() == ""
+    # importing should not create files either:
+    assert not (tmp_path / ".env").exists()
+
+
+def test_import_time_budget(tmp_path):
+    # best of a few runs, to filter out noise:
+    timings = []
+    for _ in range(3):
+        ran = run_python(f"import {MODULE}", "-X", "importtime", cwd=tmp_path)
+        timings.append(cumulative_import_us(ran.stderr, MODULE) / 1000)
+
+    assert min(timings) < IMPORT_BUDGET_MS, (
+        f"importing {MODULE} took {min(timings):.1f}ms (budget {IMPORT_BUDGET_MS}ms)"
+    )
@@ -0,0 +1,120 @@
+import datetime as dt
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from src.edwh_restic_plugin.keystone import KeystoneConfig, KeystoneError, TokenCache
+
+
+class FakeKeystone(BaseHTTPRequestHandler):
+    requests: list[dict] = []
+    lifetime = dt.timedelta(hours=1)
+    # replaces the token response when set:
+    payload = None
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.requests.append(body)
+
+        if body["auth"]["identity"]["password"]["user"]["password"] != "secret":
+            self.send_response(401)
+            self.end_headers()
+            return
+
+        expires_at = dt.datetime.now(dt.timezone.utc) + self.lifetime
+        payload = {
+            "token": {
+                "expires_at": expires_at.strftime("%Y-%m-%dT%H:%M:%S.000000Z"),
+                "catalog": [
+                    {"type": "identity", "endpoints": [{"interface": "public", "region": "NL", "url": "x"}]},
+                    {
+                        "type": "object-store",
+                        "endpoints": [
+                            {"interface": "internal", "region": "NL", "url": "http://internal/v1/AUTH_p"},
+                            {"interface": "public", "region": "DE", "url": "http://de/v1/AUTH_p"},
+                            {"interface": "public", "region": "NL", "url": "http://nl/v1/AUTH_p"},
+                        ],
+                    },
+                ],
+            }
+        }
+        data = json.dumps(payload if self.payload is None else self.payload).encode()
+        self.send_response(201)
+        self.send_header("X-Subject-Token", f"token-{len(self.requests)}")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *_):
+        pass
+
+
+@pytest.fixture
+def keystone():
+    FakeKeystone.requests = []
+    FakeKeystone.lifetime = dt.timedelta(hours=1)
+    FakeKeystone.payload = None
+    server = HTTPServer(("127.0.0.1", 0), FakeKeystone)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/v3"
+    server.shutdown()
+
+
+def make_config(auth_url: str, password: str = "secret") -> KeystoneConfig:
+    return KeystoneConfig.from_env(
+        {
+            "OS_AUTH_URL": auth_url,
+            "OS_USERNAME": "backup@example.com",
+            "OS_PASSWORD": password,
+            "OS_PROJECT_ID": "f8d15",
+            "OS_PROJECT_NAME": "backups",
+            "OS_PROJECT_DOMAIN_NAME": "transip",
+            "OS_REGION_NAME": "NL",
+        }
+    )
+
+
+def test_token_is_cached(keystone, tmp_path):
+    config = make_config(keystone)
+    cache = TokenCache(tmp_path)
+
+    token = cache.get(config)
+    assert token.token == "token-1"
+    assert token.storage_url == "http://nl/v1/AUTH_p"
+    assert token.is_valid()
+    assert FakeKeystone.requests[0]["auth"]["scope"] == {"project": {"id": "f8d15"}}
+
+    # second process: read from disk, no new login
+    assert TokenCache(tmp_path).get(config).token == "token-1"
+    assert len(FakeKeystone.requests) == 1
+    assert next(tmp_path.glob("*.json")).stat().st_mode & 0o777 == 0o600
+
+    assert cache.get(config, refresh=True).token == "token-2"
+
+
+def test_expiring_token_is_refreshed(keystone, tmp_path):
+    FakeKeystone.lifetime = dt.timedelta(minutes=5)
+    config = make_config(keystone)
+    cache = TokenCache(tmp_path)
+
+    assert cache.get(config).token == "token-1"
+    # 5 minutes left is below the minimum ttl, so the next call logs in again:
+    assert cache.get(config).token == "token-2"
+    assert len(FakeKeystone.requests) == 2
+
+
+def test_failed_login(keystone, tmp_path):
+    with pytest.raises(KeystoneError):
+        TokenCache(tmp_path).get(make_config(keystone, password="wrong"))
+    assert not list(tmp_path.glob("*.json"))
+
+
+@pytest.mark.parametrize("payload", [{}, [], {"token": {}}, {"token": {"expires_at": "soon"}}, {"token": None}])
+def test_unexpected_response(keystone, tmp_path, payload):
+    FakeKeystone.payload = payload
+    with pytest.raises(KeystoneError):
+        TokenCache(tmp_path).get(make_config(keystone))
@@ -0,0 +1,122 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+from invoke import Config, Context, Result
+from invoke.exceptions import UnexpectedExit
+
+from src.edwh_restic_plugin.hooks import HookRunner, HookScript
+from src.edwh_restic_plugin.metrics import (
+    METRICS_DIR,
+    BackupSummary,
+    Run,
+    TargetRun,
+    parse_stats,
+    parse_summary,
+    read_samples,
+    recording,
+    write,
+)
+
+TEXT_SUMMARY = """
+Files:          12 new,     3 changed,   100 unmodified
+Dirs:            1 new,     2 changed,    10 unmodified
+Added to the repository: 1.500 MiB (1.000 MiB stored)
+
+processed 115 files, 2.000 GiB in 0:12
+snapshot 1a2b3c4d saved
+"""
+
+
+def json_summary(**values: int) -> str:
+    return json.dumps({"message_type": "summary", "snapshot_id": "abc"} | values)
+
+
+def test_parse_summary():
+    output = "\n".join(
+        [
+            json.dumps({"message_type": "status", "percent_done": 0.5}),
+            json_summary(files_new=1, data_added=100, total_bytes_processed=1000),
+            # prefixed by the fan-out shim:
+            "[b2] " + json_summary(files_new=2, files_changed=1, data_added=50),
+        ]
+    )
+    assert parse_summary(output) == BackupSummary(
+        files_new=3, files_changed=1, data_added=150, total_bytes_processed=1000
+    )
+
+    assert parse_summary(TEXT_SUMMARY) == BackupSummary(
+        files_new=12,
+        files_changed=3,
+        files_unmodified=100,
+        data_added=int(1.5 * 1024**2),
+        total_files_processed=115,
+        total_bytes_processed=2 * 1024**3,
+    )
+    assert parse_summary("nothing backed up") is None
+
+    stats = (
+        "Stats in raw-data mode:\n  Snapshots processed:  4\n  Total Uncompressed Size:  3 GiB\n  Total Size:  1 GiB"
+    )
+    assert parse_stats(stats) == {"repository_snapshots": 4, "repository_size_bytes": 1024**3}
+
+
+def test_last_success_survives_failures(tmp_path):
+    path = tmp_path / "collector" / "edwh_restic_app_backup_b2.prom"
+    run = Run("backup", "b2", path=path, duration=12.5, finished=1000.0)
+    run.targets = [TargetRun("backup_files.sh", 0, 10.0, BackupSummary(files_new=5, data_added=2048))]
+    write(run, project="app")
+
+    samples = read_samples(path)
+    labels = 'project="app",repository="b2",task="backup"'
+    target = f'{labels},target="backup_files.sh"'
+    assert samples[f"edwh_restic_last_success_timestamp_seconds{{{labels}}}"] == 1000.0
+    assert samples[f"edwh_restic_backup_added_bytes{{{target}}}"] == 2048
+    assert samples[f"edwh_restic_target_exit_status{{{target}}}"] == 0
+    assert "# TYPE edwh_restic_duration_seconds gauge" in path.read_text()
+
+    failed = Run("backup", "b2", path=path, exited=3, finished=2000.0)
+    failed.targets = [TargetRun("backup_files.sh", 3, 1.0)]
+    write(failed, project="app")
+
+    samples = read_samples(path)
+    assert samples[f"edwh_restic_exit_status{{{labels}}}"] == 3
+    assert samples[f"edwh_restic_last_run_timestamp_seconds{{{labels}}}"] == 2000.0
+    # still the time of the last successful run:
+    assert samples[f"edwh_restic_last_success_timestamp_seconds{{{labels}}}"] == 1000.0
+    assert samples[f"edwh_restic_target_last_success_timestamp_seconds{{{target}}}"] == 1000.0
+    assert f"edwh_restic_backup_added_bytes{{{target}}}" not in samples
+    # only the .prom file, no temporary files left behind:
+    assert [file.name for file in path.parent.iterdir()] == [path.name]
+
+
+def test_recording(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv(METRICS_DIR, raising=False)
+    repo = SimpleNamespace(_short_name="local", env_config={METRICS_DIR: str(tmp_path / "metrics")})
+    prom = tmp_path / "metrics" / f"edwh_restic_{tmp_path.name.lower()}_check_local.prom"
+
+    with pytest.raises(UnexpectedExit), recording(repo, "check"):
+        raise UnexpectedExit(Result(exited=5))
+    assert "edwh_restic_exit_status" in prom.read_text()
+    assert any(line.endswith(" 5") for line in prom.read_text().splitlines() if "exit_status" in line)
+
+    with pytest.raises(SystemExit), recording(repo, "backup") as run:
+        assert run.enabled
+        hooks = tmp_path / "captain-hooks"
+        hooks.mkdir()
+        script = hooks / "backup_files.sh"
+        script.write_text(f"#!/bin/sh\necho '{json_summary(files_new=7)}'\nexit 2\n")
+        script.chmod(0o755)
+
+        c = Context(Config(overrides={"run": {"in_stream": False}}))
+        run.add_hook_results(HookRunner(c).run([HookScript.from_path(script)]))
+        exit(2)
+
+    assert run.exited == 2
+    assert run.targets[0].summary.files_new == 7
+    assert run.targets[0].target == "backup_files.sh"
+
+    # without RESTIC_METRICS_DIR nothing is written:
+    with recording(SimpleNamespace(_short_name="b2", env_config={}), "du") as run:
+        assert not run.enabled
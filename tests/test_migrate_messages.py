@@ -0,0 +1,143 @@
+import json
+import os
+import sys
+
+import pytest
+from invoke import Config, Context
+
+from src.edwh_restic_plugin import restic_binary
+from src.edwh_restic_plugin.fanout import restored_environ
+from src.edwh_restic_plugin.repositories.local import LocalRepository
+from src.edwh_restic_plugin.snapshot_cache import SnapshotCache
+
+from .test_snapshots import fake_snapshot
+
+# snapshots.json in the repository directory, a message snapshot's message in <repo>/<short id>.txt.
+# Tagging rewrites a snapshot (its ID starts with 'e' afterwards), like restic does, and reports it with --json.
+FAKE_RESTIC = """#!{python}
+import json, os, sys
+from pathlib import Path
+
+args = sys.argv[1:]
+repo = Path(args[args.index("-r") + 1])
+command = next(arg for arg in args if arg in ("cat", "snapshots", "list", "dump", "tag", "forget"))
+with open(os.environ["RESTIC_LOG"], "a") as log:
+    log.write(" ".join(args[args.index(command) :]) + "\\n")
+
+snapshots = json.loads((repo / "snapshots.json").read_text())
+rest = args[args.index(command) + 1 :]
+if command == "cat":
+    print(json.dumps({{"id": "repo-" + repo.name}}))
+elif command == "list":
+    print("\\n".join(s["id"] for s in snapshots))
+elif command == "snapshots":
+    ids = [arg for arg in rest if not arg.startswith("-")]
+    print(json.dumps([s for s in snapshots if not ids or s["id"] in ids]))
+elif command == "dump":
+    message = repo / f"{{rest[0][:8]}}.txt"
+    if not message.exists():
+        sys.exit("Fatal: cannot dump file: not found")
+    print(message.read_text())
+elif command == "tag":
+    tag, ids = rest[rest.index("--add") + 1], rest[rest.index("--add") + 2 :]
+    if os.environ.get("FAIL_TAG") in ids:
+        sys.exit("Fatal: unable to tag")
+    for s in snapshots:
+        if any(s["id"].startswith(i) for i in ids):
+            old, s["id"] = s["id"], "e" + s["id"][1:]
+            s["short_id"], s["tags"] = s["id"][:8], s["tags"] + [tag]
+            print(json.dumps({{"message_type": "changed", "old_snapshot_id": old, "new_snapshot_id": s["id"]}}))
+elif command == "forget":
+    snapshots = [s for s in snapshots if s["id"] not in rest]
+(repo / "snapshots.json").write_text(json.dumps(snapshots))
+"""
+
+
+@pytest.fixture
+def fake_restic(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    restic = bin_dir / "restic"
+    restic.write_text(FAKE_RESTIC.format(python=sys.executable))
+    restic.chmod(0o755)
+
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("RESTIC_LOG", str(tmp_path / "restic.log"))
+    monkeypatch.setenv("FAIL_TAG", "00000008")
+    restic_binary.forget_restic()
+    yield
+    restic_binary.forget_restic()
+
+
+@pytest.mark.usefixtures("fake_restic")
+def test_migrate_keeps_what_could_not_be_moved(tmp_path, capsys):
+    repo_dir = tmp_path / "repo"
+    repo_dir.mkdir()
+    snapshots = [
+        fake_snapshot(1, ["files"], 1),
+        fake_snapshot(2, ["stream"], 1),
+        fake_snapshot(3, ["files"], 2),
+        fake_snapshot(8, ["files"], 3),
+        # moved to 1 and 2:
+        fake_snapshot(4, ["message", "00000001", "00000002"], 1),
+        # can't be read:
+        fake_snapshot(5, ["message", "00000003"], 2),
+        # its snapshot is gone:
+        fake_snapshot(6, ["message", "00000042"], 2),
+        # tagging fails:
+        fake_snapshot(9, ["message", "00000008"], 3),
+    ]
+    (repo_dir / "snapshots.json").write_text(json.dumps(snapshots))
+    (repo_dir / "00000004.txt").write_text("nightly\n")
+    (repo_dir / "00000006.txt").write_text("lost\n")
+    (repo_dir / "00000009.txt").write_text("weekly\n")
+    env = tmp_path / ".env"
+    env.write_text(f"LOCAL_NAME={repo_dir}\nLOCAL_PASSWORD=secret\n")
+
+    with restored_environ():
+        c = Context(Config(overrides={"run": {"in_stream": False}}))
+        repo = LocalRepository(env)
+        repo.setup()
+
+        repo.migrate_message_snapshots(c)
+        out = capsys.readouterr().out
+        assert "Keeping 3 message snapshots" in out
+        assert "00000005: its message is empty or could not be read (00000003)" in out
+        assert "00000006: describes no snapshot that is still there" in out
+        assert "00000009: tagging failed (00000008)" in out
+        forget = [line for line in (tmp_path / "restic.log").read_text().splitlines() if line.startswith("forget")]
+        assert forget == [f"forget {snapshots[4]['id']}"]
+
+        listed = {snapshot.short_id: snapshot for snapshot in repo.list_snapshots(c)}
+        assert (listed["e0000001"].message, listed["e0000002"].message) == ("nightly", "nightly")
+        assert {"00000005", "00000006", "00000009", "00000008"} <= set(listed)
+
+        # a dry run assumes tagging works, but still keeps what it can't move:
+        repo.migrate_message_snapshots(c, dry=True)
+        assert "Keeping 2 message snapshots" in capsys.readouterr().out
+
+
+@pytest.mark.usefixtures("fake_restic")
+def test_tag_message_reports_new_ids(tmp_path):
+    repo_dir = tmp_path / "repo"
+    repo_dir.mkdir()
+    snapshots = [fake_snapshot(1, ["files"], 1), fake_snapshot(8, ["files"], 2)]
+    (repo_dir / "snapshots.json").write_text(json.dumps(snapshots))
+    env = tmp_path / ".env"
+    env.write_text(f"LOCAL_NAME={repo_dir}\nLOCAL_PASSWORD=secret\n")
+
+    with restored_environ():
+        c = Context(Config(overrides={"run": {"in_stream": False}}))
+        repo = LocalRepository(env)
+        repo.setup()
+        repo.list_snapshots(c)
+
+        assert repo.tag_message(c, ["00000001"], "nightly") == {"00000001": "e" + snapshots[0]["id"][1:]}
+        assert repo.tag_message(c, ["00000008"], "nightly") is None
+        assert repo.tag_message(c, [], "nightly") == {}
+
+        # the old ID is gone from the cache, the next listing has the new one:
+        with SnapshotCache() as cache:
+            assert snapshots[0]["id"] not in cache.known_ids(cache.get_repo_id(repo.uri))
+        assert [snapshot.short_id for snapshot in repo.list_snapshots(c)] == ["e0000001", "00000008"]
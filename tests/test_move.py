@@ -0,0 +1,113 @@
+import sys
+
+import pytest
+from invoke import Config, Context
+
+from src.edwh_restic_plugin.move import MoveCheckpoint, RcloneMove, parse_rclone_config, rclone_flags, same_provider
+
+# lists two data dirs, logs every command and fails syncing data/01 while $FAIL exists.
+FAKE_RCLONE = """#!{python}
+import os, sys
+
+args = sys.argv[1:]
+with open(os.environ["RCLONE_LOG"], "a") as log:
+    log.write(" ".join(args) + "\\n")
+
+if args[0] == "lsf" and "--dirs-only" in args:
+    print("00/\\n01/")
+elif args[0] == "lsf":
+    print(os.environ.get("TARGET_CONTENT", ""))
+elif args[0] == "sync" and args[1].endswith("data/01") and os.path.exists(os.environ["FAIL"]):
+    sys.exit(1)
+"""
+
+
+class FakeRepository:
+    def __init__(self, config: str, transfers: int, checkers: int, fast_list: bool):
+        self.config = config
+        self.rclone_transfers = transfers
+        self.rclone_checkers = checkers
+        self.rclone_fast_list = fast_list
+
+    def prepare_rclone_config(self):
+        return self.config
+
+
+@pytest.fixture
+def rclone(tmp_path, monkeypatch):
+    script = tmp_path / "rclone"
+    script.write_text(FAKE_RCLONE.format(python=sys.executable))
+    script.chmod(0o755)
+    monkeypatch.setenv("RCLONE_LOG", str(tmp_path / "rclone.log"))
+    monkeypatch.setenv("FAIL", str(tmp_path / "fail"))
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path / "cache"))
+    return str(script)
+
+
+def test_flags():
+    s3 = "type = s3\nprovider = Other\naccess_key_id = a\nendpoint = https://s3.example.com"
+    s3_other_account = "type = s3\nprovider = Other\naccess_key_id = b\nendpoint = https://s3.example.com"
+    sftp = "type = sftp\n    ssh = ssh box"
+
+    assert parse_rclone_config(sftp) == {"type": "sftp", "ssh": "ssh box"}
+    assert same_provider(parse_rclone_config(s3), parse_rclone_config(s3_other_account))
+    assert not same_provider(parse_rclone_config(s3), parse_rclone_config(sftp))
+
+    source = FakeRepository(s3, 32, 64, True)
+    target = FakeRepository(s3_other_account, 32, 64, True)
+    assert rclone_flags(source, target) == [
+        "--transfers",
+        "32",
+        "--checkers",
+        "64",
+        "--fast-list",
+        "--server-side-across-configs",
+    ]
+    assert "--server-side-across-configs" not in rclone_flags(source, target, server_side=False)
+
+    slow = FakeRepository(sftp, 4, 8, False)
+    assert rclone_flags(source, slow) == ["--transfers", "4", "--checkers", "8"]
+    assert rclone_flags(source, slow, transfers=2)[:2] == ["--transfers", "2"]
+
+
+def test_move_resumes(tmp_path, rclone, monkeypatch):
+    c = Context(Config(overrides={"run": {"in_stream": False, "hide": True}}))
+    mover = RcloneMove(c, rclone, "source:bucket", "target:bucket", flags=["--transfers", "4"])
+    log = tmp_path / "rclone.log"
+
+    assert mover.target_is_empty()
+    monkeypatch.setenv("TARGET_CONTENT", "config")
+    assert not mover.target_is_empty()
+    assert mover.parts() == ["data/00", "data/01", "index", "snapshots", "keys", "config"]
+
+    # interrupted halfway:
+    (tmp_path / "fail").touch()
+    checkpoint = MoveCheckpoint.load("a", "b")
+    assert mover.run(checkpoint) == ["data/01"]
+    # config is held back until everything else made it:
+    assert MoveCheckpoint.load("a", "b").done == ["data/00", "index", "snapshots", "keys"]
+
+    # second run only does what's left:
+    (tmp_path / "fail").unlink()
+    log.unlink()
+    checkpoint = MoveCheckpoint.load("a", "b")
+    assert mover.run(checkpoint) == []
+    synced = [line for line in log.read_text().splitlines() if not line.startswith("lsf")]
+    assert synced == [
+        "sync source:bucket/data/01 target:bucket/data/01 --transfers 4",
+        "copyto source:bucket/config target:bucket/config --transfers 4",
+    ]
+    assert not checkpoint.path.exists()
+    assert MoveCheckpoint.load("a", "b").done == []
+
+
+def test_config_moves_last(tmp_path, rclone):
+    c = Context(Config(overrides={"run": {"in_stream": False, "hide": True}}))
+    mover = RcloneMove(c, rclone, "source:bucket", "target:bucket", flags=[])
+    mover.run(MoveCheckpoint.load("c", "d"), dry=True)
+
+    commands = [line for line in (tmp_path / "rclone.log").read_text().splitlines() if not line.startswith("lsf")]
+    assert commands[-1] == "copyto source:bucket/config target:bucket/config --dry-run"
+    assert all("--dry-run" in command for command in commands)
+    # dry runs don't count as progress:
+    assert not MoveCheckpoint.load("c", "d").path.exists()
@@ -0,0 +1,71 @@
+import json
+import time
+
+from src.edwh_restic_plugin.hooks import HookRunner, HookScript
+from src.edwh_restic_plugin.output import OutputHandler, run
+
+
+def message(message_type: str, **values) -> bytes:
+    return json.dumps({"message_type": message_type} | values).encode() + b"\n"
+
+
+def test_keeps_tail_snapshots_and_summaries(tmp_path):
+    log = tmp_path / "logs" / "backup.log"
+    with OutputHandler(tail=3, log=log) as handler:
+        for idx in range(10_000):
+            handler.feed(f"file {idx}\n".encode())
+            handler.feed(message("status", percent_done=idx / 10_000))
+        handler.feed(b"snapshot 1a2b3c4d saved\r\n")
+        # a summary split over two reads:
+        summary = message("summary", snapshot_id="5e6f7a8b", files_new=3)
+        handler.feed(summary[:10])
+        handler.feed(summary[10:] + b"Files:  1 new,  0 changed,  2 unmodified\nno newline at the end")
+
+    assert handler.snapshots == ["1a2b3c4d", "5e6f7a8b"]
+    assert handler.summaries == [json.loads(summary)]
+    assert len(handler.summary_lines) == 2
+    # progress messages are never kept:
+    assert handler.stdout.splitlines() == [
+        f"[... 20001 earlier lines, full output in {log}]",
+        summary.decode().strip(),
+        "Files:  1 new,  0 changed,  2 unmodified",
+        "no newline at the end",
+    ]
+    # the log has everything:
+    assert log.read_bytes().count(b"\n") == 20_003
+    assert handler.bytes == log.stat().st_size
+
+
+def test_progress_bar_on_a_terminal():
+    handler = OutputHandler()
+    handler.feed(b"\x1b[2K[0:01] 10% 1 files\r\x1b[2K[0:02] 100% 2 files\r\n")
+    handler.feed(b"x" * 100_000)
+    handler.close()
+    assert handler.stdout.splitlines() == ["[0:02] 100% 2 files", "x" * 8192]
+
+
+def test_run_kills_everything_on_timeout():
+    handler = OutputHandler()
+    started = time.monotonic()
+    # the background sleep keeps the output open, unless it's killed too:
+    exited, timed_out = run(["sh", "-c", "echo started; sleep 5 & sleep 5"], handler, timeout=0.3, pty=True)
+    assert time.monotonic() - started < 3
+    assert timed_out
+    assert exited == 128 + 9
+    assert handler.stdout == "started\n"
+
+
+def test_script_logs(tmp_path):
+    script = tmp_path / "backup_files.sh"
+    script.write_text("#!/bin/sh\nseq 1 1000\necho 'snapshot 0a1b2c3d saved'\nexit 1\n")
+    script.chmod(0o755)
+
+    (result,) = HookRunner(None, log_dir=tmp_path / "logs").run([HookScript.from_path(script)])
+
+    assert result.exited == 1
+    assert result.snapshots == ["0a1b2c3d"]
+    assert len(result.stdout.splitlines()) == 201
+    assert result.stdout.endswith("1000\nsnapshot 0a1b2c3d saved\n")
+    assert result.log.endswith("-backup_files.sh.log")
+    with open(result.log) as f:
+        assert len(f.read().splitlines()) == 1001
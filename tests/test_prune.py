@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+
+import pytest
+from invoke import Config, Context
+
+from src.edwh_restic_plugin import prune, restic_binary
+from src.edwh_restic_plugin.fanout import restored_environ
+from src.edwh_restic_plugin.forget import ResticForgetPolicy
+from src.edwh_restic_plugin.repositories.local import LocalRepository
+from src.edwh_restic_plugin.repositories.sftp import SFTPRepository
+
+DAY = 86400
+
+# forget removes one snapshot that added 300 bytes, prune prints its statistics:
+FAKE_RESTIC = """#!{python}
+import json, os, sys
+
+args = sys.argv[1:]
+if "forget" in args or "prune" in args:
+    with open(os.environ["RESTIC_LOG"], "a") as log:
+        log.write(" ".join(arg for arg in args if arg in ("forget", "prune") or arg.startswith("--")) + "\\n")
+
+if "forget" in args:
+    print("applying policy")
+    remove = [{{"id": "a" * 64, "summary": {{"data_added": 300}}}}]
+    print(json.dumps([{{"host": "web", "paths": ["/data"], "keep": [{{"id": "b" * 64}}], "remove": remove}}]))
+elif "prune" in args:
+    print("to repack:            0 blobs / 0 B")
+    print("remaining:           20 blobs / 1.000 KiB")
+    print("unused size after prune: 24 B (2.34% of remaining size)")
+"""
+
+
+def test_thresholds():
+    settings = prune.PruneSettings.from_section({"min-unused": "20%", "every-days": 0, "after-forgets": 3})
+    assert (settings.min_unused, settings.every_days, settings.after_forgets) == (0.2, None, 3)
+    assert prune.PruneSettings.from_section({"max-repack-size": "2G"}).to_string() == "--max-repack-size 2G"
+    with pytest.raises(ValueError):
+        prune.PruneSettings.from_section({"keep-last": 3})
+    assert prune.PruneSettings().after_forget
+    assert not prune.PruneSettings.from_section({"after-forget": False}).after_forget
+
+    now = 100 * DAY
+    assert prune.due(prune.PruneSettings(), prune.PruneState(), now) == "never pruned from this machine"
+
+    state = prune.PruneState(last_prune=now - 2 * DAY, forgets=2, total_bytes=1000, unused_bytes=150)
+    assert prune.due(prune.PruneSettings(), state, now).startswith("~15.0% unused")
+    assert prune.due(settings, state, now) is None
+    state.forgets = 3
+    assert prune.due(settings, state, now).startswith("3 forgets")
+    # without a known size, the unused space is unknown:
+    assert prune.due(prune.PruneSettings(), prune.PruneState(last_prune=now - DAY, unused_bytes=10**9), now) is None
+    assert prune.due(prune.PruneSettings(every_days=1), prune.PruneState(last_prune=now - DAY), now)
+
+
+@pytest.fixture
+def fake_restic(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    restic = bin_dir / "restic"
+    restic.write_text(FAKE_RESTIC.format(python=sys.executable))
+    restic.chmod(0o755)
+
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("RESTIC_LOG", str(tmp_path / "restic.log"))
+    monkeypatch.chdir(tmp_path)
+    restic_binary.forget_restic()
+    yield
+    restic_binary.forget_restic()
+
+
+@pytest.mark.usefixtures("fake_restic")
+def test_forget_prunes_when_due(tmp_path, capsys):
+    env = tmp_path / ".env"
+    env.write_text(f"LOCAL_NAME={tmp_path / 'repo'}\nLOCAL_PASSWORD=secret\n")
+    (tmp_path / ".toml").write_text('[restic.prune.local]\nafter-forgets = 2\nmax-unused = "5%"\n')
+    log = tmp_path / "restic.log"
+    policy = ResticForgetPolicy(keep_last=1, prune=True)
+
+    with restored_environ():
+        c = Context(Config(overrides={"run": {"in_stream": False}}))
+        repo = LocalRepository(env)
+        repo.setup()
+
+        # dry: nothing recorded, never a prune
+        repo.forget(c, policy, dry=True)
+        assert log.read_text() == "forget --json --keep-last --dry-run\n"
+        assert "web /data: keep 1, would remove 1" in capsys.readouterr().out
+        assert prune.load_state(repo.uri) == prune.PruneState()
+
+        # nothing known yet: the first prune sets the baseline
+        log.unlink()
+        repo.forget(c, policy)
+        assert log.read_text().splitlines() == ["forget --json --keep-last", "prune --max-unused"]
+        state = prune.load_state(repo.uri)
+        assert (state.forgets, state.total_bytes, state.unused_bytes) == (0, 1024, 24)
+        assert time.time() - state.last_prune < 60
+
+        # this forget frees ~30% of the repository, more than the default min-unused of 10%:
+        log.unlink()
+        repo.forget(c, policy)
+        assert log.read_text().splitlines() == ["forget --json --keep-last", "prune --max-unused"]
+
+        # with min-unused off, only after-forgets counts:
+        (tmp_path / ".toml").write_text("[restic.prune.default]\nmin-unused = 0\nafter-forgets = 2\n")
+        log.unlink()
+        repo.forget(c, policy)
+        assert log.read_text().splitlines() == ["forget --json --keep-last"]
+        assert "prune not needed yet" in capsys.readouterr().out
+        repo.forget(c, policy)
+        assert log.read_text().splitlines()[-1] == "prune"
+        assert prune.load_state(repo.uri).forgets == 0
+
+        assert not repo.prune(c, force=False)
+        assert repo.prune(c, force=True)
+
+
+@pytest.mark.usefixtures("fake_restic")
+def test_forget_prunes_by_default(tmp_path):
+    env = tmp_path / ".env"
+    env.write_text(f"LOCAL_NAME={tmp_path / 'repo'}\nLOCAL_PASSWORD=secret\n")
+    log = tmp_path / "restic.log"
+    policy = ResticForgetPolicy(keep_last=1)
+
+    with restored_environ():
+        c = Context(Config(overrides={"run": {"in_stream": False}}))
+        repo = LocalRepository(env)
+        repo.setup()
+
+        # without `prune` in the policy, a forget still prunes when due:
+        repo.forget(c, policy)
+        assert log.read_text().splitlines() == ["forget --json --keep-last", "prune"]
+
+        # unless the repository leaves it to the prune task (~30% unused is due):
+        (tmp_path / ".toml").write_text("[restic.prune.local]\nafter-forget = false\n")
+        log.unlink()
+        repo.forget(c, policy)
+        assert log.read_text().splitlines() == ["forget --json --keep-last"]
+        repo.forget(c, ResticForgetPolicy(keep_last=1, prune=True))
+        assert log.read_text().splitlines()[-1] == "prune"
+
+
+@pytest.mark.usefixtures("fake_restic")
+def test_prune_state_of_sftp_repository(tmp_path, monkeypatch):
+    # (a cache dir with spaces: restic connects by itself, so no ssh is needed here)
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path / "my cache"))
+    env = tmp_path / ".env"
+    env.write_text("SFTP_NAME=backups\nSFTP_PASSWORD=secret\nSFTP_HOSTNAME=storagebox\n")
+    log = tmp_path / "restic.log"
+
+    with restored_environ():
+        c = Context(Config(overrides={"run": {"in_stream": False}}))
+        # the uri of an sftp repository is only known after prepare, the state must be found by it:
+        repo = SFTPRepository(env)
+        assert repo.prune(c, force=False)
+        assert prune.load_state("sftp:storagebox:backups").total_bytes == 1024
+        assert not SFTPRepository(env).prune(c, force=False)
+        assert log.read_text().splitlines() == ["prune"]
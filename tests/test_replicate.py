@@ -0,0 +1,159 @@
+import datetime as dt
+import json
+import os
+import sys
+
+import pytest
+from invoke import Config, Context
+from invoke.exceptions import UnexpectedExit
+
+from src.edwh_restic_plugin import restic_binary
+from src.edwh_restic_plugin.fanout import FanOutTarget, restored_environ
+from src.edwh_restic_plugin.replicate import Replicator, copy_command, copy_env, parse_since, select_snapshots
+from src.edwh_restic_plugin.repositories.local import LocalRepository
+from src.edwh_restic_plugin.snapshots import parse_snapshots
+
+from .test_snapshots import fake_snapshot
+
+# a tiny restic: a repository is a directory with snapshots.json, `copy` appends to the target's snapshots.json.
+FAKE_RESTIC = """#!{python}
+import hashlib, json, os, sys
+from pathlib import Path
+
+args = sys.argv[1:]
+repo = Path(args[args.index("-r") + 1])
+command = next(arg for arg in args if arg in ("cat", "snapshots", "list", "copy", "init"))
+rest = args[args.index(command) + 1 :]
+
+def load(path):
+    file, copied = path / "snapshots.json", path / "copied.jsonl"
+    snapshots = json.loads(file.read_text()) if file.exists() else []
+    return snapshots + ([json.loads(line) for line in copied.read_text().splitlines()] if copied.exists() else [])
+
+with open(os.environ["RESTIC_LOG"], "a") as log:
+    log.write(" ".join([command, *rest]) + "\\n")
+
+if command == "cat":
+    if not repo.exists():
+        sys.exit("Fatal: repository does not exist")
+    print(json.dumps({{"id": hashlib.sha256(str(repo).encode()).hexdigest()}}))
+elif command == "list":
+    print("\\n".join(s["id"] for s in load(repo)))
+elif command == "snapshots":
+    ids = [arg for arg in rest if not arg.startswith("-")]
+    print(json.dumps([s for s in load(repo) if not ids or s["id"] in ids]))
+elif command == "init":
+    repo.mkdir()
+elif command == "copy":
+    source = Path(rest[rest.index("--from-repo") + 1])
+    assert os.environ["RESTIC_FROM_PASSWORD"] == "source-password"
+    assert os.environ["RESTIC_PASSWORD"] == "target-password"
+    ids = set(rest[rest.index("--from-repo") + 2 :])
+    # appends are atomic, so concurrent batches don't lose each other's snapshots:
+    with open(repo / "copied.jsonl", "a") as f:
+        f.write("".join(json.dumps(s) + "\\n" for s in load(source) if s["id"] in ids))
+    print(f"copied {{len(ids)}} snapshots")
+"""
+
+
+@pytest.fixture
+def fake_restic(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    restic = bin_dir / "restic"
+    restic.write_text(FAKE_RESTIC.format(python=sys.executable))
+    restic.chmod(0o755)
+
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setenv("RESTIC_LOG", str(tmp_path / "restic.log"))
+    restic_binary.forget_restic()
+    yield str(restic)
+    restic_binary.forget_restic()
+
+
+def make_local(tmp_path, name: str, password: str) -> LocalRepository:
+    env = tmp_path / f"{name}.env"
+    env.write_text(f"LOCAL_NAME={tmp_path / name}\nLOCAL_PASSWORD={password}\n")
+    repo = LocalRepository(env)
+    repo.setup()
+    return repo
+
+
+def test_filters():
+    snapshots = parse_snapshots(
+        json.dumps(
+            [
+                fake_snapshot(1, ["files"], minute=1),
+                fake_snapshot(2, ["stream"], minute=2),
+                fake_snapshot(3, ["files"], minute=3),
+            ]
+        )
+    )
+    since = dt.datetime.fromisoformat("2024-05-01T10:02:00+02:00")
+    selected = select_snapshots(snapshots, tags=["files"], since=since)
+    assert [s.short_id for s in selected] == ["00000003"]
+    assert select_snapshots(snapshots) == snapshots
+
+    now = dt.datetime(2024, 5, 8, tzinfo=dt.timezone.utc)
+    assert parse_since("7d", now=now) == dt.datetime(2024, 5, 1, tzinfo=dt.timezone.utc)
+    assert parse_since("2024-05-01T00:00+00:00") == dt.datetime(2024, 5, 1, tzinfo=dt.timezone.utc)
+    with pytest.raises(ValueError):
+        parse_since("last week")
+
+
+def test_copy_command_and_env():
+    source = FanOutTarget("sftp", "sftp:box:/repo", ["-o", "sftp.command=x"], {"RESTIC_PASSWORD": "a", "X": "1"})
+    target = FanOutTarget("local", "/backups", [], {"RESTIC_PASSWORD": "b", "Y": "2"})
+
+    assert copy_command("restic", source, target, ["abc"]) == [
+        "restic",
+        "-r",
+        "/backups",
+        "-o",
+        "sftp.command=x",
+        "copy",
+        "--from-repo",
+        "sftp:box:/repo",
+        "abc",
+    ]
+    env = copy_env(source, target)
+    assert env["RESTIC_PASSWORD"] == "b"
+    assert env["RESTIC_FROM_PASSWORD"] == "a"
+    assert (env["X"], env["Y"]) == ("1", "2")
+
+
+def test_replicate_local_to_local(tmp_path, fake_restic):
+    source_dir = tmp_path / "source"
+    source_dir.mkdir()
+    snapshots = [fake_snapshot(idx, ["files"], minute=idx) for idx in range(1, 6)]
+    (source_dir / "snapshots.json").write_text(json.dumps(snapshots))
+
+    with restored_environ():
+        # pytest captures stdin:
+        c = Context(Config(overrides={"run": {"in_stream": False}}))
+        source = make_local(tmp_path, "source", "source-password")
+        target = make_local(tmp_path, "target", "target-password")
+
+        replicator = Replicator(c, source, target, restic=fake_restic)
+        with pytest.raises(UnexpectedExit):
+            # target doesn't exist yet
+            replicator.run()
+
+        result = replicator.run(batch_size=2, parallel=2, init=True)
+        assert sorted(result.copied) == sorted(s["id"] for s in snapshots)
+        assert not result.failed
+
+        # one new snapshot in the source: only that one is copied
+        snapshots.append(fake_snapshot(6, ["files"], minute=6))
+        (source_dir / "snapshots.json").write_text(json.dumps(snapshots))
+        result = replicator.run(batch_size=2)
+        assert result.copied == [snapshots[-1]["id"]]
+        assert result.skipped == 5
+
+    copied = (tmp_path / "target" / "copied.jsonl").read_text().splitlines()
+    assert len(copied) == 6
+
+    log = (tmp_path / "restic.log").read_text().splitlines()
+    assert sum(line.startswith("copy") for line in log) == 4
+    assert any(line.startswith("init --from-repo") and "--copy-chunker-params" in line for line in log)
@@ -66,3 +66,59 @@ def test_detection(clear_prio):
     assert len(regs) > 3
 
     assert next(iter(regs.keys())) == "hetzner"
+
+
+@pytest.mark.usefixtures("clear_prio")
+def test_manifest_matches_registrations():
+    from src.edwh_restic_plugin.repositories.manifest import MANIFEST, build_manifest
+
+    assert list(MANIFEST) == build_manifest(), "Manifest is outdated, regenerate it (see manifest.py)"
+
+
+@pytest.mark.usefixtures("clear_prio")
+def test_names_without_imports():
+    assert registrations.names()[:2] == ["hetzner", "os"]
+    assert registrations.get("openstack") is registrations.get("os")
+    assert registrations.get("nonexistent") is None
+
+
+SNAPSHOTS_SCRIPT = """
+import sys
+sys.path.insert(0, {root!r})
+
+from invoke import Context
+
+from src.edwh_restic_plugin import tasks
+from src.edwh_restic_plugin.repositories import Repository
+
+# no restic available/needed here:
+Repository._require_restic = lambda self: None
+Repository.snapshot = lambda self, c, **kw: None
+
+tasks.snapshots(Context())
+
+backends = sorted(
+    name.rsplit(".", 1)[-1]
+    for name in sys.modules
+    if name.startswith("src.edwh_restic_plugin.repositories.") and not name.endswith(".manifest")
+)
+print(",".join(backends))
+"""
+
+
+def test_snapshots_imports_one_backend(tmp_path):
+    import subprocess
+    import sys
+    from pathlib import Path
+
+    root = str(Path(__file__).resolve().parent.parent)
+    (tmp_path / ".env").write_text("LOCAL_NAME=/tmp/repo\nLOCAL_PASSWORD=secret\n")
+
+    ran = subprocess.run(
+        [sys.executable, "-c", SNAPSHOTS_SCRIPT.format(root=root)],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert ran.stdout.strip().splitlines()[-1] == "local"
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from src.edwh_restic_plugin import restic_binary
+from src.edwh_restic_plugin.restic_binary import ResticCapabilities
+
+FAKE_RESTIC = """#!/bin/sh
+echo probed >> "{log}"
+echo "restic {version} compiled with go1.22.5 on linux/amd64"
+"""
+
+
+@pytest.fixture
+def fake_restic(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    log = tmp_path / "calls.log"
+    restic = bin_dir / "restic"
+    installed = []
+
+    def install(version: str):
+        restic.write_text(FAKE_RESTIC.format(log=log, version=version))
+        restic.chmod(0o755)
+        # both versions have the same size, so give each install its own mtime (also with a coarse resolution):
+        installed.append(version)
+        os.utime(restic, (1_700_000_000 + len(installed),) * 2)
+        restic_binary.forget_restic()
+
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path / "cache"))
+    install("0.16.4")
+    yield install, log
+    restic_binary.forget_restic()
+
+
+def test_probe_once_per_binary(fake_restic):
+    install, log = fake_restic
+
+    caps = restic_binary.capabilities()
+    assert caps.version == (0, 16, 4)
+    assert caps.path == restic_binary.find_restic()
+
+    # new process (= cleared in-memory cache), same binary: answered from disk
+    restic_binary.forget_restic()
+    assert restic_binary.capabilities().version == (0, 16, 4)
+    assert log.read_text().splitlines() == ["probed"]
+
+    # binary changed (e.g. self-update): probed again
+    install("0.17.3")
+    assert restic_binary.capabilities().version == (0, 17, 3)
+    assert len(log.read_text().splitlines()) == 2
+
+
+def test_capability_flags():
+    old = ResticCapabilities.from_version_output("restic", "restic 0.13.1 compiled with go1.18")
+    assert not old.repository_version_2
+    assert old.backup_args(read_concurrency=8) == []
+
+    new = ResticCapabilities.from_version_output("restic", "restic 0.17.0 compiled with go1.22")
+    assert new.stdin_from_command
+    assert new.backup_args() == ["--no-scan"]
+    assert new.backup_args(read_concurrency=8) == ["--no-scan", "--read-concurrency", "8"]
+
+    unknown = ResticCapabilities.from_version_output("restic", "")
+    assert unknown.version == (0, 0, 0)
+    assert not unknown.no_scan
@@ -0,0 +1,61 @@
+import os
+import time
+
+import pytest
+
+from src.edwh_restic_plugin import restic_cache
+
+
+def make_cache(root, repo_id: str, size: int, age_days: float):
+    path = root / repo_id
+    for kind in restic_cache.CACHE_KINDS:
+        (path / kind).mkdir(parents=True)
+    (path / "version").write_text("1")
+    (path / "data" / "pack").write_bytes(b"x" * size)
+
+    mtime = time.time() - age_days * 86400
+    for file in (path / "version", path / "data" / "pack", path):
+        os.utime(file, (mtime, mtime))
+
+
+def test_parse_size():
+    assert restic_cache.parse_size("500") == 500
+    assert restic_cache.parse_size("1K") == 1024
+    assert restic_cache.parse_size("1.5GiB") == int(1.5 * 1024**3)
+    assert restic_cache.parse_size("") is None
+    with pytest.raises(ValueError):
+        restic_cache.parse_size("lots")
+
+
+def test_scan_and_evict(tmp_path):
+    make_cache(tmp_path, "old", 100, age_days=40)
+    make_cache(tmp_path, "middle", 300, age_days=5)
+    make_cache(tmp_path, "new", 200, age_days=1)
+    (tmp_path / "not-a-cache").mkdir()
+
+    entries = restic_cache.scan(tmp_path)
+    assert [entry.repo_id for entry in entries] == ["old", "middle", "new"]
+    assert entries[1].size == 300
+    assert entries[1].files == {"index": 0, "snapshots": 0, "data": 1}
+
+    by_age = restic_cache.select_evictions(entries, max_age_days=30)
+    assert [entry.repo_id for entry in by_age] == ["old"]
+
+    by_size = restic_cache.select_evictions(entries, max_size=250)
+    assert [entry.repo_id for entry in by_size] == ["old", "middle"]
+
+    keep_middle = restic_cache.select_evictions(entries, max_size=250, keep={"middle"})
+    assert [entry.repo_id for entry in keep_middle] == ["old", "new"]
+
+    restic_cache.evict(by_age)
+    assert [entry.repo_id for entry in restic_cache.scan(tmp_path)] == ["middle", "new"]
+
+
+def test_default_root_is_restics_own(tmp_path, monkeypatch):
+    monkeypatch.setattr("sys.platform", "linux")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "xdg"))
+    # not under the plugin's own cache dir, so caches restic built before stay warm:
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path / "plugin"))
+
+    assert restic_cache.cache_root({}) == tmp_path / "xdg" / "restic"
+    assert restic_cache.cache_root({"RESTIC_CACHE_ROOT": str(tmp_path / "shared")}) == tmp_path / "shared"
@@ -0,0 +1,63 @@
+import json
+import re
+
+import pytest
+from invoke import Config, Context, MockContext, Result
+
+from src.edwh_restic_plugin.restore import Phases, teardown, verify, volumes_of
+
+ANY = re.compile(".*")
+
+
+def container(*volumes: str) -> dict:
+    mounts = [{"Type": "volume", "Name": volume} for volume in volumes]
+    return {"Mounts": [*mounts, {"Type": "bind", "Name": "", "Source": "/etc/hosts"}]}
+
+
+def test_volumes_are_removed_in_one_call():
+    inspected = [container("app_pg0", "app_shared"), container("app_pg1", "app_shared")]
+    assert volumes_of(inspected) == ["app_pg0", "app_shared", "app_pg1"]
+
+    c = MockContext(run={"docker inspect pg-0 pg-1": Result(json.dumps(inspected)), ANY: Result()}, repeat=True)
+    assert teardown(c) == ["app_pg0", "app_shared", "app_pg1"]
+
+    commands = [call.args[0] for call in c.run.call_args_list]
+    assert [command for command in commands if command.startswith("docker volume")] == [
+        "docker volume rm app_pg0 app_shared app_pg1"
+    ]
+    assert commands[-2].endswith("rm -f pg-0 pg-1")
+
+
+def test_nothing_to_remove():
+    c = MockContext(run={"docker inspect pg-0 pg-1": Result(exited=1), ANY: Result()}, repeat=True)
+    assert teardown(c) == []
+    assert not any("volume" in call.args[0] for call in c.run.call_args_list)
+
+
+def test_phases(capsys):
+    phases = Phases()
+    with phases.phase("prepare"):
+        pass
+    with pytest.raises(SystemExit), phases.phase("restore"):
+        exit(1)
+
+    assert list(phases.durations) == ["prepare", "restore"]
+    assert phases.failed == "restore"
+    phases.report()
+    assert "restore" in capsys.readouterr().err
+
+
+def test_verify(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    c = Context(Config(overrides={"run": {"in_stream": False}}))
+    # no verify scripts is fine:
+    assert verify(c, "stream", verbose=False)
+
+    hooks = tmp_path / "captain-hooks"
+    hooks.mkdir()
+    for name, code in (("verify_stream_pg.sh", 0), ("verify_files.sh", 1)):
+        (hooks / name).write_text(f"#!/bin/sh\nexit {code}\n")
+        (hooks / name).chmod(0o755)
+
+    assert verify(c, "stream", verbose=False, parallel=2)
+    assert not verify(c, "", verbose=False, parallel=2)
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+from invoke import Config, Context
+
+from src.edwh_restic_plugin.fanout import restored_environ
+from src.edwh_restic_plugin.repositories.local import LocalRepository
+from src.edwh_restic_plugin.snapshot_cache import FETCH_BATCH_SIZE, SnapshotCache
+from src.edwh_restic_plugin.snapshots import filter_snapshots, parse_snapshots
+
+from .test_file_index import fake_restic  # noqa: F401
+from .test_snapshots import fake_snapshot
+
+
+def test_incremental_sync(tmp_path):
+    remote = parse_snapshots(json.dumps([fake_snapshot(idx, ["files"], minute=idx) for idx in range(5)]))
+    fetched: list[list[str]] = []
+
+    def fetch(ids: list[str]):
+        fetched.append(ids)
+        return [snapshot for snapshot in remote if snapshot.id in ids]
+
+    with SnapshotCache(tmp_path / "cache.sqlite") as cache:
+        cache.set_repo_id("local:/repo", "repo-1")
+        assert cache.get_repo_id("local:/repo") == "repo-1"
+
+        assert cache.sync("repo-1", [s.id for s in remote], fetch) == (5, 0)
+        assert [s.id for s in cache.load("repo-1")] == [s.id for s in remote]
+
+        # nothing changed: nothing is fetched
+        fetched.clear()
+        assert cache.sync("repo-1", [s.id for s in remote], fetch) == (0, 0)
+        assert fetched == []
+
+        # one forgotten, one new:
+        remote = remote[1:] + parse_snapshots(json.dumps([fake_snapshot(9, ["stream"], minute=30)]))
+        assert cache.sync("repo-1", [s.id for s in remote], fetch) == (1, 1)
+        assert fetched == [[remote[-1].id]]
+
+        loaded = cache.load("repo-1")
+        assert [s.short_id for s in loaded] == ["00000001", "00000002", "00000003", "00000004", "00000009"]
+        assert loaded[-1].tags == ["stream"]
+
+        cache.forget_repository("local:/repo")
+        assert cache.get_repo_id("local:/repo") is None
+        assert cache.load("repo-1") == []
+
+
+def test_filter_snapshots():
+    data = [fake_snapshot(idx, ["files"], minute=idx) for idx in range(4)]
+    data += [fake_snapshot(10, ["stream", "db"], minute=10), fake_snapshot(11, ["message"], minute=11)]
+    data[0]["hostname"] = "other"
+    snapshots = parse_snapshots(json.dumps(data))
+
+    assert len(filter_snapshots(snapshots, tags=["files"])) == 4
+    assert len(filter_snapshots(snapshots, tags=["files", "message"])) == 5
+    assert [s.short_id for s in filter_snapshots(snapshots, tags=["stream,db"])] == ["0000000a"]
+    assert filter_snapshots(snapshots, tags=["stream,files"]) == []
+    assert len(filter_snapshots(snapshots, host="server")) == 5
+
+    # latest per (host, paths):
+    latest = filter_snapshots(snapshots, tags=["files"], latest=1)
+    assert [s.short_id for s in latest] == ["00000000", "00000003"]
+
+
+@pytest.mark.usefixtures("fake_restic")
+def test_cold_cache_stores_each_snapshot_once(tmp_path, monkeypatch):
+    repo_dir = tmp_path / "repo"
+    repo_dir.mkdir()
+    count = FETCH_BATCH_SIZE * 2 + 50
+    snapshots = [fake_snapshot(idx, ["files"], minute=idx % 60) for idx in range(count)]
+    (repo_dir / "snapshots.json").write_text(json.dumps(snapshots))
+    env = tmp_path / ".env"
+    env.write_text(f"LOCAL_NAME={repo_dir}\nLOCAL_PASSWORD=secret\n")
+
+    stored: list[int] = []
+    store = SnapshotCache.store
+    monkeypatch.setattr(
+        SnapshotCache, "store", lambda self, repo_id, items: stored.append(len(items)) or store(self, repo_id, items)
+    )
+
+    with restored_environ():
+        c = Context(Config(overrides={"run": {"in_stream": False}}))
+        repo = LocalRepository(env)
+        repo.setup()
+
+        assert len(repo.list_snapshots(c)) == count
+        # one full listing, not the whole list again per fetch batch:
+        assert sum(stored) == count
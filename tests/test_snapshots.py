@@ -0,0 +1,98 @@
+import json
+import time
+
+from src.edwh_restic_plugin.snapshots import (
+    decode_message_tag,
+    encode_message_tag,
+    link_messages,
+    parse_snapshots,
+    render_table,
+)
+
+
+def fake_snapshot(idx: int, tags: list[str], minute: int = 0) -> dict:
+    snapshot_id = f"{idx:08x}" + "0" * 56
+    return {
+        "time": f"2024-05-01T10:{minute:02d}:00.123456789+02:00",
+        "tree": "f" * 64,
+        "paths": ["/data"],
+        "hostname": "server",
+        "username": "root",
+        "tags": tags,
+        "id": snapshot_id,
+        "short_id": snapshot_id[:8],
+    }
+
+
+def test_parse_and_link():
+    data = [
+        fake_snapshot(1, ["files"], minute=1),
+        fake_snapshot(2, ["stream"], minute=2),
+        fake_snapshot(3, ["message", "00000001", "00000002"], minute=3),
+        fake_snapshot(4, None, minute=4),
+    ]
+    snapshots = parse_snapshots(json.dumps(data))
+
+    assert [s.short_id for s in snapshots] == ["00000001", "00000002", "00000003", "00000004"]
+    assert snapshots[3].tags == []
+    assert snapshots[2].is_message
+
+    linked = link_messages(snapshots)
+    assert set(linked) == {"00000001", "00000002"}
+    assert linked["00000001"].short_id == "00000003"
+
+    table = render_table(snapshots, {"00000001": "nightly"})
+    lines = table.splitlines()
+    assert lines[0].split() == ["ID", "Time", "Host", "Tags"]
+    assert lines[2].startswith("00000001  2024-05-01 10:01:00  server  files")
+    assert lines[2].endswith(" : [nightly]")
+    # message snapshot itself is not shown:
+    assert "00000003" not in table
+    assert lines[-1] == "3 snapshots"
+
+
+def test_parse_empty():
+    assert parse_snapshots("") == []
+    assert parse_snapshots("null") == []
+    assert render_table([]).splitlines()[-1] == "0 snapshots"
+
+
+def test_many_snapshots_scale_linearly():
+    data = []
+    for idx in range(0, 6000, 3):
+        data.append(fake_snapshot(idx, ["files"], minute=idx % 60))
+        data.append(fake_snapshot(idx + 1, ["stream"], minute=idx % 60))
+        data.append(fake_snapshot(idx + 2, ["message", f"{idx:08x}", f"{idx + 1:08x}"], minute=idx % 60))
+
+    started = time.monotonic()
+    snapshots = parse_snapshots(json.dumps(data))
+    linked = link_messages(snapshots)
+    render_table(snapshots, {key: "msg" for key in linked})
+
+    assert len(linked) == 4000
+    assert time.monotonic() - started < 2
+
+
+def test_message_tags():
+    message = "nightly, 50% done; 'quoted' & ünïcode"
+    tag = encode_message_tag(message)
+    assert tag.startswith("msg=")
+    assert "," not in tag
+    assert decode_message_tag(tag) == message
+    assert decode_message_tag("files") is None
+
+    snapshots = parse_snapshots(
+        json.dumps(
+            [
+                fake_snapshot(1, ["files", tag], minute=1),
+                fake_snapshot(2, ["stream"], minute=2),
+            ]
+        )
+    )
+    assert snapshots[0].message == message
+    assert snapshots[0].display_tags == ["files"]
+    assert snapshots[1].message is None
+
+    lines = render_table(snapshots, {"00000002": "legacy"}).splitlines()
+    assert lines[2].endswith(f"files : [{message}]")
+    assert lines[3].endswith("stream : [legacy]")
@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+from src.edwh_restic_plugin import restic_binary
+from src.edwh_restic_plugin.fanout import restored_environ
+from src.edwh_restic_plugin.repositories.sftp import SFTPRepository
+from src.edwh_restic_plugin.ssh_master import SSHMaster
+
+# pretends to be ssh: `-O check` succeeds once a 'master' was started.
+FAKE_SSH = """#!/bin/sh
+echo "$@" >> "{log}"
+case " $* " in
+  *" -O check "*) test -e "{master}" ;;
+  *) touch "{master}" ;;
+esac
+"""
+
+
+def test_options_from_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path))
+    master = SSHMaster.from_env(
+        "storagebox",
+        {"SFTP_SSH_PERSIST": "60", "SFTP_SSH_CIPHER": "aes128-gcm@openssh.com", "SFTP_SSH_COMPRESSION": "yes"},
+    )
+
+    options = master.options()
+    assert "ControlMaster=auto" in options
+    assert f"ControlPath={tmp_path / 'ssh' / '%C'}" in options
+    assert "ControlPersist=60" in options
+    assert options[options.index("-c") + 1] == "aes128-gcm@openssh.com"
+    assert "Compression=yes" in options
+    assert (tmp_path / "ssh").stat().st_mode & 0o777 == 0o700
+
+    defaults = SSHMaster.from_env("storagebox", {})
+    assert defaults.persist == 600
+    assert "-c" not in defaults.options()
+    assert "Compression=yes" not in defaults.options()
+
+
+def test_sftp_wrapper(tmp_path, monkeypatch):
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path))
+    master = SSHMaster("user@backup.example.com")
+
+    option = master.restic_option()
+    wrapper = tmp_path / "ssh" / "sftp-user_backup.example.com"
+    assert option == f"-o sftp.command={wrapper}"
+    assert " " not in option.removeprefix("-o ")
+    assert os.access(wrapper, os.X_OK)
+
+    content = wrapper.read_text()
+    assert content.startswith("#!/bin/sh\nexec ssh ")
+    assert content.rstrip().endswith("user@backup.example.com -s sftp")
+    assert "ControlMaster=auto" in content
+
+
+def test_start_reuses_master(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    log = tmp_path / "ssh.log"
+    ssh = bin_dir / "ssh"
+    ssh.write_text(FAKE_SSH.format(log=log, master=tmp_path / "master"))
+    ssh.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path / "cache"))
+
+    master = SSHMaster("storagebox")
+    assert master.start() == (True, "")
+    assert master.start() == (True, "")
+
+    calls = log.read_text().splitlines()
+    # check, connect (= start master), check (alive, so no second connection):
+    assert len(calls) == 3
+    assert calls[1].endswith("storagebox exit")
+
+
+def test_cache_dir_with_spaces(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "restic").write_text("#!/bin/sh\n")
+    (bin_dir / "restic").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("EDWH_RESTIC_CACHE_DIR", str(tmp_path / "my cache"))
+    restic_binary.forget_restic()
+    with pytest.raises(ValueError, match="EDWH_RESTIC_CACHE_DIR"):
+        SSHMaster("storagebox").restic_option()
+
+    # the sftp backend then lets restic connect by itself:
+    env = tmp_path / ".env"
+    env.write_text("SFTP_NAME=backups\nSFTP_PASSWORD=secret\nSFTP_HOSTNAME=storagebox\n")
+    with restored_environ():
+        repo = SFTPRepository(env)
+        repo.prepare_for_restic(None)
+        assert repo.restic_options == ""
+        assert repo.uri == "sftp:storagebox:backups"
+    restic_binary.forget_restic()
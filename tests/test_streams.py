@@ -0,0 +1,181 @@
+import dataclasses
+import os
+import sys
+
+import pytest
+from invoke import Config, Context
+
+from src.edwh_restic_plugin.hooks import HookRunner, HookScript
+from src.edwh_restic_plugin.streams import StreamTarget, load_streams, parse_output, run_restore, run_stream
+
+# stores what it backs up in $OUT/<filename> and reports like `restic backup --json`, dumps it back from there.
+FAKE_RESTIC = """#!{python}
+import json, os, subprocess, sys
+
+args = sys.argv[1:]
+if "dump" in args:
+    with open(os.path.join(os.environ["OUT"], "dump.log"), "a") as log:
+        log.write(" ".join(args[args.index("dump") :]) + "\\n")
+    path = os.path.join(os.environ["OUT"], args[-1].lstrip("/"))
+    if not os.path.exists(path):
+        print("Fatal: no matching snapshot found", file=sys.stderr)
+        sys.exit(1)
+    with open(path, "rb") as f:
+        sys.stdout.buffer.write(f.read())
+    sys.exit(0)
+
+filename = args[args.index("--stdin-filename") + 1]
+if "--stdin-from-command" in args:
+    producer = subprocess.run(args[args.index("--") + 1 :], stdout=subprocess.PIPE)
+    if producer.returncode:
+        print(json.dumps({{"message_type": "error", "error": {{"message": "producer failed"}}}}))
+        sys.exit(1)
+    data = producer.stdout
+else:
+    data = sys.stdin.buffer.read()
+
+with open(os.path.join(os.environ["OUT"], filename), "wb") as f:
+    f.write(data)
+print(json.dumps({{"message_type": "status", "percent_done": 1}}))
+summary = {{"message_type": "summary", "total_bytes_processed": len(data), "snapshot_id": filename * 2}}
+print(json.dumps(summary))
+"""
+
+
+@pytest.fixture
+def restic(tmp_path, monkeypatch):
+    script = tmp_path / "restic"
+    script.write_text(FAKE_RESTIC.format(python=sys.executable))
+    script.chmod(0o755)
+    monkeypatch.setenv("OUT", str(tmp_path))
+    monkeypatch.setenv("URI", "/repo")
+    monkeypatch.setenv("HOST", "--host box")
+    return str(script)
+
+
+def test_command_producer(tmp_path, restic):
+    stream = StreamTarget("pg", "printf dump", filename="pg.dump", tags=["db"])
+    assert stream.restic_command(restic, from_command=True) == [
+        restic,
+        "--host",
+        "box",
+        "-r",
+        "/repo",
+        "backup",
+        "--json",
+        "--stdin-filename",
+        "pg.dump",
+        "--tag",
+        "stream",
+        "--tag",
+        "db",
+        "--stdin-from-command",
+        "--",
+        "sh",
+        "-c",
+        "printf dump",
+    ]
+
+    for from_command in (True, False):
+        result = run_stream(stream, restic, from_command=from_command)
+        assert result.ok, result.stdout
+        assert (result.snapshot, result.bytes) == ("pg.dumppg.dump", 4)
+        assert "snapshot pg.dumppg.dump saved" in result.stdout
+        assert (tmp_path / "pg.dump").read_text() == "dump"
+
+
+def test_failing_producers_create_no_snapshot(tmp_path, restic):
+    for from_command in (True, False):
+        result = run_stream(StreamTarget("pg", "printf partial; exit 3"), restic, from_command=from_command)
+        assert not result.ok
+        assert result.snapshot is None
+
+    # piped: restic is killed before it sees the end of the stream
+    assert not (tmp_path / "pg").exists()
+    assert "exited with 3" in result.stdout
+
+    def broken(out):
+        out.write(b"half")
+        raise RuntimeError("database went away")
+
+    result = run_stream(StreamTarget("export", broken), restic)
+    assert result.exited == 1
+    assert result.snapshot is None
+    assert "database went away" in result.stdout
+
+
+@pytest.mark.usefixtures("restic")
+def test_callable_producer_with_scripts(tmp_path, monkeypatch):
+    hooks = tmp_path / "captain-hooks"
+    hooks.mkdir()
+    (hooks / "streams.py").write_text(
+        "from src.edwh_restic_plugin.streams import StreamTarget\n"
+        "def export(out):\n"
+        "    out.write(b'{}' * 1000)\n"
+        "STREAMS = [StreamTarget('export', export, filename='export.json', timeout=5), StreamTarget('pg', 'true')]\n"
+    )
+    script = hooks / "backup_files.sh"
+    script.write_text("#!/bin/sh\necho snapshot files01 saved\n")
+    script.chmod(0o755)
+
+    assert [s.name for s in load_streams("stream_ex", hooks)] == ["export"]
+    assert load_streams("files", hooks) == []
+    # without a restore consumer, streams are left out of a restore:
+    assert load_streams("", hooks, verb="restore") == []
+    streams = load_streams("", hooks, default_timeout=60)
+    assert [s.timeout for s in streams] == [5, 60]
+
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    c = Context(Config(overrides={"run": {"in_stream": False}}))
+    results = HookRunner(c, workers=2).run([HookScript.from_path(script), streams[0]])
+    assert [result.ok for result in results] == [True, True]
+    assert results[1].bytes == 2000
+    assert results[1].throughput > 0
+    assert "snapshot export.jsonexport.json saved" in results[1].stdout
+
+
+def test_parse_fan_out_output():
+    output = (
+        '[local] restic backup: exit 0 (0.1s)\n[local] {"message_type": "summary", "snapshot_id": "aa"}\n'
+        "[sftp] restic backup: exit 1 (0.1s)\n[sftp] Fatal: unable to open repository\n"
+    )
+    summary, lines = parse_output(output)
+    assert summary["snapshot_id"] == "aa"
+    assert "[sftp] Fatal: unable to open repository" in lines
+
+
+def test_restore(tmp_path, restic, monkeypatch):
+    restored = tmp_path / "restored"
+    stream = StreamTarget("pg", "printf dump", filename="pg.dump", tags=["stream", "db"], restore=f"cat > {restored}")
+    assert stream.restic_command(restic).count("stream") == 1
+    assert stream.dump_command(restic, "abcd1234")[3:] == [
+        "-r",
+        "/repo",
+        "dump",
+        "--tag",
+        "stream",
+        "--path",
+        "/pg.dump",
+        "abcd1234",
+        "/pg.dump",
+    ]
+    assert run_stream(stream, restic, from_command=False).ok
+
+    # like scripts, restore streams get the snapshot from $SNAPSHOT:
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("SNAPSHOT", "abcd1234")
+    (result,) = HookRunner(Context(), verb="restore").run([stream])
+    assert result.ok, result.stdout
+    assert (restored.read_text(), result.bytes) == ("dump", 4)
+    assert (tmp_path / "dump.log").read_text().split()[-2:] == ["abcd1234", "/pg.dump"]
+
+    received = []
+    result = run_restore(dataclasses.replace(stream, restore=lambda source: received.append(source.read())), "latest")
+    assert result.ok, result.stdout
+    assert received == [b"dump"]
+
+    # a failing consumer, or nothing to dump, fails the restore:
+    assert run_restore(dataclasses.replace(stream, restore="cat > /dev/null; exit 2"), restic=restic).exited == 2
+    result = run_restore(StreamTarget("other", "true", restore="cat"), restic=restic)
+    assert not result.ok
+    assert "no matching snapshot" in result.stdout
@@ -0,0 +1,143 @@
+import json
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from invoke import Config, Context, MockContext, Result
+from invoke.exceptions import UnexpectedExit
+
+from src.edwh_restic_plugin import tasks, tracing
+from src.edwh_restic_plugin.hooks import HookRunner, HookScript
+
+ANY = re.compile(".*")
+
+
+def attributes(span: dict) -> dict:
+    return {item["key"]: next(iter(item["value"].values())) for item in span["attributes"]}
+
+
+def read_spans(path) -> dict[str, dict]:
+    (request,) = [json.loads(line) for line in path.read_text().splitlines()]
+    (resource,) = request["resourceSpans"]
+    assert {"key": "service.name", "value": {"stringValue": "edwh-restic-plugin"}} in resource["resource"]["attributes"]
+    return {span["name"]: span for span in resource["scopeSpans"][0]["spans"]}
+
+
+def test_off_by_default(monkeypatch):
+    monkeypatch.delenv(tracing.TRACE_ENV, raising=False)
+    assert tracing.span("anything") is tracing.NOOP
+
+    c = MockContext(run={ANY: Result("ok")}, repeat=True)
+    assert tracing.run(c, "restic snapshots").stdout == "ok"
+    assert tracing.current() is None
+
+
+def test_nested_spans(tmp_path, monkeypatch):
+    trace_file = tmp_path / "trace.jsonl"
+    monkeypatch.setenv(tracing.TRACE_ENV, str(trace_file))
+
+    # `restic check` fails, everything else prints an empty list:
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "restic").write_text('#!/bin/sh\ncase "$*" in *check*) exit 1;; esac\necho "[]"\n')
+    (bin_dir / "restic").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    hooks = tmp_path / "captain-hooks"
+    hooks.mkdir()
+    for name, code in (("backup_files.sh", 0), ("backup_stream.sh", 3)):
+        (hooks / name).write_text(f'#!/bin/sh\necho "$TRACEPARENT"\nexit {code}\n')
+        (hooks / name).chmod(0o755)
+    scripts = [HookScript.from_path(hooks / name) for name in ("backup_files.sh", "backup_stream.sh")]
+
+    @tracing.traced("task.example")
+    def example(c, parallel: int = 1):
+        tracing.run(c, "restic -r /tmp/repo snapshots --json", hide=True)
+        with pytest.raises(UnexpectedExit):
+            tracing.run(c, "restic -r /tmp/repo check", hide=True)
+        return HookRunner(c, workers=parallel).run(scripts)
+
+    c = Context(Config(overrides={"run": {"in_stream": False}}))
+    results = example(c, parallel=2)
+    assert [result.exited for result in results] == [0, 3]
+
+    spans = read_spans(trace_file)
+    assert set(spans) == {
+        "task.example",
+        "restic snapshots",
+        "restic check",
+        "script backup_files.sh",
+        "script backup_stream.sh",
+    }
+    root = spans["task.example"]
+    assert root["parentSpanId"] == ""
+    assert attributes(root)["arg.parallel"] == "2"
+    # also the scripts that ran in worker threads:
+    assert all(span["parentSpanId"] == root["spanId"] for name, span in spans.items() if name != "task.example")
+    assert len({span["traceId"] for span in spans.values()}) == 1
+
+    failing = spans["script backup_stream.sh"]
+    assert attributes(failing)["exit_code"] == "3"
+    assert failing["status"]["code"] == tracing.STATUS_ERROR
+    assert int(failing["endTimeUnixNano"]) >= int(failing["startTimeUnixNano"])
+    # the script got the W3C trace context of its own span:
+    assert results[1].stdout.strip() == f"00-{failing['traceId']}-{failing['spanId']}-01"
+    assert attributes(failing)["stdout_bytes"] == str(len(results[1].stdout.encode()))
+
+    assert spans["restic check"]["status"]["code"] == tracing.STATUS_ERROR
+    assert attributes(spans["restic snapshots"])["command"] == "restic -r /tmp/repo snapshots --json"
+
+
+def test_exit_code_of_task(tmp_path, monkeypatch):
+    trace_file = tmp_path / "trace.jsonl"
+    monkeypatch.setenv(tracing.TRACE_ENV, str(trace_file))
+
+    with pytest.raises(SystemExit), tracing.span("task.failing"):
+        exit(2)
+
+    span = read_spans(trace_file)["task.failing"]
+    assert attributes(span)["exit_code"] == "2"
+    assert span["status"] == {"code": tracing.STATUS_ERROR, "message": "exit 2"}
+
+
+def test_export_to_collector(monkeypatch):
+    received = []
+
+    class Collector(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.append((self.path, json.loads(self.rfile.read(int(self.headers["Content-Length"])))))
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *_):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Collector)
+    thread = threading.Thread(target=server.handle_request)
+    thread.start()
+    monkeypatch.setenv(tracing.TRACE_ENV, f"http://127.0.0.1:{server.server_port}")
+
+    with tracing.span("task.snapshots"):
+        pass
+
+    thread.join(timeout=5)
+    server.server_close()
+    ((path, request),) = received
+    assert path == "/v1/traces"
+    assert request["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["name"] == "task.snapshots"
+
+
+def test_unreachable_collector_is_not_fatal(monkeypatch, capsys):
+    monkeypatch.setenv(tracing.TRACE_ENV, "http://127.0.0.1:9")
+    with tracing.span("task.snapshots"):
+        pass
+    assert "could not export trace" in capsys.readouterr().err
+
+
+def test_tasks_keep_their_arguments():
+    assert tasks.backup.body.__wrapped__
+    assert "parallel" in tasks.backup.argspec(tasks.backup.body).parameters
+    assert tracing.command_name("/usr/bin/restic -r s3:x --host h forget --prune") == "restic forget"
+    assert tracing.command_name("rclone lsf remote:") == "rclone lsf"